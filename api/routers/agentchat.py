@@ -4,8 +4,7 @@ from pydantic import BaseModel
 
 import openai
 
-from autogen.oai import OpenAIWrapper
-from autogen import ConversableAgent
+from utils.lazy_imports import get_autogen
 
 from typing import List, Dict, Literal, Any
 
@@ -45,6 +44,7 @@ async def create_function_call_agent_response(
     all_tools = TO_TOOLS
     selected_tools = dict_filter(all_tools, tools)
 
+    ConversableAgent = get_autogen().ConversableAgent
     assistant = ConversableAgent(
         name="Assistant",
         system_message="You are a helpful AI assistant. "
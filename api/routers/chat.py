@@ -6,7 +6,7 @@ from io import StringIO
 
 from openai import OpenAI
 
-from autogen.oai import OpenAIWrapper
+from utils.lazy_imports import get_autogen_oai
 
 from typing import List, Dict, Literal, Optional
 
@@ -75,7 +75,7 @@ async def create_completion(
     # 如果 Source 在 sources 中为 "request"，则使用 Request 进行处理
 
     if support_sources["sources"][source] == "sdk":
-        client = OpenAIWrapper(
+        client = get_autogen_oai().OpenAIWrapper(
             **llm_config.dict(exclude_unset=True),
             # 禁用缓存
             cache = None,
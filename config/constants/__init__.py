@@ -1,8 +1,10 @@
 from .app import VERSION
 from .i18n import SUPPORTED_LANGUAGES, I18N_DIR
-from .paths import LOGO_DIR, KNOWLEDGE_BASE_DIR, EMBEDDING_OPTIONS_FILE_PATH
+from .paths import LOGO_DIR, KNOWLEDGE_BASE_DIR, EMBEDDING_OPTIONS_FILE_PATH, WHISPER_MODEL_DIR
 from .chat import (
     DEFAULT_DIALOG_TITLE,
+    DEFAULT_HISTORY_TOKEN_BUDGET,
+    WHISPER_MODELS,
     USER_AVATAR_SVG,
     AI_AVATAR_SVG,
 )
@@ -10,11 +12,19 @@ from .prompts import (
     DEFAULT_SYSTEM_PROMPT, 
     ANSWER_USER_WITH_TOOLS_SYSTEM_PROMPT,
     SUMMARY_PROMPT,
+    CONVERSATION_SUMMARY_PROMPT,
 )
 from .databases import (
     CHAT_HISTORY_DIR,
     CHAT_HISTORY_DB_FILE,
     CHAT_HISTORY_DB_TABLE,
+    IMAGE_BLOB_DIR,
+    PARSE_CACHE_DIR,
+    CRAWL_STATE_DIR,
+    KNOWLEDGE_GRAPH_DIR,
+    KNOWLEDGE_GRAPH_FILE,
+    KNOWLEDGE_GRAPH_INDEX_FILE,
+    GRAPH_EXTRACTION_CACHE_DIR,
     DYNAMIC_CONFIGS_DIR,
     OPENAI_LIKE_MODEL_CONFIG_FILE_PATH,
     EMBEDDING_DIR,
@@ -33,12 +43,22 @@ __all__ = [
     'LOGO_DIR',
     'KNOWLEDGE_BASE_DIR',
     'EMBEDDING_OPTIONS_FILE_PATH',
+    'WHISPER_MODEL_DIR',
     'DEFAULT_DIALOG_TITLE',
+    'DEFAULT_HISTORY_TOKEN_BUDGET',
+    'WHISPER_MODELS',
     'DEFAULT_SYSTEM_PROMPT',
     'ANSWER_USER_WITH_TOOLS_SYSTEM_PROMPT',
     'CHAT_HISTORY_DIR',
     'CHAT_HISTORY_DB_FILE', 
     'CHAT_HISTORY_DB_TABLE',
+    'IMAGE_BLOB_DIR',
+    'PARSE_CACHE_DIR',
+    'CRAWL_STATE_DIR',
+    'KNOWLEDGE_GRAPH_DIR',
+    'KNOWLEDGE_GRAPH_FILE',
+    'KNOWLEDGE_GRAPH_INDEX_FILE',
+    'GRAPH_EXTRACTION_CACHE_DIR',
     'DYNAMIC_CONFIGS_DIR',
     'OPENAI_LIKE_MODEL_CONFIG_FILE_PATH',
     'EMBEDDING_DIR',
@@ -49,6 +69,7 @@ __all__ = [
     'OPENAI_LIKE_CONFIGS_DB_FILE',
     'OPENAI_LIKE_CONFIGS_DB_TABLE',
     'SUMMARY_PROMPT',
+    'CONVERSATION_SUMMARY_PROMPT',
     'USER_AVATAR_SVG',
     'AI_AVATAR_SVG',
 ]
\ No newline at end of file
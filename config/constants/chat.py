@@ -1,5 +1,12 @@
 # 聊天相关常量
 DEFAULT_DIALOG_TITLE = "New dialog"
+# 默认发送给模型的系统提示词与历史消息的 token 上限
+DEFAULT_HISTORY_TOKEN_BUDGET = 16000
+# openai-whisper 提供的语音识别模型，与 `whisper.available_models()` 一致，列出模型时不必导入 whisper（及 torch）
+WHISPER_MODELS = [
+    "tiny.en", "tiny", "base.en", "base", "small.en", "small",
+    "medium.en", "medium", "large-v1", "large-v2", "large-v3", "large",
+]
 
 USER_AVATAR_SVG = """
     <svg xmlns="http://www.w3.org/2000/svg" class="icon icon-tabler icon-tabler-user-square" width="44" height="44" viewBox="0 0 24 24" stroke-width="1.5" stroke="#1455ea" fill="none" stroke-linecap="round" stroke-linejoin="round">
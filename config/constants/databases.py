@@ -23,6 +23,16 @@ CHAT_HISTORY_DIR = os.path.join(DATABASE_DIR, "chat_history")
 KNOWLEDGE_BASE_DIR = os.path.join(DATABASE_DIR, "knowledgebase")
 # 嵌入模型目录
 EMBEDDING_DIR = os.path.join(ROOT_DIR, "embeddings")
+# 知识库导入时文件解析结果的缓存目录
+PARSE_CACHE_DIR = os.path.join(DATABASE_DIR, "parse_cache")
+# 网页抓取的 ETag/Last-Modified 记录，用于条件请求，每个知识库一个文件
+CRAWL_STATE_DIR = os.path.join(DATABASE_DIR, "crawl_state")
+# 知识图谱目录：图谱文件与 LLM 抽取结果的缓存
+KNOWLEDGE_GRAPH_DIR = os.path.join(DATABASE_DIR, "knowledge_graph")
+KNOWLEDGE_GRAPH_FILE = os.path.join(KNOWLEDGE_GRAPH_DIR, "graph.json")
+# 检索用的实体倒排索引与邻接表
+KNOWLEDGE_GRAPH_INDEX_FILE = os.path.join(KNOWLEDGE_GRAPH_DIR, "graph_index.db")
+GRAPH_EXTRACTION_CACHE_DIR = os.path.join(KNOWLEDGE_GRAPH_DIR, "extraction_cache")
 
 # 配置目录
 OPENAI_LIKE_CONFIGS_BASE_DIR = os.path.join(DATABASE_DIR, "openai_like_configs")
@@ -30,6 +40,8 @@ OPENAI_LIKE_CONFIGS_DB_FILE = os.path.join(OPENAI_LIKE_CONFIGS_BASE_DIR, "openai
 
 # 聊天记录数据库文件
 CHAT_HISTORY_DB_FILE = os.path.join(CHAT_HISTORY_DIR, "chat_history.db")
+# 聊天中图片等二进制内容的存储目录
+IMAGE_BLOB_DIR = os.path.join(CHAT_HISTORY_DIR, "blobs")
 # 聊天记录表名称
 CHAT_HISTORY_DB_TABLE = "chatbot_chat_history"
 # RAG聊天记录表名称
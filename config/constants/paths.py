@@ -17,6 +17,8 @@ IMAGES_DIR = os.path.join(ASSETS_DIR, "images")
 STYLES_DIR = os.path.join(ASSETS_DIR, "styles")
 LOCALE_DIR = os.path.join(ASSETS_DIR, "locale")
 LOG_DIR = os.path.join(ROOT_DIR, "log")
+# 语音识别（Whisper）模型的下载目录
+WHISPER_MODEL_DIR = os.path.join(ROOT_DIR, "tts_models")
 
 # 各资源类型
 LOGO_DIR = os.path.join(IMAGES_DIR, "logos")
@@ -23,3 +23,17 @@ Please summarize the conversation history in a concise manner.
 
 The conversation history is as follows:
 """
+
+CONVERSATION_SUMMARY_PROMPT = """
+You are an intelligent assistant that maintains a running summary of a long conversation.
+
+You will be given the current summary (it may be empty) and the messages that followed it.
+Update the summary so that it covers both.
+
+**Rules:**
+
+1. Keep facts, decisions, names, numbers, open questions and the user's preferences and goals.
+2. Leave out greetings, filler and anything that was later corrected.
+3. Write in the user's language, in plain prose or short bullet points, without any preamble.
+4. Keep the summary under 300 words.
+"""
@@ -2,42 +2,83 @@ import os
 import json
 import logging
 import locale
+import threading
 import streamlit as st
 
-from typing import Literal
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Literal, Mapping, Tuple
+
+
+# 文件路径 -> (mtime, 大小, 内容)，进程内所有页面与会话共享
+_CATALOGS: Dict[str, Tuple[int, int, Mapping[str, str]]] = {}
+_CATALOG_LOCK = threading.Lock()
+_EMPTY_CATALOG: Mapping[str, str] = MappingProxyType({})
+
+
+def load_json_cached(path: str) -> Mapping[str, str]:
+    """
+    读取语言文件（或 config.json），文件未修改时直接返回缓存的内容
+
+    Streamlit 每次交互都会重新执行页面，各页面与模块在导入时创建 `I18nAuto`，
+    缓存后每次只需一次 `os.stat`，不再重复解析 JSON。返回的内容只读，可以在线程间共享。
+
+    Args:
+        path: JSON 文件路径
+    """
+    stat = os.stat(path)
+    cached = _CATALOGS.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with _CATALOG_LOCK:
+        cached = _CATALOGS.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(path, "r", encoding="utf-8") as f:
+            catalog = MappingProxyType(json.load(f))
+        _CATALOGS[path] = (stat.st_mtime_ns, stat.st_size, catalog)
+        return catalog
+
+
+def _config_language(kwargs: dict) -> str:
+    config_path = "config.json"
+    if os.path.exists(config_path):
+        config = load_json_cached(os.path.abspath(config_path))
+    elif "language" in kwargs:
+        config = {"language": kwargs["language"]}
+    else:
+        config = {}
+    language = config.get("language", "auto")
+    language = language.replace("-", "_")
+    if language == "auto":
+        language = locale.getdefaultlocale()[0] # get the language code of the system (ex. zh_CN)
+    return language
+
+
+@lru_cache(maxsize=None)
+def _warn_missing_language(i18n_dir: str, language: str) -> None:
+    # 每种语言只提示一次，而不是每次重新执行页面时都提示
+    logging.warning(
+        f"Language file for {language} does not exist. Using English instead."
+    )
+    logging.warning(
+        f"Available languages: {', '.join([x[:-5] for x in os.listdir(i18n_dir)])}"
+    )
 
 
 class I18nAuto:
     def __init__(self, i18n_dir: str, **kwargs):
-        if os.path.exists("config.json"):
-            with open("config.json", "r", encoding="utf-8") as f:
-                config = json.load(f)
-        elif "language" in kwargs:
-            config = {"language": kwargs["language"]}
-        else:
-            config = {}
-        language = config.get("language", "auto")
-        language = language.replace("-", "_")
-        if language == "auto":
-            language = locale.getdefaultlocale()[0] # get the language code of the system (ex. zh_CN)
-        self.language_map = {}
-        self.file_is_exists = os.path.isfile(os.path.join(i18n_dir, f"{language}.json"))
+        language = _config_language(kwargs)
+        path = os.path.join(i18n_dir, f"{language}.json")
+        self.file_is_exists = os.path.isfile(path)
         if self.file_is_exists:
-            with open(os.path.join(i18n_dir, f"{language}.json"), "r", encoding="utf-8") as f:
-                self.language_map.update(json.load(f))
+            self.language_map = load_json_cached(path)
         else:
-            logging.warning(
-                f"Language file for {language} does not exist. Using English instead."
-            )
-            logging.warning(
-                f"Available languages: {', '.join([x[:-5] for x in os.listdir(i18n_dir)])}"
-            )
-            with open(os.path.join(i18n_dir, "en_US.json"), "r", encoding="utf-8") as f:
-                self.language_map.update(json.load(f))
+            _warn_missing_language(i18n_dir, language)
+            # 没有对应的语言文件时原样返回键（即英文）
+            self.language_map = _EMPTY_CATALOG
+        # 预先绑定查表函数，翻译时只需一次字典查找
+        self._lookup = self.language_map.get
 
     def __call__(self, key):
-        if self.file_is_exists and key in self.language_map:
-            return self.language_map[key]
-        else:
-            return key
-
+        return self._lookup(key, key)
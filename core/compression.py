@@ -0,0 +1,91 @@
+import os
+import zlib
+from typing import Dict, Literal, Optional, Tuple
+from loguru import logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CompressionCodec = Literal["none", "zlib", "zstd"]
+
+# Codec bytes, stored in front of compressed payloads
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_IDS: Dict[str, int] = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+
+def default_codec() -> CompressionCodec:
+    """
+    默认压缩方式：环境变量 `STORAGE_COMPRESSION`，未设置时安装了 zstandard 则用 zstd，否则用 zlib
+    """
+    codec = os.getenv("STORAGE_COMPRESSION") or ("zstd" if zstandard is not None else "zlib")
+    return resolve_codec(codec)
+
+
+def resolve_codec(codec: str) -> CompressionCodec:
+    """校验压缩方式，zstandard 未安装时 zstd 回退到 zlib"""
+    if codec not in CODEC_IDS:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    if codec == "zstd" and zstandard is None:
+        logger.warning("`zstandard` not installed, falling back to zlib compression")
+        return "zlib"
+    return codec
+
+
+def compress(
+    data: bytes,
+    codec: CompressionCodec,
+    zstd_dict: Optional["zstandard.ZstdCompressionDict"] = None,
+) -> Tuple[int, bytes]:
+    """
+    压缩数据，压缩后没有变小时返回原始数据
+
+    Args:
+        data: 原始数据
+        codec: 压缩方式
+        zstd_dict: 可选的 zstd 字典，只在 codec 为 zstd 时使用
+
+    Returns:
+        Tuple[int, bytes]: 实际使用的 codec 字节与压缩后的数据
+    """
+    if codec == "none":
+        return CODEC_NONE, data
+    if codec == "zstd":
+        compressed = zstandard.ZstdCompressor(level=3, dict_data=zstd_dict).compress(data)
+    else:
+        compressed = zlib.compress(data, 1)
+    if len(compressed) >= len(data):
+        return CODEC_NONE, data
+    return CODEC_IDS[codec], compressed
+
+
+def decompress(
+    codec_id: int,
+    data: bytes,
+    zstd_dicts: Optional[Dict[int, "zstandard.ZstdCompressionDict"]] = None,
+) -> bytes:
+    """
+    解压 `compress` 的结果，zstd 数据帧中记录了字典 ID，会从 zstd_dicts 中查找对应字典
+
+    Args:
+        codec_id: codec 字节
+        data: 压缩后的数据
+        zstd_dicts: 字典 ID 到 zstd 字典的映射
+    """
+    if codec_id == CODEC_NONE:
+        return data
+    if codec_id == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec_id == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError("`zstandard` is required to read zstd compressed data: pip install zstandard")
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        dict_data = (zstd_dicts or {}).get(dict_id) if dict_id else None
+        if dict_id and dict_data is None:
+            raise ValueError(f"Missing zstd dictionary {dict_id}")
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+    raise ValueError(f"Unknown codec byte: {codec_id}")
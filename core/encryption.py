@@ -1,44 +1,67 @@
 import os
 import base64
-from cryptography.fernet import Fernet
+import binascii
+import hashlib
+from typing import List, Literal, Optional, Union
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from loguru import logger
 
 from core.strategy import EncryptorStrategy
+from core.compression import (
+    CODEC_IDS,
+    compress,
+    decompress,
+    resolve_codec,
+    zstandard,
+)
+
+
+def load_encryption_key(key: Optional[Union[str, bytes]] = None) -> bytes:
+    """
+    获取 Fernet 格式的主密钥
+
+    优先使用传入的密钥，其次是环境变量 `ENCRYPTION_KEY`，再次是 encryption_key.txt，
+    都没有时生成新密钥并保存到 encryption_key.txt。
+    """
+    if key is None:
+        key = os.getenv("ENCRYPTION_KEY")
+        if key:
+            try:
+                # 尝试使用环境变量中的密钥
+                Fernet(key.encode() if isinstance(key, str) else key)
+            except ValueError:
+                # 如果环境变量中的密钥不合法，生成新密钥
+                logger.warning(
+                    "Invalid `ENCRYPTION_KEY` in environment variable, generating a new key."
+                )
+                key = None
+
+        if not key:
+            # 如果没有合法的环境变量密钥，尝试从文件读取或生成新密钥
+            if os.path.exists("encryption_key.txt"):
+                with open("encryption_key.txt", "r") as f:
+                    key = f.read().encode()
+            else:
+                key = Fernet.generate_key()
+                logger.warning(
+                    "Generating a new encryption key."
+                )
+            # 将密钥保存到文件中（无论是读取还是新生成的）
+            with open("encryption_key.txt", "w") as f:
+                f.write(key.decode() if isinstance(key, bytes) else key)
+
+    # 确保最终的key是bytes类型
+    if isinstance(key, str):
+        key = key.encode()
+    return key
 
 
 class FernetEncryptor(EncryptorStrategy):
     def __init__(self, key=None):
-        if key is None:
-            key = os.getenv("ENCRYPTION_KEY")
-            if key:
-                try:
-                    # 尝试使用环境变量中的密钥
-                    Fernet(key.encode() if isinstance(key, str) else key)
-                except ValueError:
-                    # 如果环境变量中的密钥不合法，生成新密钥
-                    logger.warning(
-                        "Invalid `ENCRYPTION_KEY` in environment variable, generating a new key."
-                    )
-                    key = None
-            
-            if not key:
-                # 如果没有合法的环境变量密钥，尝试从文件读取或生成新密钥
-                if os.path.exists("encryption_key.txt"):
-                    with open("encryption_key.txt", "r") as f:
-                        key = f.read().encode()
-                else:
-                    key = Fernet.generate_key()
-                    logger.warning(
-                        "Generating a new encryption key."
-                    )
-                # 将密钥保存到文件中（无论是读取还是新生成的）
-                with open("encryption_key.txt", "w") as f:
-                    f.write(key.decode() if isinstance(key, bytes) else key)
-        
-        # 确保最终的key是bytes类型
-        if isinstance(key, str):
-            key = key.encode()
-        self.cipher_suite = Fernet(key)
+        self.cipher_suite = Fernet(load_encryption_key(key))
 
     def encrypt(self, data: str) -> str:
         return base64.urlsafe_b64encode(
@@ -49,3 +72,145 @@ class FernetEncryptor(EncryptorStrategy):
         return self.cipher_suite.decrypt(
             base64.urlsafe_b64decode(encrypted_data)
         ).decode()
+
+
+class EnvelopeEncryptor(EncryptorStrategy):
+    """
+    版本化的 AES-GCM 加密信封：`v2$<key_id>$<codec>$<base64(nonce + ciphertext)>`
+
+    - 只做一次 base64 编码，相比 `FernetEncryptor` 的双重编码体积更小、速度更快
+    - codec 标记明文是否经过压缩：`n` 不压缩，`z` zlib，`s` zstd
+    - 支持密钥轮换：用第一个密钥加密，用 key_id 对应的密钥解密
+    - 兼容读取 `FernetEncryptor` 写入的旧数据
+    """
+
+    VERSION = "v2"
+    _CODECS = {"none": "n", "zlib": "z", "zstd": "s"}
+    _CODEC_CHARS = {CODEC_IDS[name]: char for name, char in _CODECS.items()}
+    _CODEC_IDS = {char: CODEC_IDS[name] for name, char in _CODECS.items()}
+
+    def __init__(
+        self,
+        keys: Optional[List[Union[str, bytes]]] = None,
+        compression: Optional[Literal["none", "zlib", "zstd"]] = None,
+        min_compress_size: int = 512,
+    ):
+        """
+        Args:
+            keys: Fernet 格式的密钥列表，第一个用于加密，其余只用于解密旧数据。
+                为 None 时读取环境变量 `ENCRYPTION_KEYS`（逗号分隔），否则使用 `load_encryption_key`。
+            compression: 明文压缩方式，为 None 时读取环境变量 `ENCRYPTION_COMPRESSION`，默认 zlib。
+            min_compress_size: 小于该字节数的明文不压缩。
+        """
+        if keys is None:
+            env_keys = os.getenv("ENCRYPTION_KEYS")
+            keys = [k.strip() for k in env_keys.split(",") if k.strip()] if env_keys else [load_encryption_key()]
+        fernet_keys = [k.encode() if isinstance(k, str) else k for k in keys]
+        if not fernet_keys:
+            raise ValueError("At least one encryption key is required")
+
+        self._ciphers = {self._key_id(k): AESGCM(self._derive_key(k)) for k in fernet_keys}
+        self._primary_key_id = self._key_id(fernet_keys[0])
+        self._legacy_cipher = MultiFernet([Fernet(k) for k in fernet_keys])
+
+        self._compression = resolve_codec(compression or os.getenv("ENCRYPTION_COMPRESSION", "zlib"))
+        self._min_compress_size = min_compress_size
+
+    @staticmethod
+    def _key_id(fernet_key: bytes) -> str:
+        return hashlib.sha256(fernet_key).hexdigest()[:8]
+
+    @staticmethod
+    def _derive_key(fernet_key: bytes) -> bytes:
+        """从 Fernet 密钥派生 256 位 AES 密钥，因此原有的密钥文件可以直接使用"""
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b"ragent-envelope-aes-gcm-v2",
+        ).derive(base64.urlsafe_b64decode(fernet_key))
+
+    def _compress(self, data: bytes) -> tuple:
+        if len(data) < self._min_compress_size:
+            return "n", data
+        codec_id, compressed = compress(data, self._compression)
+        return self._CODEC_CHARS[codec_id], compressed
+
+    def _decompress(self, codec: str, data: bytes) -> bytes:
+        if codec not in self._CODEC_IDS:
+            raise ValueError(f"Unknown codec: {codec}")
+        return decompress(self._CODEC_IDS[codec], data)
+
+    def encrypt(self, data: str) -> str:
+        codec, payload = self._compress(data.encode())
+        nonce = os.urandom(12)
+        aad = f"{self.VERSION}${self._primary_key_id}${codec}".encode()
+        ciphertext = self._ciphers[self._primary_key_id].encrypt(nonce, payload, aad)
+        return f"{aad.decode()}${base64.urlsafe_b64encode(nonce + ciphertext).decode()}"
+
+    def decrypt(self, encrypted_data: str) -> str:
+        if not self.is_envelope(encrypted_data):
+            return self._decrypt_legacy(encrypted_data)
+
+        version, key_id, codec, body = encrypted_data.split("$", 3)
+        cipher = self._ciphers.get(key_id)
+        if cipher is None:
+            raise ValueError(f"No encryption key available for key id {key_id}")
+        raw = base64.urlsafe_b64decode(body)
+        payload = cipher.decrypt(raw[:12], raw[12:], f"{version}${key_id}${codec}".encode())
+        return self._decompress(codec, payload).decode()
+
+    def _decrypt_legacy(self, encrypted_data: str) -> str:
+        """解密 `FernetEncryptor` 写入的双重 base64 数据，以及未二次编码的 Fernet token"""
+        try:
+            return self._legacy_cipher.decrypt(base64.urlsafe_b64decode(encrypted_data)).decode()
+        except (InvalidToken, binascii.Error, ValueError):
+            return self._legacy_cipher.decrypt(encrypted_data.encode()).decode()
+
+    @classmethod
+    def is_envelope(cls, encrypted_data: str) -> bool:
+        return isinstance(encrypted_data, str) and encrypted_data.startswith(f"{cls.VERSION}$")
+
+    def needs_reencryption(self, encrypted_data: str) -> bool:
+        """数据是否为旧格式或由非主密钥加密，需要重新加密"""
+        if not self.is_envelope(encrypted_data):
+            return True
+        return encrypted_data.split("$", 2)[1] != self._primary_key_id
+
+
+if __name__ == "__main__":
+    # 微基准：比较旧的 Fernet 双重编码与新的加密信封的体积和速度
+    import json
+    import time
+
+    key = Fernet.generate_key()
+    message = {
+        "role": "assistant",
+        "content": "RAGENT stores every chat message encrypted in SQLite. " * 40,
+        "created_at": "2025-01-01T00:00:00",
+    }
+    payload = json.dumps({"chat_history": [message] * 50})
+    size_kb = len(payload.encode()) / 1024
+    rounds = 50
+
+    encryptors = {
+        "fernet (legacy)": FernetEncryptor(key),
+        "envelope": EnvelopeEncryptor([key], compression="none"),
+        "envelope+zlib": EnvelopeEncryptor([key], compression="zlib"),
+    }
+    if zstandard is not None:
+        encryptors["envelope+zstd"] = EnvelopeEncryptor([key], compression="zstd")
+
+    print(f"payload: {size_kb:.1f} KB JSON, {rounds} rounds")
+    print(f"{'scheme':<18}{'bytes ratio':>12}{'enc us/KB':>12}{'dec us/KB':>12}")
+    for name, encryptor in encryptors.items():
+        start = time.perf_counter()
+        for _ in range(rounds):
+            token = encryptor.encrypt(payload)
+        encrypt_us = (time.perf_counter() - start) / rounds / size_kb * 1e6
+        start = time.perf_counter()
+        for _ in range(rounds):
+            assert encryptor.decrypt(token) == payload
+        decrypt_us = (time.perf_counter() - start) / rounds / size_kb * 1e6
+        ratio = len(token) / len(payload.encode())
+        print(f"{name:<18}{ratio:>12.2f}{encrypt_us:>12.1f}{decrypt_us:>12.1f}")
@@ -29,6 +29,8 @@ class BaseMessage(BaseModel, ABC):
     role: Literal["user", "assistant", "system"]
     content: str
     reasoning_content: Optional[str] = None
+    # Cached token count of the message, filled in by `TokenCounter` and stored with the history
+    token_count: Optional[int] = None
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
     updated_at: Optional[datetime] = Field(default_factory=datetime.now)
     
@@ -40,7 +42,7 @@ class BaseMessage(BaseModel, ABC):
     @property
     def sensitive_fields(self) -> Set[str]:
         """需要特殊处理的敏感字段"""
-        return {'created_at', 'updated_at', 'reasoning_content'}
+        return {'created_at', 'updated_at', 'reasoning_content', 'token_count'}
     
     def to_dict(self, mode: SerializationMode = SerializationMode.FULL) -> Dict[str, Any]:
         """转换消息为字典，根据不同模式选择性地排除字段
@@ -54,7 +56,7 @@ class BaseMessage(BaseModel, ABC):
         exclude = set()
         
         if mode == SerializationMode.MODEL:
-            exclude.update({'created_at', 'updated_at', 'reasoning_content'})
+            exclude.update({'created_at', 'updated_at', 'reasoning_content', 'token_count'})
         elif mode == SerializationMode.STORAGE:
             pass
         elif mode == SerializationMode.EXPORT:
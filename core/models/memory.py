@@ -109,4 +109,19 @@ class AssistantRun(BaseModel):
         _dict = self.model_dump(exclude={"created_at", "updated_at", "task_data"})
         _dict["created_at"] = self.created_at.isoformat() if self.created_at else None
         _dict["updated_at"] = self.updated_at.isoformat() if self.updated_at else None
-        return _dict
\ No newline at end of file
+        return _dict
+
+
+class AssistantRunSummary(BaseModel):
+    """Lightweight projection of an assistant run, used to list dialogs without loading their data"""
+
+    run_id: str
+    """Run UUID"""
+    run_name: Optional[str] = None
+    """Run name"""
+    created_at: Optional[datetime] = None
+    """The timestamp of when this run was created"""
+    updated_at: Optional[datetime] = None
+    """The timestamp of when this run was last updated"""
+
+    model_config = ConfigDict(from_attributes=True)
@@ -1,17 +1,38 @@
-from typing import TypeVar
+import importlib
+from typing import TYPE_CHECKING, TypeVar
 
 from .chat.classic import ChatProcessor
-from .chat.rag import RAGChatProcessor
 from .config.llm import OAILikeConfigProcessor
 from .dialog.dialog_processors import (
     BaseDialogProcessor,
-    ClassicChatDialogProcessor, 
+    ClassicChatDialogProcessor,
     RAGChatDialogProcessor
 )
-from .vector.chroma.kb_processors import (
-    ChromaVectorStoreProcessorWithNoApi,
-    ChromaCollectionProcessorWithNoApi,
-)
+
+if TYPE_CHECKING:
+    from .chat.rag import RAGChatProcessor
+    from .vector.chroma.kb_processors import (
+        ChromaVectorStoreProcessorWithNoApi,
+        ChromaCollectionProcessorWithNoApi,
+    )
+
+# RAG 与知识库处理器依赖 chromadb、sentence_transformers 等，只在第一次访问时导入，
+# 不使用它们的页面（如 Classic Chat）不必等待这些依赖加载
+_LAZY_PROCESSORS = {
+    'RAGChatProcessor': '.chat.rag',
+    'ChromaVectorStoreProcessorWithNoApi': '.vector.chroma.kb_processors',
+    'ChromaCollectionProcessorWithNoApi': '.vector.chroma.kb_processors',
+}
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_PROCESSORS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
 
 ALLDIAGLOGPROCESSOR = TypeVar('ALLDIAGLOGPROCESSOR', bound=BaseDialogProcessor)
 
@@ -25,7 +25,7 @@ from core.strategy import (
     CozeChatProcessStrategy
 )
 from core.strategy import EncryptorStrategy
-from core.encryption import FernetEncryptor
+from core.encryption import EnvelopeEncryptor
 from utils.tool_utils import create_tools_call_completion
 from utils.log.logger_config import setup_logger, get_load_balance_logger
 
@@ -458,9 +458,9 @@ class OAILikeConfigProcessor(OpenAILikeModelConfigProcessStrategy):
     def __init__(self, encryptor: EncryptorStrategy = None):
         """
         Args:
-            encryptor (EncryptorStrategy, optional): Defaults to None. If not provided, a new FernetEncryptor will be created.
+            encryptor (EncryptorStrategy, optional): Defaults to None. If not provided, a new EnvelopeEncryptor will be created.
         """
-        self.encryptor = encryptor or FernetEncryptor()
+        self.encryptor = encryptor or EnvelopeEncryptor()
         # 如果本地没有custom_model_config.json文件，则创建文件夹及文件
         if not os.path.exists(self.config_path):
             os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
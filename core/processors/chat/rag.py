@@ -67,6 +67,7 @@ class RAGChatProcessor(RAGChatProcessStrategy):
         is_hybrid_retrieve: bool = False,
         hybrid_retriever_weight: float = 0.5,
         selected_file: Optional[str] = None,
+        summary: Optional[str] = None,
     ) -> BaseRAGResponse:
         # 处理messages
         context_messages, user_prompt = self._parse_messages(messages)
@@ -175,5 +176,5 @@ class RAGChatProcessor(RAGChatProcessStrategy):
             .build()
         )
 
-        response = rag.invoke(query=user_prompt, stream=stream)
+        response = rag.invoke(query=user_prompt, stream=stream, summary=summary)
         return response
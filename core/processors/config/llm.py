@@ -4,7 +4,7 @@ import uuid
 from typing import Dict, List, Optional
 from config.constants import OPENAI_LIKE_MODEL_CONFIG_FILE_PATH
 from core.strategy import OpenAILikeModelConfigProcessStrategy, EncryptorStrategy
-from core.encryption import FernetEncryptor
+from core.encryption import EnvelopeEncryptor
 from core.models.llm import OpenAILikeConfigInStorage
 from core.storage.db.sqlite.oai_config import OpenAIConfigSQLiteStorage
 
@@ -17,9 +17,9 @@ class OAILikeConfigProcessor(OpenAILikeModelConfigProcessStrategy):
     def __init__(self, encryptor: EncryptorStrategy = None):
         """
         Args:
-            encryptor (EncryptorStrategy, optional): Defaults to None. If not provided, a new FernetEncryptor will be created.
+            encryptor (EncryptorStrategy, optional): Defaults to None. If not provided, a new EnvelopeEncryptor will be created.
         """
-        self.encryptor = encryptor or FernetEncryptor()
+        self.encryptor = encryptor or EnvelopeEncryptor()
         self.storage = OpenAIConfigSQLiteStorage()
     
     def reinitialize(self) -> None:
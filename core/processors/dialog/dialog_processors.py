@@ -1,22 +1,24 @@
-from typing import Optional, Dict, Any, List, Type
+from typing import Optional, Dict, Any, List, Tuple
 from enum import IntEnum
 from datetime import datetime
-from queue import Queue
+from queue import Queue, Empty, Full
 from threading import Lock, Thread
+import atexit
 import time
+import weakref
 from loguru._logger import Logger
 import streamlit as st
 
 from core.strategy import BaseDialogProcessStrategy
 from core.storage.db.base import Sqlstorage
-from core.models.memory import AssistantRun
+from core.models.memory import AssistantRun, AssistantRunSummary
 from utils.log.logger_config import *
 
 
 class OperationPriority(IntEnum):
     """对话处理器的操作优先级"""
     NORMAL = 0
-    HIGH = 1  # 高优先级操作将跳过防抖
+    HIGH = 1  # 高优先级操作将同步等待写入完成
 
 
 class Operation:
@@ -27,37 +29,104 @@ class Operation:
         self.kwargs = kwargs
 
 
+# 所有存活的对话处理器，进程退出时同步刷新它们的写缓冲
+_ACTIVE_PROCESSORS: "weakref.WeakSet[BaseDialogProcessor]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all_processors():
+    for processor in list(_ACTIVE_PROCESSORS):
+        try:
+            processor.shutdown()
+        except Exception as e:
+            logger.error(f"Error flushing dialog processor on exit: {e}")
+
+
 class BaseDialogProcessor(BaseDialogProcessStrategy):
     """
     对话处理器，用于管理对话相关的数据库操作
+
+    字段更新写入以 (run_id, field) 为键的写缓冲，同一个键只保留最新的值，
+    按时间间隔或缓冲大小批量写入数据库；创建、删除等结构性操作按顺序排队执行，
+    排队前会先把已有的写缓冲封存到队列中，保证写入顺序。
+    批量写入失败时，这一批更新会并回写缓冲（不覆盖之后的新值），按指数退避重试。
+
+    Streamlit 每次重新运行脚本都会执行页面代码，页面应通过 `st.cache_resource`
+    在进程内共享同一个处理器，否则上一次运行中尚未写入的缓冲对新的处理器不可见。
     """
     def __init__(
         self,
         storage: Sqlstorage,
         debounce_delay: float = 0.5,
         max_queue_size: int = 100,
+        max_batch_size: int = 50,
+        max_retry_delay: float = 30.0,
         logger: Logger = logger
     ):
+        """
+        Args:
+            storage (Sqlstorage): 对话存储
+            debounce_delay (float): 写缓冲的刷新间隔（秒）
+            max_queue_size (int): 操作队列的最大长度
+            max_batch_size (int): 写缓冲中待写入键的数量达到该值时立即刷新
+            max_retry_delay (float): 批量写入失败后重试的最长间隔（秒）
+            logger (Logger): 日志记录器
+        """
         self.storage = storage
         self.debounce_delay = debounce_delay
+        self.max_batch_size = max_batch_size
+        self.max_retry_delay = max_retry_delay
         self.operation_queue = Queue(maxsize=max_queue_size)
-        self.last_operation_time = 0.0
         self.lock = Lock()
-        
-        # 启动处理线程
-        self.processing_thread = Thread(target=self._process_queue, daemon=True)
-        self.processing_thread.start()
+
+        # 写缓冲，键为 (run_id, field)，值为 (user_id, value)
+        # field 可以是列名，也可以是 "列名.键名"，表示只更新 JSON 列中的某个键
+        self._pending: Dict[Tuple[str, str], Tuple[Optional[str], Any]] = {}
+        self._pending_lock = Lock()
+        self._closed = False
+
+        # 写入失败、等待重试的更新，由处理线程写入，因此使用单独的锁，
+        # 避免与持有 _pending_lock 并等待队列空间的调用方互相等待
+        self._failed: Dict[Tuple[str, str], Tuple[Optional[str], Any]] = {}
+        self._failed_lock = Lock()
+        self._retry_attempts = 0
+        self._retry_at = 0.0
+
+        # 刷新统计
+        self._flush_count = 0
+        self._flushed_writes = 0
+        self._coalesced_writes = 0
+        self._total_flush_latency = 0.0
+        self._last_flush_latency = 0.0
 
         # logger
         self._logger = logger
+
+        # 启动处理线程
+        self.processing_thread = Thread(target=self._process_queue, daemon=True)
+        self.processing_thread.start()
+        _ACTIVE_PROCESSORS.add(self)
     
     def _process_queue(self):
         """处理后端操作队列"""
         while True:
             try:
-                # 获取下一个操作
-                operation = self.operation_queue.get()
+                try:
+                    operation = self.operation_queue.get(timeout=self.debounce_delay)
+                except Empty:
+                    # 队列空闲时把写缓冲封存到队列中，由下一轮循环写入
+                    # 调用方可能正持有锁并等待队列腾出空间，因此这里不能阻塞等锁
+                    if self._pending_lock.acquire(blocking=False):
+                        try:
+                            if time.monotonic() >= self._retry_at:
+                                self._merge_failed_locked()
+                            self._seal_pending_locked(block=False)
+                        finally:
+                            self._pending_lock.release()
+                    continue
+
                 if operation is None:
+                    self.operation_queue.task_done()
                     break
                 
                 # 解包操作信息
@@ -65,19 +134,11 @@ class BaseDialogProcessor(BaseDialogProcessStrategy):
                 
                 # 执行操作
                 with self.lock:
-                    current_time = time.time()
-                    time_diff = current_time - self.last_operation_time
-                    
-                    # 高优先级操作跳过防抖检查
-                    if time_diff >= self.debounce_delay or operation.priority == OperationPriority.HIGH:
-                        try:
-                            method(*args, **kwargs)
-                            self.last_operation_time = current_time
-                            self._logger.info(f"Successfully executed operation: {method.__name__}")
-                        except Exception as e:
-                            self._logger.error(f"Error executing operation: {e}")
-                    else:
-                        self._logger.debug(f"Operation {method.__name__} debounced")
+                    try:
+                        method(*args, **kwargs)
+                        self._logger.debug(f"Successfully executed operation: {method.__name__}")
+                    except Exception as e:
+                        self._logger.error(f"Error executing operation: {e}")
                 
                 self.operation_queue.task_done()
                 
@@ -85,20 +146,154 @@ class BaseDialogProcessor(BaseDialogProcessStrategy):
                 self._logger.error(f"Error in operation processing thread: {e}")
     
     def _enqueue_operation(self, method, priority=OperationPriority.NORMAL, *args, **kwargs):
-        """将操作添加到队列"""
+        """将操作添加到队列，之前缓冲的字段更新会先于该操作写入"""
         try:
             operation = Operation(method, priority, *args, **kwargs)
-            self.operation_queue.put(operation)
+            with self._pending_lock:
+                self._seal_pending_locked(block=True)
+                self.operation_queue.put(operation)
             self._logger.debug(f"Operation {method.__name__} enqueued with priority {priority}")
         except Exception as e:
             self._logger.error(f"Error enqueueing operation: {e}")
             raise
+
+        if priority == OperationPriority.HIGH:
+            self.operation_queue.join()
+
+    def _buffer_write(self, run_id: str, user_id: Optional[str], field: str, value: Any):
+        """
+        缓冲一次字段更新，同一个 (run_id, field) 只保留最新的值
+
+        Args:
+            run_id (str): 对话ID
+            user_id (Optional[str]): 用户ID
+            field (str): 列名，或 "列名.键名" 表示只更新 JSON 列中的某个键
+            value (Any): 新的值
+        """
+        if self._closed:
+            # 处理器已关闭时直接同步写入，避免丢失更新
+            with self.lock:
+                self._write_batch({(run_id, field): (user_id, value)})
+            return
+
+        with self._pending_lock:
+            if (run_id, field) in self._pending:
+                self._coalesced_writes += 1
+            self._pending[(run_id, field)] = (user_id, value)
+            if len(self._pending) >= self.max_batch_size:
+                self._seal_pending_locked(block=True)
+
+    def _seal_pending(self, block: bool = True):
+        with self._pending_lock:
+            self._seal_pending_locked(block=block)
+
+    def _seal_pending_locked(self, block: bool = True):
+        """把当前写缓冲作为一个批量写入操作放入队列，调用方需持有 _pending_lock"""
+        if not self._pending:
+            return
+        operation = Operation(self._write_batch, OperationPriority.NORMAL, self._pending)
+        try:
+            # 处理线程自身不能阻塞在满队列上，否则没有人消费队列
+            self.operation_queue.put(operation, block=block)
+        except Full:
+            return
+        self._pending = {}
+
+    def _merge_failed_locked(self):
+        """把写入失败的更新并回写缓冲，缓冲中已有的新值优先，调用方需持有 _pending_lock"""
+        with self._failed_lock:
+            failed, self._failed = self._failed, {}
+        for key, item in failed.items():
+            self._pending.setdefault(key, item)
+
+    def _write_batch(self, batch: Dict[Tuple[str, str], Tuple[Optional[str], Any]]):
+        """把一批缓冲的字段更新按对话合并，并在一个事务中只写入变化的列"""
+        start_time = time.perf_counter()
+
+        updates: Dict[str, Tuple[Optional[str], Dict[str, Any]]] = {}
+        for (run_id, field), (user_id, value) in batch.items():
+            updates.setdefault(run_id, (user_id, {}))[1][field] = value
+
+        # 只更新发生变化的列，不再读取并重写整行
+        try:
+            updated_run_ids = self.storage.update_many(updates, raise_on_error=True)
+        except Exception as e:
+            with self._failed_lock:
+                # 之后失败的批次更新，值比先前失败的更新新
+                self._failed.update(batch)
+                self._retry_attempts += 1
+                delay = min(self.debounce_delay * 2 ** self._retry_attempts, self.max_retry_delay)
+                self._retry_at = time.monotonic() + delay
+            self._logger.error(f"Failed to write {len(batch)} pending writes, retrying in {delay:.1f}s: {e}")
+            return
+
+        with self._failed_lock:
+            # 已写入更新的值的键不再重试旧值
+            for key in batch:
+                self._failed.pop(key, None)
+            if not self._failed:
+                self._retry_attempts = 0
+                self._retry_at = 0.0
+
+        for run_id in updates.keys() - set(updated_run_ids):
+            self._logger.warning(f"Dialog with run_id {run_id} not updated, dropping {list(updates[run_id][1])}")
+
+        latency = time.perf_counter() - start_time
+        self._flush_count += 1
+        self._flushed_writes += len(batch)
+        self._total_flush_latency += latency
+        self._last_flush_latency = latency
+        self._logger.debug(f"Flushed {len(batch)} pending writes for {len(updated_run_ids)} dialogs in {latency:.3f}s")
+
+    def flush(self):
+        """把写缓冲与队列中的操作全部写入数据库（同步操作），写入失败的更新会立即重试一次"""
+        with self._pending_lock:
+            self._merge_failed_locked()
+            self._seal_pending_locked(block=True)
+        if self.processing_thread.is_alive():
+            self.operation_queue.join()
+
+    @property
+    def queue_depth(self) -> int:
+        """尚未写入数据库的操作与字段更新数量"""
+        return self.operation_queue.qsize() + len(self._pending) + len(self._failed)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取写缓冲的统计信息"""
+        return {
+            "queue_depth": self.operation_queue.qsize(),
+            "pending_writes": len(self._pending),
+            "failed_writes": len(self._failed),
+            "retry_attempts": self._retry_attempts,
+            "flush_count": self._flush_count,
+            "flushed_writes": self._flushed_writes,
+            "coalesced_writes": self._coalesced_writes,
+            "last_flush_latency": self._last_flush_latency,
+            "avg_flush_latency": (
+                self._total_flush_latency / self._flush_count if self._flush_count else 0.0
+            ),
+        }
     
     def shutdown(self):
-        """关闭处理器"""
+        """关闭处理器，同步写入所有未完成的更新"""
+        if self._closed:
+            return
+        self._seal_pending(block=True)
+        self._closed = True
         self.operation_queue.put(None)
         self.processing_thread.join()
 
+        # 关闭期间仍可能有写入进入缓冲，连同写入失败的更新直接同步写入
+        with self._pending_lock:
+            self._merge_failed_locked()
+            pending, self._pending = self._pending, {}
+        if pending:
+            with self.lock:
+                self._write_batch(pending)
+        if self._failed:
+            self._logger.error(f"Dropping {len(self._failed)} writes that could not be saved: {list(self._failed)}")
+        _ACTIVE_PROCESSORS.discard(self)
+
 
 class ClassicChatDialogProcessor(BaseDialogProcessor):
     """
@@ -109,27 +304,22 @@ class ClassicChatDialogProcessor(BaseDialogProcessor):
         storage: Sqlstorage,
         debounce_delay: float = 0.5,
         max_queue_size: int = 100,
+        max_batch_size: int = 50,
+        max_retry_delay: float = 30.0,
         logger: Logger = logger
     ):
         super().__init__(
             storage=storage,
             debounce_delay=debounce_delay,
             max_queue_size=max_queue_size,
+            max_batch_size=max_batch_size,
+            max_retry_delay=max_retry_delay,
             logger=logger
         )
     
     def update_dialog_name(self, *, run_id: str, user_id: str, new_name: str):
         """更新对话名称"""
-        def _update():
-            self.storage.upsert(
-                AssistantRun(
-                    run_id=run_id,
-                    user_id=user_id,
-                    run_name=new_name,
-                    updated_at=datetime.now()
-                )
-            )
-        self._enqueue_operation(_update)
+        self._buffer_write(run_id, user_id, "run_name", new_name)
     
     def update_dialog_config(
         self,
@@ -143,26 +333,15 @@ class ClassicChatDialogProcessor(BaseDialogProcessor):
         updated_at: Optional[datetime] = None
     ):
         """更新对话配置"""
-        def _update():
-            current_run = self.storage.get_specific_run(run_id, user_id)
-            if not current_run:
-                raise ValueError(f"Dialog with run_id {run_id} not found")
-            
-            self.storage.upsert(
-                AssistantRun(
-                    run_id=run_id,
-                    user_id=user_id,
-                    name=current_run.name,
-                    run_name=current_run.run_name,
-                    llm=llm_config,
-                    memory=current_run.memory,
-                    run_data=run_data or current_run.run_data,
-                    assistant_data=assistant_data or current_run.assistant_data,
-                    task_data=task_data or current_run.task_data,
-                    updated_at=updated_at or datetime.now()
-                )
-            )
-        self._enqueue_operation(_update)
+        self._buffer_write(run_id, user_id, "llm", llm_config)
+        if updated_at:
+            self._buffer_write(run_id, user_id, "updated_at", updated_at)
+        if run_data:
+            self._buffer_write(run_id, user_id, "run_data", run_data)
+        if assistant_data:
+            self._buffer_write(run_id, user_id, "assistant_data", assistant_data)
+        if task_data:
+            self._buffer_write(run_id, user_id, "task_data", task_data)
     
     def update_chat_history(
         self,
@@ -176,26 +355,43 @@ class ClassicChatDialogProcessor(BaseDialogProcessor):
         updated_at: Optional[datetime] = None
     ):
         """更新对话历史"""
-        def _update():
-            current_run = self.storage.get_specific_run(run_id, user_id)
-            if not current_run:
-                raise ValueError(f"Dialog with run_id {run_id} not found")
-            
-            self.storage.upsert(
-                AssistantRun(
-                    run_id=run_id,
-                    user_id=user_id,
-                    name=current_run.name,
-                    run_name=current_run.run_name,
-                    llm=current_run.llm,
-                    memory={"chat_history": chat_history},
-                    assistant_data=assistant_data or current_run.assistant_data,
-                    task_data=task_data or current_run.task_data,
-                    run_data=run_data or current_run.run_data,
-                    updated_at=updated_at or datetime.now()
-                )
-            )
-        self._enqueue_operation(_update)
+        # 对话历史写入追加式消息日志，只有新增或变化的消息会被加密写入
+        self._buffer_write(run_id, user_id, "chat_history", chat_history)
+        if updated_at:
+            self._buffer_write(run_id, user_id, "updated_at", updated_at)
+        if assistant_data:
+            self._buffer_write(run_id, user_id, "assistant_data", assistant_data)
+        if task_data:
+            self._buffer_write(run_id, user_id, "task_data", task_data)
+        if run_data:
+            self._buffer_write(run_id, user_id, "run_data", run_data)
+
+    def update_memory_summary(self, *, run_id: str, user_id: str, summary: Dict[str, Any]):
+        """更新对话的滚动摘要，只写入 memory 中的 summary 键"""
+        self._buffer_write(run_id, user_id, "memory.summary", summary)
+
+    def update_history_token_budget(self, *, run_id: str, user_id: str, history_token_budget: int):
+        """更新发送给模型的历史消息的 token 预算，只写入 run_data 中的 history_token_budget 键"""
+        self._buffer_write(run_id, user_id, "run_data.history_token_budget", history_token_budget)
+
+    def get_history_token_budget(self, run_id: str, user_id: str) -> Optional[int]:
+        """获取对话保存的历史消息 token 预算，没有设置过时返回 None"""
+        dialog = self.get_dialog(run_id, user_id, with_chat_history=False)
+        if dialog and dialog.run_data:
+            return dialog.run_data.get("history_token_budget")
+        return None
+
+    def append_messages(self, *, run_id: str, user_id: str, messages: List[Dict[str, Any]]):
+        """在对话历史末尾追加消息，只加密写入新消息，不重新提交整个对话历史"""
+        def _append():
+            self.storage.append_messages(run_id, user_id, messages)
+        self._enqueue_operation(_append)
+
+    def truncate_chat_history(self, *, run_id: str, user_id: str, length: int):
+        """只保留对话历史的前 `length` 条消息，用于删除最近的对话轮次或清空对话"""
+        def _truncate():
+            self.storage.truncate_messages(run_id, user_id, length)
+        self._enqueue_operation(_truncate)
     
     def create_dialog(
         self,
@@ -213,8 +409,8 @@ class ClassicChatDialogProcessor(BaseDialogProcessor):
         """创建新对话"""
         def _create():
             try:
-                self._logger.debug(f"Creating new dialog with run_id: {run_id}")
-                self._logger.debug(f"Dialog config: {llm_config}")
+                self._logger.debug("Creating new dialog with run_id: {}", run_id)
+                self._logger.opt(lazy=True).debug("Dialog config: {}", lambda: redact_secrets(llm_config))
                 
                 self.storage.upsert(
                     AssistantRun(
@@ -244,19 +440,34 @@ class ClassicChatDialogProcessor(BaseDialogProcessor):
             self.storage.delete_run(run_id, user_id)
         self._enqueue_operation(_delete)
     
-    def get_dialog(self, run_id: str, user_id: Optional[str] = None) -> Optional[AssistantRun]:
-        """获取对话（同步操作）"""
+    def get_dialog(
+        self,
+        run_id: str,
+        user_id: Optional[str] = None,
+        with_chat_history: bool = True
+    ) -> Optional[AssistantRun]:
+        """
+        获取对话（同步操作）
+
+        Args:
+            run_id (str): 对话ID
+            user_id (Optional[str]): 用户ID
+            with_chat_history (bool): 是否加载完整的对话历史，只读取配置时传 False，
+                对话历史通过 `get_chat_history` 或 `get_lazy_chat_history` 分页读取
+        """
+        self.flush()
         with self.lock:
             return self.storage.get_specific_run(
                 run_id=run_id,
-                user_id=user_id
+                user_id=user_id,
+                with_chat_history=with_chat_history
             )
     
     def get_all_dialogs(self, user_id: Optional[str] = None, debug_mode: bool = False) -> List[AssistantRun]:
         """获取所有对话（同步操作）"""
         try:
             # 等待所有操作完成
-            self.operation_queue.join()
+            self.flush()
             
             with self.lock:
                 dialogs = self.storage.get_all_runs(
@@ -269,6 +480,59 @@ class ClassicChatDialogProcessor(BaseDialogProcessor):
             self._logger.error(f"Error getting dialogs: {e}")
             return []
 
+    def list_dialogs(
+        self,
+        user_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        after: Optional[AssistantRunSummary] = None,
+        debug_mode: bool = False
+    ) -> List[AssistantRunSummary]:
+        """
+        获取对话列表（同步操作），只查询 run_id、run_name 和时间戳，不解密对话内容
+
+        Args:
+            user_id (Optional[str]): 用户ID
+            limit (Optional[int]): 每页数量，为 None 时返回全部
+            after (Optional[AssistantRunSummary]): 上一页的最后一个对话，用于翻页
+            debug_mode (bool): 是否返回所有用户的对话
+        """
+        self.flush()
+        with self.lock:
+            return self.storage.list_runs(
+                user_id=user_id,
+                limit=limit,
+                after=after,
+                debug_mode=debug_mode
+            )
+
+    def get_chat_history(
+        self,
+        run_id: str,
+        user_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        before: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        分页获取对话历史（同步操作）
+
+        Args:
+            run_id (str): 对话ID
+            user_id (Optional[str]): 用户ID
+            limit (Optional[int]): 最多返回的消息数量，为 None 时返回全部
+            before (Optional[int]): 只返回位置小于该值的消息，用于向前翻页
+
+        Returns:
+            List[Dict[str, Any]]: 按时间顺序排列的消息
+        """
+        self.flush()
+        with self.lock:
+            return self.storage.get_chat_history(run_id, user_id, limit=limit, before=before)
+
+    def get_lazy_chat_history(self, run_id: str, user_id: Optional[str] = None, page_size: int = 50):
+        """获取按需分页加载的对话历史序列，可直接传给 `write_chat_history` 或 `MessageHistoryTransform`"""
+        self.flush()
+        return self.storage.get_lazy_chat_history(run_id, user_id, page_size=page_size)
+
 
 class RAGChatDialogProcessor(ClassicChatDialogProcessor):
     """RAG聊天对话处理器"""
@@ -277,12 +541,16 @@ class RAGChatDialogProcessor(ClassicChatDialogProcessor):
         storage: Sqlstorage,
         debounce_delay: float = 0.5,
         max_queue_size: int = 100,
+        max_batch_size: int = 50,
+        max_retry_delay: float = 30.0,
         logger: Logger = logger
     ):
         super().__init__(
             storage=storage,
             debounce_delay=debounce_delay,
             max_queue_size=max_queue_size,
+            max_batch_size=max_batch_size,
+            max_retry_delay=max_retry_delay,
             logger=logger
         )
 
@@ -307,42 +575,19 @@ class RAGChatDialogProcessor(ClassicChatDialogProcessor):
                 query_mode (str): 查询模式 ("collection" 或 "file")
                 selected_file (str, optional): 单文件模式下选择的文件
         """
-        def _update():
-            try:
-                current_run = self.storage.get_specific_run(run_id, user_id)
-                if not current_run:
-                    raise ValueError(f"Dialog with run_id {run_id} not found")
-                
-                # 更新run_data中的knowledge_base_config
-                current_run_data = current_run.run_data or {}
-                current_run_data["knowledge_base_config"] = knowledge_base_config
-                
-                self.storage.upsert(
-                    AssistantRun(
-                        run_id=run_id,
-                        user_id=user_id,
-                        name=current_run.name,
-                        run_name=current_run.run_name,
-                        llm=current_run.llm,
-                        memory=current_run.memory,
-                        run_data=current_run_data,
-                        assistant_data=current_run.assistant_data,
-                        task_data=current_run.task_data,
-                        updated_at=datetime.now()
-                    )
-                )
-                self._logger.info(f"Successfully updated knowledge base config for dialog: {run_id}")
-            except Exception as e:
-                self._logger.error(f"Failed to update knowledge base config: {e}")
-                raise
-                
-        self._enqueue_operation(_update)
+        # 只更新run_data中的knowledge_base_config
+        self._buffer_write(run_id, user_id, "run_data.knowledge_base_config", knowledge_base_config)
     
+    def update_source_documents(self, *, run_id: str, user_id: str, source_documents: Dict[str, Any]):
+        """更新对话中各回答引用的源文档，只写入 task_data 中的 source_documents 键"""
+        self._buffer_write(run_id, user_id, "task_data.source_documents", source_documents)
+
     def get_knowledge_base_config(self, run_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """获取当前对话指向的知识库配置"""
+        self.flush()
         with self.lock:
             try:
-                run = self.storage.get_specific_run(run_id, user_id)
+                run = self.storage.get_specific_run(run_id, user_id, with_chat_history=False)
                 if run and run.run_data:
                     return run.run_data.get("knowledge_base_config", {})
                 return {}
@@ -358,12 +603,16 @@ class AgenChatDialogProcessor(BaseDialogProcessor):
         storage: Sqlstorage,
         debounce_delay: float = 0.5,
         max_queue_size: int = 100,
+        max_batch_size: int = 50,
+        max_retry_delay: float = 30.0,
         logger: Logger = logger
     ):
         super().__init__(
             storage=storage,
             debounce_delay=debounce_delay,
             max_queue_size=max_queue_size,
+            max_batch_size=max_batch_size,
+            max_retry_delay=max_retry_delay,
             logger=logger
         )
     
@@ -385,7 +634,7 @@ class AgenChatDialogProcessor(BaseDialogProcessor):
         def _create():
             try:
                 self._logger.debug(f"Creating new dialog with run_id: {run_id}")
-                self._logger.debug(f"Agent/Team config: {template}")
+                self._logger.opt(lazy=True).debug("Agent/Team config: {}", lambda: redact_secrets(template))
                 
                 assistant_data = {
                     "template": template,
@@ -422,6 +671,7 @@ class AgenChatDialogProcessor(BaseDialogProcessor):
 
     def get_dialog(self, run_id: str, user_id: Optional[str] = None) -> Optional[AssistantRun]:
         """获取对话（同步操作）"""
+        self.flush()
         with self.lock:
             return self.storage.get_specific_run(
                 run_id=run_id,
@@ -432,7 +682,7 @@ class AgenChatDialogProcessor(BaseDialogProcessor):
         """获取所有对话（同步操作）"""
         try:
             # 等待所有操作完成
-            self.operation_queue.join()
+            self.flush()
             
             with self.lock:
                 dialogs = self.storage.get_all_runs(
@@ -445,27 +695,26 @@ class AgenChatDialogProcessor(BaseDialogProcessor):
             self._logger.error(f"Error getting dialogs: {e}")
             return []
 
+    def list_dialogs(
+        self,
+        user_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        after: Optional[AssistantRunSummary] = None,
+        debug_mode: bool = False
+    ) -> List[AssistantRunSummary]:
+        """获取对话列表（同步操作），只查询 run_id、run_name 和时间戳，不解密对话内容"""
+        self.flush()
+        with self.lock:
+            return self.storage.list_runs(
+                user_id=user_id,
+                limit=limit,
+                after=after,
+                debug_mode=debug_mode
+            )
+
     def update_dialog_name(self, *, run_id: str, user_id: str, new_name: str):
         """更新对话名称"""
-        def _update():
-            try:
-                current_run = self.storage.get_specific_run(run_id, user_id)
-                if not current_run:
-                    raise ValueError(f"Dialog with run_id {run_id} not found")
-            
-                self.storage.upsert(
-                    AssistantRun(
-                        run_id=run_id,
-                        user_id=user_id,
-                        run_name=new_name,
-                        updated_at=datetime.now()
-                    )
-                )
-                self._logger.info(f"Successfully updated dialog name for: {run_id}")
-            except Exception as e:
-                self._logger.error(f"Failed to update dialog name: {e}")
-                raise
-        self._enqueue_operation(_update)
+        self._buffer_write(run_id, user_id, "run_name", new_name)
 
     def update_template(
         self, 
@@ -481,38 +730,12 @@ class AgenChatDialogProcessor(BaseDialogProcessor):
             run_id (str): 对话ID
             template (Dict[str, Any]): 模板
         """
-        def _update():
-            try:
-                current_run = self.storage.get_specific_run(run_id, user_id)
-                if not current_run:
-                    raise ValueError(f"Dialog with run_id {run_id} not found")
-
-                # 更新run_data中的template
-                current_assistant_data = current_run.assistant_data or {}
-                current_assistant_data["template"] = template
-
-                self.storage.upsert(
-                    AssistantRun(
-                        run_id=run_id,
-                        name=current_run.name,
-                        run_name=current_run.run_name,
-                        llm=current_run.llm,
-                        memory=current_run.memory,
-                        run_data=current_run.run_data,
-                        assistant_data=current_assistant_data,
-                        task_data=current_run.task_data,
-                        updated_at=datetime.now()
-                    )
-                )
-                self._logger.info(f"Successfully updated template for dialog: {run_id}")
-            except Exception as e:
-                self._logger.error(f"Failed to update template: {e}")
-                raise
-            
-        self._enqueue_operation(_update)
+        # 只更新assistant_data中的template
+        self._buffer_write(run_id, user_id, "assistant_data.template", template)
 
     def get_template(self, run_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """获取当前对话指向的 Agent team 模板"""
+        self.flush()
         with self.lock:
             try:
                 run = self.storage.get_specific_run(run_id, user_id)
@@ -525,31 +748,11 @@ class AgenChatDialogProcessor(BaseDialogProcessor):
     
     def update_team_state(self, run_id: str, user_id: str, team_state: Dict[str, Any]):
         """更新团队状态"""
-        def _update():
-            try:
-                current_run = self.storage.get_specific_run(run_id, user_id)
-                if not current_run:
-                    raise ValueError(f"Dialog with run_id {run_id} not found")
-            
-                current_assistant_data = current_run.assistant_data or {}
-                current_assistant_data["team_state"] = team_state
-                
-                self.storage.upsert(
-                    AssistantRun(
-                        run_id=run_id, 
-                        user_id=user_id,
-                        assistant_data=current_assistant_data
-                    )
-                )
-                self._logger.info(f"Successfully updated team state for dialog: {run_id}")
-            except Exception as e:
-                self._logger.error(f"Failed to update team state: {e}")
-                raise
-        
-        self._enqueue_operation(_update)
+        self._buffer_write(run_id, user_id, "assistant_data.team_state", team_state)
 
     def get_team_state(self, run_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """获取团队状态"""
+        self.flush()
         with self.lock:
             run = self.storage.get_specific_run(run_id, user_id)
             if run and run.assistant_data:
@@ -558,46 +761,9 @@ class AgenChatDialogProcessor(BaseDialogProcessor):
     
     def update_run_name(self, run_id: str, user_id: str, run_name: str):
         """更新对话名称"""
-        def _update():
-            try:
-                current_run = self.storage.get_specific_run(run_id, user_id)
-                if not current_run:
-                    raise ValueError(f"Dialog with run_id {run_id} not found")
-                
-                self.storage.upsert(
-                    AssistantRun(
-                        run_id=run_id, 
-                        user_id=user_id, 
-                        run_name=run_name
-                    )
-                )
-                self._logger.info(f"Successfully updated run name for: {run_id}")
-            except Exception as e:
-                self._logger.error(f"Failed to update run name: {e}")
-                raise
-        self._enqueue_operation(_update)
+        self._buffer_write(run_id, user_id, "run_name", run_name)
 
     def update_template_and_team_state(self, run_id: str, user_id: str, template: Dict[str, Any], team_state: Dict[str, Any]):
         """更新对话模板和团队状态"""
-        def _update():
-            try:
-                current_run = self.storage.get_specific_run(run_id, user_id)
-                if not current_run:
-                    raise ValueError(f"Dialog with run_id {run_id} not found")
-                
-                current_assistant_data = current_run.assistant_data or {}
-                current_assistant_data["template"] = template
-                current_assistant_data["team_state"] = team_state
-
-                self.storage.upsert(
-                    AssistantRun(
-                        run_id=run_id,
-                        user_id=user_id,
-                        assistant_data=current_assistant_data
-                    )
-                )
-                self._logger.info(f"Successfully updated template and team state for dialog: {run_id}")
-            except Exception as e:
-                self._logger.error(f"Failed to update template and team state: {e}")
-                raise
-        self._enqueue_operation(_update)
+        self._buffer_write(run_id, user_id, "assistant_data.template", template)
+        self._buffer_write(run_id, user_id, "assistant_data.team_state", team_state)
@@ -10,11 +10,11 @@ import streamlit as st
 import chromadb
 from chromadb.utils import embedding_functions
 
-from huggingface_hub import snapshot_download
 from langchain_core.documents.base import Document
 from loguru import logger
 
 from core.basic_config import I18nAuto
+from utils.lazy_imports import get_huggingface_hub
 from config.constants import (
     KNOWLEDGE_BASE_DIR,
     EMBEDDING_CONFIG_FILE_PATH,
@@ -362,7 +362,7 @@ class ChromaVectorStoreProcessorWithNoApi(BaseChromaInitEmbeddingConfig):
         ignore_patterns = ["onnx/*", "*.jpg", "*.webp"]
         try:
             os.makedirs(model_name_or_path, exist_ok=True)
-            snapshot_download(
+            get_huggingface_hub().snapshot_download(
                 repo_id=repo_id,
                 local_dir=model_name_or_path,
                 local_dir_use_symlinks=False,
@@ -589,7 +589,8 @@ class ChromaCollectionProcessorWithNoApi(BaseChromaInitEmbeddingConfig):
         embedding_model_id: str,
     ):
         self.embedding_config = embedding_config
-        self.embedding_model = self._get_embedding_model(embedding_model_id)
+        self.embedding_model_config = self._get_embedding_model_config(embedding_model_id)
+        self.embedding_model = self._create_embedding_model(self.embedding_model_config)
         self.collection_name = collection_name
         self.collection_id = self._get_collection_id(collection_name)
         self.collection = self._get_chroma_specific_collection(
@@ -640,14 +641,17 @@ class ChromaCollectionProcessorWithNoApi(BaseChromaInitEmbeddingConfig):
         except ValueError:
             return None
 
-    def _get_embedding_model(self, model_id: str) -> chromadb.EmbeddingFunction:
+    def _get_embedding_model_config(self, model_id: str) -> EmbeddingModelConfiguration:
         model_config = next(
             (model for model in self.embedding_config.models if model.id == model_id),
             None,
         )
         if not model_config:
             raise ValueError(f"No embedding model found with id {model_id}")
-        return self._create_embedding_model(model_config)
+        return model_config
+
+    def _get_embedding_model(self, model_id: str) -> chromadb.EmbeddingFunction:
+        return self._create_embedding_model(self._get_embedding_model_config(model_id))
 
     def _create_embedding_model(
         self, model_config: EmbeddingModelConfiguration
@@ -819,6 +823,19 @@ class ChromaCollectionProcessorWithNoApi(BaseChromaInitEmbeddingConfig):
         ]
         self.collection.delete(ids=ids_for_target_file)
 
+    def delete_documents_by_url(
+        self,
+        urls: List[str],
+    ) -> None:
+        """
+        从知识库中删除来自这些网页的文档块，用于重新嵌入内容有变化的网页
+
+        Args:
+            urls (List[str]): 网页地址，与分块元数据中的 `url` 比较
+        """
+        if urls:
+            self.collection.delete(where={"url": {"$in": list(urls)}})
+
     def delete_specific_documents(
         self,
         chunk_document_content: str,
@@ -0,0 +1,271 @@
+try:
+    from sqlalchemy.dialects import sqlite
+    from sqlalchemy.schema import MetaData, Table, Column
+    from sqlalchemy.sql.expression import select, update, delete
+    from sqlalchemy.types import String, Integer
+except ImportError:
+    raise ImportError("`sqlalchemy` not installed")
+
+import os
+import re
+import base64
+import hashlib
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import lru_cache
+from threading import Lock, Thread
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+from loguru import logger
+
+from config.constants import IMAGE_BLOB_DIR
+from core.storage.db.sqlite.engine import get_sqlite_engines
+
+
+# Reference stored in place of inline image data: `blob:sha256:<hex digest>`
+BLOB_URL_PREFIX = "blob:sha256:"
+_DATA_URL_PATTERN = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+);base64,(?P<data>.*)$", re.DOTALL)
+
+
+def is_blob_url(url: Any) -> bool:
+    return isinstance(url, str) and url.startswith(BLOB_URL_PREFIX)
+
+
+def blob_digest(url: str) -> str:
+    return url[len(BLOB_URL_PREFIX):]
+
+
+class BlobStore:
+    """
+    本地内容寻址的二进制存储，用于存放对话中的图片
+
+    - 文件按 SHA-256 存放在 `<root_dir>/<digest[:2]>/<digest>`，相同内容只存一份
+    - `<root_dir>/index.db` 记录 MIME 类型与引用计数，引用计数为 0 且超过宽限期的文件会被回收
+    - 消息中只保存 `blob:sha256:<digest>` 引用，在请求模型或渲染时再按需解析
+    """
+
+    def __init__(self, root_dir: str, grace_period: timedelta = timedelta(hours=1)):
+        """
+        Args:
+            root_dir: 存储目录
+            grace_period: 新写入但尚未被引用的文件的保留时间，避免回收还未保存到对话中的图片
+        """
+        self.root_dir = os.path.abspath(root_dir)
+        self.grace_period = grace_period
+        os.makedirs(self.root_dir, exist_ok=True)
+
+        engines = get_sqlite_engines(os.path.join(self.root_dir, "index.db"))
+        self.Session = engines.Session
+        self.ReadSession = engines.ReadSession
+        self.metadata = MetaData()
+        self.table = Table(
+            "blobs",
+            self.metadata,
+            Column("digest", String(64), primary_key=True),
+            Column("mime_type", String, nullable=False),
+            Column("size", Integer, nullable=False),
+            # Number of stored messages referencing this blob
+            Column("ref_count", Integer, nullable=False, default=0),
+            Column("created_at", sqlite.DATETIME, default=datetime.now),
+        )
+        self.table.create(engines.writer, checkfirst=True)
+
+        self._gc_lock = Lock()
+        self._gc_started = False
+        # 渲染时同一张图片会被反复读取，缓存最近使用的内容
+        self._read_cached = lru_cache(maxsize=32)(self._read)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root_dir, digest[:2], digest)
+
+    def put(self, data: bytes, mime_type: str = "image/jpeg") -> str:
+        """
+        保存数据，返回 `blob:sha256:<digest>` 引用
+
+        新写入的数据引用计数为 0，保存包含该引用的消息时才会增加。
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self.Session() as sess, sess.begin():
+            exists = sess.execute(
+                select(self.table.c.digest).where(self.table.c.digest == digest)
+            ).first()
+            if exists is None:
+                sess.execute(
+                    self.table.insert().values(digest=digest, mime_type=mime_type, size=len(data), ref_count=0)
+                )
+            else:
+                # 重新上传的内容重新计算宽限期
+                sess.execute(
+                    update(self.table).where(self.table.c.digest == digest).values(created_at=datetime.now())
+                )
+        return f"{BLOB_URL_PREFIX}{digest}"
+
+    def put_data_url(self, data_url: str) -> str:
+        """保存 `data:<mime>;base64,...` 格式的数据，不是 data URL 时原样返回"""
+        match = _DATA_URL_PATTERN.match(data_url)
+        if match is None:
+            return data_url
+        return self.put(base64.b64decode(match.group("data")), match.group("mime"))
+
+    def _read(self, digest: str) -> Tuple[str, bytes]:
+        with self.ReadSession() as sess:
+            mime_type = sess.execute(
+                select(self.table.c.mime_type).where(self.table.c.digest == digest)
+            ).scalar_one_or_none()
+        if mime_type is None:
+            raise KeyError(f"Blob {digest} not found")
+        with open(self._path(digest), "rb") as f:
+            return mime_type, f.read()
+
+    def read(self, url: str) -> bytes:
+        """读取引用对应的数据"""
+        return self._read_cached(blob_digest(url))[1]
+
+    def to_data_url(self, url: str) -> str:
+        """将引用解析为 data URL，其它 URL 原样返回"""
+        if not is_blob_url(url):
+            return url
+        mime_type, data = self._read_cached(blob_digest(url))
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    def update_refs(self, deltas: Mapping[str, int]) -> None:
+        """按 digest 增减引用计数"""
+        deltas = {digest: delta for digest, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        with self.Session() as sess, sess.begin():
+            for digest, delta in deltas.items():
+                sess.execute(
+                    update(self.table)
+                    .where(self.table.c.digest == digest)
+                    .values(ref_count=self.table.c.ref_count + delta)
+                )
+
+    def collect_garbage(self) -> int:
+        """删除引用计数为 0 且超过宽限期的数据，返回删除的数量"""
+        cutoff = datetime.now() - self.grace_period
+        with self.Session() as sess, sess.begin():
+            digests = sess.execute(
+                select(self.table.c.digest).where(
+                    self.table.c.ref_count <= 0,
+                    self.table.c.created_at < cutoff,
+                )
+            ).scalars().all()
+            if digests:
+                sess.execute(delete(self.table).where(self.table.c.digest.in_(digests)))
+        for digest in digests:
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+        if digests:
+            self._read_cached.cache_clear()
+            logger.info(f"Removed {len(digests)} unreferenced blobs from {self.root_dir}")
+        return len(digests)
+
+    def start_background_gc(self) -> None:
+        """在后台线程中回收一次未被引用的数据，每个进程只执行一次"""
+        with self._gc_lock:
+            if self._gc_started:
+                return
+            self._gc_started = True
+
+        def _run():
+            try:
+                self.collect_garbage()
+            except Exception as e:
+                logger.error(f"Error collecting blobs in {self.root_dir}: {e}")
+
+        Thread(target=_run, daemon=True, name="blob-gc").start()
+
+
+def _image_url(item: Dict[str, Any]) -> Optional[str]:
+    """`ImageContent` 的 image_url 是字符串，OpenAI 格式是 {"url": ...}"""
+    image_url = item.get("image_url")
+    if isinstance(image_url, dict):
+        return image_url.get("url")
+    return image_url
+
+
+def _with_image_url(item: Dict[str, Any], url: str) -> Dict[str, Any]:
+    if isinstance(item.get("image_url"), dict):
+        return {**item, "image_url": {**item["image_url"], "url": url}}
+    return {**item, "image_url": url}
+
+
+def _map_image_urls(message: Dict[str, Any], func) -> Dict[str, Any]:
+    content = message.get("content")
+    if not isinstance(content, list):
+        return message
+    new_content = []
+    changed = False
+    for item in content:
+        if isinstance(item, dict) and item.get("type") == "image_url":
+            url = _image_url(item)
+            new_url = func(url) if isinstance(url, str) else url
+            if new_url != url:
+                item = _with_image_url(item, new_url)
+                changed = True
+        new_content.append(item)
+    return {**message, "content": new_content} if changed else message
+
+
+def offload_message_images(message: Dict[str, Any], store: BlobStore) -> Dict[str, Any]:
+    """将消息中的内联 base64 图片保存到 `store`，替换为引用；消息不变时返回原对象"""
+    return _map_image_urls(message, store.put_data_url)
+
+
+def resolve_message_images(message: Dict[str, Any], store: Optional["BlobStore"] = None) -> Dict[str, Any]:
+    """将消息中的图片引用解析为 data URL，用于请求模型和导出"""
+    store = store or get_blob_store()
+    return _map_image_urls(message, store.to_data_url)
+
+
+def resolve_messages_images(messages: Iterable[Dict[str, Any]], store: Optional["BlobStore"] = None) -> List[Dict[str, Any]]:
+    return [resolve_message_images(message, store) for message in messages]
+
+
+def resolve_image_url(url: str, store: Optional["BlobStore"] = None) -> str:
+    return (store or get_blob_store()).to_data_url(url) if is_blob_url(url) else url
+
+
+def message_blob_digests(message: Dict[str, Any]) -> List[str]:
+    """消息引用的 blob digest 列表"""
+    content = message.get("content")
+    if not isinstance(content, list):
+        return []
+    return [
+        blob_digest(url)
+        for item in content
+        if isinstance(item, dict) and item.get("type") == "image_url"
+        for url in [_image_url(item)]
+        if is_blob_url(url)
+    ]
+
+
+def count_blob_refs(blob_refs: Iterable[Optional[str]]) -> Counter:
+    """统计消息表中 `blob_refs` 列（逗号分隔的 digest）的引用次数"""
+    counter = Counter()
+    for refs in blob_refs:
+        if refs:
+            counter.update(refs.split(","))
+    return counter
+
+
+_STORES: Dict[str, BlobStore] = {}
+_STORES_LOCK = Lock()
+
+
+def get_blob_store(root_dir: str = IMAGE_BLOB_DIR) -> BlobStore:
+    """获取进程内共享的 BlobStore"""
+    key = os.path.abspath(root_dir)
+    with _STORES_LOCK:
+        if key not in _STORES:
+            _STORES[key] = BlobStore(key)
+        return _STORES[key]
@@ -1,27 +1,48 @@
 try:
+    from sqlalchemy import event
     from sqlalchemy.dialects import sqlite
     from sqlalchemy.engine import create_engine, Engine, Row
     from sqlalchemy.inspection import inspect
     from sqlalchemy.orm import Session, sessionmaker
-    from sqlalchemy.schema import MetaData, Table, Column
-    from sqlalchemy.sql.expression import text, select, delete
-    from sqlalchemy.types import DateTime, String, Integer
+    from sqlalchemy.schema import MetaData, Table, Column, PrimaryKeyConstraint, Index
+    from sqlalchemy.sql.expression import text, select, delete, update, func, or_, and_, tuple_, type_coerce
+    from sqlalchemy.types import DateTime, String, Integer, LargeBinary
 except ImportError:
     raise ImportError("`sqlalchemy` not installed")
 
 from sqlite3 import OperationalError
 from datetime import datetime
-from typing import Optional, List, Literal, Any, Dict
+from typing import Optional, List, Literal, Any, Dict, Tuple, Sequence, Iterator, Union, overload
 from loguru import logger
 from sqlalchemy.schema import Table
-from tenacity import retry, stop_after_attempt, wait_exponential
-from core.models.memory import AssistantRun
+from core.models.memory import AssistantRun, AssistantRunSummary
 from core.storage.db.base import Sqlstorage
+from core.storage.db.sqlite.engine import get_sqlite_engines
+from core.storage.blob import (
+    BlobStore,
+    count_blob_refs,
+    get_blob_store,
+    message_blob_digests,
+    offload_message_images,
+)
+from core.storage.db.sqlite.codec import CompressedJSON, get_column_codec, train_zstd_dictionary
 from utils.log.logger_config import setup_logger
-from core.encryption import FernetEncryptor
+from core.encryption import EnvelopeEncryptor
 from core.strategy import EncryptorStrategy
 import json
 import time
+import os
+import hashlib
+from collections import Counter
+from threading import Lock, Thread
+
+
+# Message fields computed from the message itself, not part of its digest
+DERIVED_MESSAGE_FIELDS = frozenset({"token_count"})
+
+# (database, table) pairs whose background re-encryption was already started in this process
+_REENCRYPTION_STARTED = set()
+_REENCRYPTION_LOCK = Lock()
 
 
 class SqlAssistantStorage(Sqlstorage):
@@ -32,6 +53,7 @@ class SqlAssistantStorage(Sqlstorage):
         db_file: Optional[str] = None,
         db_engine: Optional[Engine] = None,
         encryptor: Optional[EncryptorStrategy] = None,
+        blob_store: Optional[BlobStore] = None,
     ):
         """
         This class provides assistant storage using a sqlite database.
@@ -42,18 +64,28 @@ class SqlAssistantStorage(Sqlstorage):
             3. Use the db_file
             4. Create a new in-memory database
 
+        With db_file, the process-wide tuned engines from `get_sqlite_engines` are used:
+        WAL mode, busy timeouts, one writer connection and a pool of read-only connections.
+
         :param table_name: The name of the table to store assistant runs.
         :param db_url: The database URL to connect to.
         :param db_file: The database file to connect to.
         :param db_engine: The database engine to use.
-        :param encryptor: The encryptor to use. If not provided, a new FernetEncryptor will be created.
+        :param encryptor: The encryptor to use. If not provided, a new EnvelopeEncryptor will be created,
+            and rows written in an older format or with a rotated-out key are re-encrypted in the background.
+        :param blob_store: Where inline base64 images of stored messages are offloaded to.
+            Defaults to a "blobs" directory next to db_file; without db_file images stay inline.
         """
         _engine: Optional[Engine] = db_engine
+        _read_engine: Optional[Engine] = None
+        self.lock_stats = None
         if _engine is None and db_url is not None:
             _engine = create_engine(db_url)
         elif _engine is None and db_file is not None:
-            _engine = create_engine(f"sqlite:///{db_file}")
-        else:
+            engines = get_sqlite_engines(db_file)
+            _engine, _read_engine = engines.writer, engines.reader
+            self.lock_stats = engines.stats
+        elif _engine is None:
             _engine = create_engine("sqlite://")
 
         if _engine is None:
@@ -63,16 +95,39 @@ class SqlAssistantStorage(Sqlstorage):
         self.table_name: str = table_name
         self.db_url: Optional[str] = db_url
         self.db_engine: Engine = _engine
+        self.read_engine: Engine = _read_engine or _engine
         self.metadata: MetaData = MetaData()
 
-        # Database session
+        # Database sessions, writes go through db_engine and reads through read_engine
         self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+        self.ReadSession: sessionmaker[Session] = sessionmaker(bind=self.read_engine)
+
+        # Content-addressed store for message images, reference counts change only after a commit
+        if blob_store is None and db_file is not None:
+            blob_store = get_blob_store(os.path.join(os.path.dirname(os.path.abspath(db_file)), "blobs"))
+        self.blob_store: Optional[BlobStore] = blob_store
+        if self.blob_store is not None:
+            event.listen(self.Session, "after_commit", self._apply_blob_ref_deltas)
+            event.listen(self.Session, "after_rollback", self._discard_blob_ref_deltas)
+            self.blob_store.start_background_gc()
+
+        # Compression of the large JSON columns, shared by all storages of this table
+        self.codec = get_column_codec(f"{self.db_engine.url}/{table_name}")
 
         # Database table for storage
         self.table: Table = self.get_table()
+        # Append-only message log, one encrypted row per chat message
+        self.messages_table: Table = self.get_messages_table()
+        # Trained zstd dictionaries of the compressed columns
+        self.codec_dicts_table: Table = self.get_codec_dicts_table()
+        if self.table_exists():
+            self._create_missing_schema()
+            self._load_codec_dicts()
 
         # Initialize encryptor
-        self.encryptor: EncryptorStrategy = encryptor or FernetEncryptor()
+        self.encryptor: EncryptorStrategy = encryptor or EnvelopeEncryptor()
+        if encryptor is None and db_file is not None and self.table_exists():
+            self.start_background_reencryption()
 
     def _sanitize_input(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """清理和预处理输入数据"""
@@ -154,6 +209,182 @@ class SqlAssistantStorage(Sqlstorage):
             logger.error(f"Data that caused error: {decrypted_data[field]}")
         return decrypted_data
     
+    def _serialize_message(self, message: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Serialize a message the way it is stored, and digest that stored form.
+
+        The digest is taken after `_sanitize_input`, so a message read back from the log
+        hashes to the digest it was stored with. Derived fields such as `token_count`
+        are left out of the digest: filling them in later does not make the message look changed.
+
+        :return: The JSON payload to encrypt and its digest.
+        """
+        data = self._sanitize_input(message)
+        payload = json.dumps(data, sort_keys=True, default=str)
+        content = {k: v for k, v in data.items() if k not in DERIVED_MESSAGE_FIELDS}
+        digest_source = payload if len(content) == len(data) else json.dumps(content, sort_keys=True, default=str)
+        return payload, hashlib.sha256(digest_source.encode()).hexdigest()
+
+    def _message_digest(self, message: Dict[str, Any]) -> str:
+        return self._serialize_message(message)[1]
+
+    def _encrypt_message(self, message: Dict[str, Any]) -> str:
+        """加密单条消息"""
+        return self.encryptor.encrypt(self._serialize_message(message)[0])
+
+    def _decrypt_message(self, encrypted_message: str) -> Dict[str, Any]:
+        """解密单条消息，并将时间戳字符串转换回 datetime 对象"""
+        message = json.loads(self.encryptor.decrypt(encrypted_message))
+        if 'created_at' in message and message['created_at']:
+            message['created_at'] = datetime.fromisoformat(message['created_at'])
+        if 'updated_at' in message and message['updated_at']:
+            message['updated_at'] = datetime.fromisoformat(message['updated_at'])
+        return message
+
+    def _offload_images(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace inline base64 images with blob store references."""
+        if self.blob_store is None:
+            return message
+        return offload_message_images(message, self.blob_store)
+
+    def _message_row(
+        self,
+        sess: Session,
+        run_id: str,
+        seq: int,
+        message: Dict[str, Any],
+        digest: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Build a message log row, counting the blobs the message references."""
+        blob_digests = message_blob_digests(message)
+        if blob_digests:
+            self._pending_blob_refs(sess).update(blob_digests)
+        payload, payload_digest = self._serialize_message(message)
+        return {
+            "run_id": run_id,
+            "seq": seq,
+            "digest": digest or payload_digest,
+            "message": self.encryptor.encrypt(payload),
+            "blob_refs": ",".join(blob_digests) or None,
+            "created_at": datetime.now(),
+        }
+
+    @staticmethod
+    def _pending_blob_refs(sess: Session) -> Counter:
+        """Reference count changes of the current transaction, applied by `_apply_blob_ref_deltas`."""
+        return sess.info.setdefault("blob_ref_deltas", Counter())
+
+    def _release_blob_refs(self, sess: Session, *where) -> None:
+        """Count the blobs referenced by message rows that are about to be deleted."""
+        if self.blob_store is None:
+            return
+        refs = sess.execute(
+            select(self.messages_table.c.blob_refs).where(*where, self.messages_table.c.blob_refs.isnot(None))
+        ).scalars().all()
+        self._pending_blob_refs(sess).subtract(count_blob_refs(refs))
+
+    def _apply_blob_ref_deltas(self, sess: Session) -> None:
+        deltas = sess.info.pop("blob_ref_deltas", None)
+        if not deltas:
+            return
+        try:
+            self.blob_store.update_refs(deltas)
+        except Exception as e:
+            logger.error(f"Error updating blob reference counts: {e}")
+
+    def _discard_blob_ref_deltas(self, sess: Session) -> None:
+        sess.info.pop("blob_ref_deltas", None)
+
+    def _sync_messages(self, sess: Session, run_id: str, chat_history: List[Dict[str, Any]]) -> int:
+        """
+        Make the stored message log of a run equal to `chat_history`.
+
+        Only the messages after the longest unchanged prefix are deleted and re-inserted,
+        so appending a message encrypts and writes just that message.
+
+        :return: The number of messages written.
+        """
+        stored_digests = sess.execute(
+            select(self.messages_table.c.digest)
+            .where(self.messages_table.c.run_id == run_id)
+            .order_by(self.messages_table.c.seq)
+        ).scalars().all()
+
+        chat_history = [self._offload_images(message) for message in chat_history]
+        prefix = 0
+        digests = []
+        for message in chat_history:
+            digest = self._message_digest(message)
+            if prefix == len(digests) and prefix < len(stored_digests) and stored_digests[prefix] == digest:
+                prefix += 1
+            digests.append(digest)
+
+        if prefix < len(stored_digests):
+            stale = (self.messages_table.c.run_id == run_id, self.messages_table.c.seq >= prefix)
+            self._release_blob_refs(sess, *stale)
+            sess.execute(delete(self.messages_table).where(*stale))
+        new_rows = [
+            self._message_row(sess, run_id, seq, chat_history[seq], digests[seq])
+            for seq in range(prefix, len(chat_history))
+        ]
+        if new_rows:
+            sess.execute(self.messages_table.insert(), new_rows)
+        return len(new_rows)
+
+    def _load_messages(
+        self,
+        sess: Session,
+        run_id: str,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Load and decrypt the messages with start <= seq < stop."""
+        stmt = select(self.messages_table.c.message).where(
+            self.messages_table.c.run_id == run_id,
+            self.messages_table.c.seq >= start
+        )
+        if stop is not None:
+            stmt = stmt.where(self.messages_table.c.seq < stop)
+        rows = sess.execute(stmt.order_by(self.messages_table.c.seq)).scalars().all()
+        return [self._decrypt_message(message) for message in rows]
+
+    def _attach_chat_history(self, sess: Session, decrypted_row: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Put the chat history of a run into `memory["chat_history"]`.
+
+        Rows written before the message log existed keep their history inside the `memory` column;
+        they are migrated to the message log the first time they are read.
+        """
+        memory = decrypted_row.get('memory') or {}
+        if 'chat_history' in memory:
+            # `sess` may be a read-only session, migrate through the writer
+            with self.Session() as write_sess, write_sess.begin():
+                self._sync_messages(write_sess, decrypted_row['run_id'], memory['chat_history'])
+                legacy_memory = {k: v for k, v in memory.items() if k != 'chat_history'}
+                write_sess.execute(
+                    update(self.table)
+                    .where(self.table.c.run_id == decrypted_row['run_id'])
+                    .values(**self._encrypt_sensitive_data({'memory': legacy_memory}))
+                )
+            logger.info(f"Migrated chat history of run_id {decrypted_row['run_id']} to the message log")
+        else:
+            memory = {**memory, 'chat_history': self._load_messages(sess, decrypted_row['run_id'])}
+        decrypted_row['memory'] = memory
+        return decrypted_row
+
+    @staticmethod
+    def _pop_chat_history(fields: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[List[Dict[str, Any]]]]:
+        """Split the chat history out of `memory` so it is stored in the message log instead."""
+        fields = dict(fields)
+        chat_history = fields.pop('chat_history', None)
+        if 'memory.chat_history' in fields:
+            chat_history = fields.pop('memory.chat_history')
+        if isinstance(fields.get('memory'), dict) and 'chat_history' in fields['memory']:
+            memory = dict(fields['memory'])
+            chat_history = memory.pop('chat_history')
+            fields['memory'] = memory
+        return fields, chat_history
+
     def get_table(self) -> Table:
         return Table(
             self.table_name,
@@ -171,21 +402,57 @@ class SqlAssistantStorage(Sqlstorage):
             # -*- Assistant memory
             Column("memory", sqlite.JSON),
             # Metadata associated with this assistant
-            Column("assistant_data", sqlite.JSON),
+            Column("assistant_data", CompressedJSON(self.codec, "assistant_data")),
             # Metadata associated with this run
-            Column("run_data", sqlite.JSON),
+            Column("run_data", CompressedJSON(self.codec, "run_data")),
             # Metadata associated the user participating in this run
-            Column("user_data", sqlite.JSON),
+            Column("user_data", CompressedJSON(self.codec, "user_data")),
             # Metadata associated with the assistant tasks
-            Column("task_data", sqlite.JSON),
+            Column("task_data", CompressedJSON(self.codec, "task_data")),
             # The timestamp of when this run was created.
-            Column("created_at", sqlite.DATETIME, default=datetime.now()),
+            Column("created_at", sqlite.DATETIME, default=datetime.now),
             # The timestamp of when this run was last updated.
-            Column("updated_at", sqlite.DATETIME, onupdate=datetime.now()),
+            Column("updated_at", sqlite.DATETIME, onupdate=datetime.now),
+            # Indexes for listing the dialogs of a user
+            Index(f"ix_{self.table_name}_user_id_created_at", "user_id", "created_at"),
+            Index(f"ix_{self.table_name}_user_id_updated_at", "user_id", "updated_at"),
             extend_existing=True,
             sqlite_autoincrement=True,
         )
 
+    def get_messages_table(self) -> Table:
+        return Table(
+            f"{self.table_name}_messages",
+            self.metadata,
+            # Run the message belongs to
+            Column("run_id", String, nullable=False),
+            # Position of the message in the chat history, starting at 0
+            Column("seq", Integer, nullable=False),
+            # SHA-256 of the stored plaintext without derived fields, used to find the unchanged prefix without decrypting
+            Column("digest", String(64), nullable=False),
+            # -*- Encrypted message
+            Column("message", sqlite.JSON),
+            # Comma separated digests of the blob store images the message references
+            Column("blob_refs", String),
+            # The timestamp of when this message was stored.
+            Column("created_at", sqlite.DATETIME, default=datetime.now),
+            PrimaryKeyConstraint("run_id", "seq"),
+            extend_existing=True,
+        )
+
+    def get_codec_dicts_table(self) -> Table:
+        return Table(
+            f"{self.table_name}_codec_dicts",
+            self.metadata,
+            # zstd dictionary ID, stored in every frame compressed with the dictionary
+            Column("dict_id", Integer, primary_key=True),
+            # Column the dictionary was trained on, the newest one is used for writes
+            Column("column", String, nullable=False),
+            Column("data", LargeBinary, nullable=False),
+            Column("created_at", sqlite.DATETIME, default=datetime.now),
+            extend_existing=True,
+        )
+
     def table_exists(self) -> bool:
         # logger.debug(f"Checking if table exists: {self.table.name}")
         try:
@@ -198,6 +465,18 @@ class SqlAssistantStorage(Sqlstorage):
         if not self.table_exists():
             logger.info(f"Creating table: {self.table.name}")
             self.table.create(self.db_engine)
+        self._create_missing_schema()
+
+    def _create_missing_schema(self) -> None:
+        """Create the message log and indexes that databases from older versions do not have yet."""
+        self.messages_table.create(self.db_engine, checkfirst=True)
+        message_columns = {c["name"] for c in inspect(self.db_engine).get_columns(self.messages_table.name)}
+        if "blob_refs" not in message_columns:
+            with self.db_engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE "{self.messages_table.name}" ADD COLUMN blob_refs VARCHAR'))
+        self.codec_dicts_table.create(self.db_engine, checkfirst=True)
+        for index in self.table.indexes:
+            index.create(self.db_engine, checkfirst=True)
 
     def _read(self, session: Session, run_id: str) -> Optional[Row[Any]]:
         stmt = select(self.table).where(self.table.c.run_id == run_id)
@@ -211,10 +490,10 @@ class SqlAssistantStorage(Sqlstorage):
         return None
 
     def read(self, run_id: str) -> Optional[AssistantRun]:
-        with self.Session() as sess:
+        with self.ReadSession() as sess:
             existing_row: Optional[Row[Any]] = self._read(session=sess, run_id=run_id)
             if existing_row is not None:
-                decrypted_row = self._decrypt_sensitive_data(existing_row)
+                decrypted_row = self._attach_chat_history(sess, self._decrypt_sensitive_data(existing_row))
                 return AssistantRun.model_validate(decrypted_row)
             return None
 
@@ -225,9 +504,9 @@ class SqlAssistantStorage(Sqlstorage):
         ) -> List[str]:
         run_ids: List[str] = []
         try:
-            with self.Session() as sess:
+            with self.ReadSession() as sess:
                 # get all run_ids for this user
-                stmt = select(self.table)
+                stmt = select(self.table.c.run_id)
                 if user_id is not None:
                     stmt = stmt.where(self.table.c.user_id == user_id)
                 if filter == "created_at":
@@ -238,10 +517,7 @@ class SqlAssistantStorage(Sqlstorage):
                     stmt = stmt.order_by(self.table.c.updated_at.desc())
                 # execute query
                 rows = sess.execute(stmt).fetchall()
-                for row in rows:
-                    if row is not None and row.run_id is not None:
-                        decrypted_row = self._decrypt_sensitive_data(row)
-                        run_ids.append(decrypted_row['run_id'])
+                run_ids = [row.run_id for row in rows if row is not None and row.run_id is not None]
         except OperationalError:
             logger.debug(f"Table does not exist: {self.table.name}")
             pass
@@ -263,7 +539,7 @@ class SqlAssistantStorage(Sqlstorage):
                 logger.debug("No user_id provided, returning empty list")
                 return []
             
-            with self.Session() as sess:
+            with self.ReadSession() as sess:
                 # get all runs for this user
                 stmt = select(self.table)
                 if not debug_mode and user_id is not None:
@@ -276,21 +552,85 @@ class SqlAssistantStorage(Sqlstorage):
                 rows = sess.execute(stmt).fetchall()
                 for row in rows:
                     if row.run_id is not None:
-                        decrypted_row = self._decrypt_sensitive_data(row)
+                        decrypted_row = self._attach_chat_history(sess, self._decrypt_sensitive_data(row))
                         conversations.append(AssistantRun.model_validate(decrypted_row))
         except OperationalError:
             logger.debug(f"Table does not exist: {self.table.name}")
             pass
         return conversations
     
-    def get_specific_run(self, run_id: str, user_id: Optional[str] = None) -> Optional[AssistantRun]:
+    def list_runs(
+            self,
+            user_id: Optional[str] = None,
+            order_by: Literal["created_at", "updated_at"] = "created_at",
+            limit: Optional[int] = None,
+            after: Optional[AssistantRunSummary] = None,
+            debug_mode: bool = False
+        ) -> List[AssistantRunSummary]:
+        """
+        List runs as (run_id, run_name, created_at, updated_at) without reading or decrypting their data.
+
+        Results are ordered newest first and paginated by keyset: pass the last summary of
+        a page as `after` to get the next page, which stays cheap however many runs a user has.
+
+        :param user_id: The user whose runs to list.
+        :param order_by: The timestamp column to order by.
+        :param limit: The maximum number of runs to return, all if None.
+        :param after: The last run of the previous page.
+        :param debug_mode: If True, list the runs of all users.
+        """
+        if user_id is None and not debug_mode:
+            logger.debug("No user_id provided, returning empty list")
+            return []
+
+        order_column = self.table.c[order_by]
+        stmt = select(
+            self.table.c.run_id,
+            self.table.c.run_name,
+            self.table.c.created_at,
+            self.table.c.updated_at,
+        )
+        if not debug_mode:
+            stmt = stmt.where(self.table.c.user_id == user_id)
+        if after is not None:
+            after_value = getattr(after, order_by)
+            stmt = stmt.where(
+                or_(
+                    order_column < after_value,
+                    and_(order_column == after_value, self.table.c.run_id < after.run_id),
+                )
+            )
+        stmt = stmt.order_by(order_column.desc(), self.table.c.run_id.desc())
+        if limit is not None:
+            stmt = stmt.limit(limit)
+
+        try:
+            with self.ReadSession() as sess:
+                rows = sess.execute(stmt).fetchall()
+        except OperationalError:
+            logger.debug(f"Table does not exist: {self.table.name}")
+            return []
+        return [AssistantRunSummary.model_validate(row._mapping) for row in rows]
+
+    def get_specific_run(
+        self,
+        run_id: str,
+        user_id: Optional[str] = None,
+        with_chat_history: bool = True,
+    ) -> Optional[AssistantRun]:
+        """
+        Read a run owned by `user_id`.
+
+        :param with_chat_history: Load and decrypt the whole chat history into `memory["chat_history"]`.
+            Pass False when only the run's config is needed, and page the history with `get_chat_history`.
+        """
         try:
             # 如果没有提供user_id，直接返回None
             if user_id is None:
                 logger.debug("No user_id provided, returning None")
                 return None
             
-            with self.Session() as sess:
+            with self.ReadSession() as sess:
                 stmt = select(self.table).where(
                     self.table.c.run_id == run_id,
                     self.table.c.user_id == user_id
@@ -298,12 +638,66 @@ class SqlAssistantStorage(Sqlstorage):
                 row = sess.execute(stmt).first()
                 if row is not None:
                     decrypted_row = self._decrypt_sensitive_data(row)
+                    if with_chat_history:
+                        decrypted_row = self._attach_chat_history(sess, decrypted_row)
                     return AssistantRun.model_validate(decrypted_row)
         except OperationalError:
             logger.debug(f"Table does not exist: {self.table.name}")
         return None
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=15))
+    def _build_upsert_stmt(self, row: AssistantRun):
+        """Build an insert-or-update statement for a single assistant run with sensitive data encrypted."""
+        # The chat history is stored in the message log, see `_upsert_row`
+        data, _ = self._pop_chat_history(row.model_dump())
+        # Before upserting, encrypt sensitive data
+        encrypted_data = self._encrypt_sensitive_data(self._sanitize_input(data))
+        
+        if not encrypted_data:
+            raise ValueError("Failed to encrypt data")
+        
+        # Create an insert statement
+        stmt = sqlite.insert(self.table).values(
+            run_id=encrypted_data['run_id'],
+            name=encrypted_data['name'],
+            run_name=encrypted_data['run_name'],
+            user_id=encrypted_data['user_id'],
+            llm=encrypted_data['llm'],
+            memory=encrypted_data['memory'],
+            assistant_data=encrypted_data['assistant_data'],
+            run_data=encrypted_data['run_data'],
+            user_data=encrypted_data['user_data'],
+            task_data=encrypted_data['task_data'],
+            updated_at=datetime.now(),
+        )
+
+        # Define the upsert if the run_id already exists
+        update_dict = {
+            'name': encrypted_data['name'],
+            'run_name': encrypted_data['run_name'],
+            'user_id': encrypted_data['user_id'],
+            'llm': encrypted_data['llm'],
+            'memory': encrypted_data['memory'],
+            'assistant_data': encrypted_data['assistant_data'],
+            'run_data': encrypted_data['run_data'],
+            'user_data': encrypted_data['user_data'],
+            'task_data': encrypted_data['task_data'],
+            'updated_at': datetime.now(),
+        }
+
+        # Filter out None values if necessary
+        update_dict = {k: v for k, v in update_dict.items() if v is not None}
+
+        return stmt.on_conflict_do_update(
+            index_elements=["run_id"],
+            set_=update_dict,  # The updated value for each column
+        )
+
+    def _upsert_row(self, sess: Session, row: AssistantRun) -> None:
+        sess.execute(self._build_upsert_stmt(row))
+        _, chat_history = self._pop_chat_history({'memory': row.memory})
+        if chat_history is not None:
+            self._sync_messages(sess, row.run_id, chat_history)
+
     def upsert(self, row: AssistantRun) -> Optional[AssistantRun]:
         """
         Create a new assistant run if it does not exist, otherwise update the existing conversation.
@@ -312,65 +706,430 @@ class SqlAssistantStorage(Sqlstorage):
         with self.Session() as sess:
             try:
                 logger.debug(f"Starting upsert for run_id: {row.run_id}")
-                # Before upserting, encrypt sensitive data
-                encrypted_data = self._encrypt_sensitive_data(
-                    self._sanitize_input(row.model_dump())
-                )
-                
-                if not encrypted_data:
-                    logger.error("Failed to encrypt data")
-                    return None
-                
-                # Create an insert statement
-                stmt = sqlite.insert(self.table).values(
-                    run_id=encrypted_data['run_id'],
-                    name=encrypted_data['name'],
-                    run_name=encrypted_data['run_name'],
-                    user_id=encrypted_data['user_id'],
-                    llm=encrypted_data['llm'],
-                    memory=encrypted_data['memory'],
-                    assistant_data=encrypted_data['assistant_data'],
-                    run_data=encrypted_data['run_data'],
-                    user_data=encrypted_data['user_data'],
-                    task_data=encrypted_data['task_data'],
-                    updated_at=datetime.now(),
-                )
-
-                # Define the upsert if the run_id already exists
-                update_dict = {
-                    'name': encrypted_data['name'],
-                    'run_name': encrypted_data['run_name'],
-                    'user_id': encrypted_data['user_id'],
-                    'llm': encrypted_data['llm'],
-                    'memory': encrypted_data['memory'],
-                    'assistant_data': encrypted_data['assistant_data'],
-                    'run_data': encrypted_data['run_data'],
-                    'user_data': encrypted_data['user_data'],
-                    'task_data': encrypted_data['task_data'],
-                    'updated_at': datetime.now(),
-                }
-
-                # Filter out None values if necessary
-                update_dict = {k: v for k, v in update_dict.items() if v is not None}
-
-                stmt = stmt.on_conflict_do_update(
-                    index_elements=["run_id"],
-                    set_=update_dict,  # The updated value for each column
-                )
-
-                sess.execute(stmt)
+                self._upsert_row(sess, row)
                 sess.commit()  # Make sure to commit the changes to the database
                 logger.info(f"Successfully upserted run_id: {row.run_id} in {time.time() - start_time:.2f}s")
-                return self.read(run_id=encrypted_data['run_id'])
+                return self.read(run_id=row.run_id)
             except Exception as e:
                 logger.error(f"Error during upsert: {e}")
                 sess.rollback()
                 return None
 
+    def upsert_many(self, rows: List[AssistantRun]) -> int:
+        """
+        Upsert several assistant runs in a single transaction, without reading them back.
+
+        :param rows: The assistant runs to upsert.
+        :return: The number of rows written, 0 if the transaction was rolled back.
+        """
+        start_time = time.time()
+        with self.Session() as sess:
+            try:
+                for row in rows:
+                    self._upsert_row(sess, row)
+                sess.commit()
+                logger.info(f"Successfully upserted {len(rows)} runs in {time.time() - start_time:.2f}s")
+                return len(rows)
+            except Exception as e:
+                logger.error(f"Error during batch upsert: {e}")
+                sess.rollback()
+                return 0
+
+    def _update_fields(
+        self,
+        sess: Session,
+        run_id: str,
+        user_id: str,
+        fields: Dict[str, Any],
+    ) -> bool:
+        """
+        Update only the given columns of a run inside an existing session.
+
+        A field is either a column name, or "column.key" to set a single key inside a JSON column.
+        The `chat_history` field (or `memory.chat_history`) is written to the message log.
+        Keys inside a JSON column read only that column and merge in Python, because
+        encrypted and compressed values cannot be edited with SQLite's JSON functions.
+
+        :return: True if the run exists and was updated.
+        """
+        fields, chat_history = self._pop_chat_history(fields)
+        values: Dict[str, Any] = {}
+        json_keys: Dict[str, Dict[str, Any]] = {}
+        for field, value in fields.items():
+            column, _, key = field.partition(".")
+            if column not in self.table.c or column in ("run_id", "user_id"):
+                raise ValueError(f"Unknown or immutable column: {column}")
+            if key:
+                json_keys.setdefault(column, {})[key] = value
+            else:
+                values[column] = value
+
+        where = (self.table.c.run_id == run_id, self.table.c.user_id == user_id)
+        read_columns = [c for c in json_keys if c not in values]
+        if read_columns:
+            row = sess.execute(
+                select(*[self.table.c[c] for c in read_columns]).where(*where)
+            ).first()
+            if row is None:
+                return False
+            current = self._decrypt_sensitive_data(row)
+            for column in read_columns:
+                values[column] = {**(current.get(column) or {}), **json_keys.pop(column)}
+        for column, keys in json_keys.items():
+            values[column] = {**(values[column] or {}), **keys}
+
+        # 调用方可以传入修改发生的时间，写缓冲延迟写入时仍然保留原始的更新时间
+        updated_at = values.pop('updated_at', None) or datetime.now()
+        values = self._encrypt_sensitive_data(self._sanitize_input(values))
+        values['updated_at'] = updated_at
+
+        result = sess.execute(update(self.table).where(*where).values(**values))
+        if result.rowcount == 0:
+            return False
+        if chat_history is not None:
+            self._sync_messages(sess, run_id, chat_history)
+        return True
+
+    def update_fields(
+        self,
+        run_id: str,
+        user_id: Optional[str],
+        fields: Dict[str, Any],
+        read_back: bool = False,
+    ) -> Optional[AssistantRun] | bool:
+        """
+        Update only the given columns of an existing run, without rewriting the whole row.
+
+        :param run_id: The run to update.
+        :param user_id: The user that owns the run.
+        :param fields: Column names (or "column.key" for a key inside a JSON column) mapped to new values.
+        :param read_back: If True, read and return the updated run.
+        :return: The updated run if `read_back`, otherwise whether the run was updated.
+        """
+        if user_id is None:
+            logger.debug("No user_id provided, skipping update")
+            return None if read_back else False
+        with self.Session() as sess:
+            try:
+                updated = self._update_fields(sess, run_id, user_id, fields)
+                sess.commit()
+            except Exception as e:
+                logger.error(f"Error updating {list(fields)} of run_id {run_id}: {e}")
+                sess.rollback()
+                return None if read_back else False
+        if read_back:
+            return self.get_specific_run(run_id, user_id) if updated else None
+        return updated
+
+    def update_many(
+        self,
+        updates: Dict[str, Tuple[Optional[str], Dict[str, Any]]],
+        raise_on_error: bool = False,
+    ) -> List[str]:
+        """
+        Apply partial updates to several runs in a single transaction.
+
+        :param updates: run_id mapped to (user_id, fields), see `update_fields`.
+        :param raise_on_error: Re-raise after rolling back instead of returning an empty list,
+            so callers can tell a failed transaction from runs that do not exist.
+        :return: The run_ids that were updated, empty if the transaction was rolled back.
+        """
+        start_time = time.time()
+        updated: List[str] = []
+        with self.Session() as sess:
+            try:
+                for run_id, (user_id, fields) in updates.items():
+                    if user_id is not None and self._update_fields(sess, run_id, user_id, fields):
+                        updated.append(run_id)
+                sess.commit()
+            except Exception as e:
+                logger.error(f"Error during batch update: {e}")
+                sess.rollback()
+                if raise_on_error:
+                    raise
+                return []
+        logger.info(f"Successfully updated {len(updated)} runs in {time.time() - start_time:.2f}s")
+        return updated
+
+    def update_run_name(self, run_id: str, user_id: Optional[str], run_name: str, read_back: bool = False):
+        """Update only the `run_name` column of a run."""
+        return self.update_fields(run_id, user_id, {"run_name": run_name}, read_back=read_back)
+
+    def update_llm(self, run_id: str, user_id: Optional[str], llm: Dict[str, Any], read_back: bool = False):
+        """Update only the encrypted `llm` column of a run."""
+        return self.update_fields(run_id, user_id, {"llm": llm}, read_back=read_back)
+
+    def update_memory(self, run_id: str, user_id: Optional[str], memory: Dict[str, Any], read_back: bool = False):
+        """Update only the encrypted `memory` column of a run."""
+        return self.update_fields(run_id, user_id, {"memory": memory}, read_back=read_back)
+
+    def update_assistant_data(self, run_id: str, user_id: Optional[str], assistant_data: Dict[str, Any], read_back: bool = False):
+        """Update only the `assistant_data` column of a run."""
+        return self.update_fields(run_id, user_id, {"assistant_data": assistant_data}, read_back=read_back)
+
+    def update_run_data(self, run_id: str, user_id: Optional[str], run_data: Dict[str, Any], read_back: bool = False):
+        """Update only the `run_data` column of a run."""
+        return self.update_fields(run_id, user_id, {"run_data": run_data}, read_back=read_back)
+
+    def update_task_data(self, run_id: str, user_id: Optional[str], task_data: Dict[str, Any], read_back: bool = False):
+        """Update only the `task_data` column of a run."""
+        return self.update_fields(run_id, user_id, {"task_data": task_data}, read_back=read_back)
+
+    def append_messages(self, run_id: str, user_id: Optional[str], messages: List[Dict[str, Any]]) -> int:
+        """
+        Append messages to the chat history of a run, encrypting and writing only the new messages.
+
+        :return: The number of messages appended.
+        """
+        if user_id is None:
+            logger.debug("No user_id provided, skipping append")
+            return 0
+        with self.Session() as sess, sess.begin():
+            owned = sess.execute(
+                select(self.table.c.run_id).where(
+                    self.table.c.run_id == run_id,
+                    self.table.c.user_id == user_id
+                )
+            ).first()
+            if owned is None:
+                return 0
+            next_seq = sess.execute(
+                select(func.count()).where(self.messages_table.c.run_id == run_id)
+            ).scalar_one()
+            sess.execute(
+                self.messages_table.insert(),
+                [
+                    self._message_row(sess, run_id, next_seq + offset, self._offload_images(message))
+                    for offset, message in enumerate(messages)
+                ]
+            )
+            sess.execute(
+                update(self.table)
+                .where(self.table.c.run_id == run_id)
+                .values(updated_at=datetime.now())
+            )
+        return len(messages)
+
+    def truncate_messages(self, run_id: str, user_id: Optional[str], length: int) -> int:
+        """
+        Keep only the first `length` messages of the chat history of a run.
+
+        :return: The number of messages deleted.
+        """
+        if user_id is None:
+            logger.debug("No user_id provided, skipping truncate")
+            return 0
+        with self.Session() as sess, sess.begin():
+            result = sess.execute(
+                update(self.table)
+                .where(self.table.c.run_id == run_id, self.table.c.user_id == user_id)
+                .values(updated_at=datetime.now())
+            )
+            if result.rowcount == 0:
+                return 0
+            stale = (self.messages_table.c.run_id == run_id, self.messages_table.c.seq >= max(length, 0))
+            self._release_blob_refs(sess, *stale)
+            return sess.execute(delete(self.messages_table).where(*stale)).rowcount
+
+    def count_messages(self, run_id: str) -> int:
+        """Count the messages in the chat history of a run without decrypting them."""
+        with self.ReadSession() as sess:
+            return sess.execute(
+                select(func.count()).where(self.messages_table.c.run_id == run_id)
+            ).scalar_one()
+
+    def get_chat_history(
+        self,
+        run_id: str,
+        user_id: Optional[str],
+        limit: Optional[int] = None,
+        before: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Load a page of the chat history of a run, newest page first.
+
+        :param run_id: The run to read.
+        :param user_id: The user that owns the run.
+        :param limit: The maximum number of messages to return, all if None.
+        :param before: Only return messages whose position is lower than this, for paging backwards.
+        :return: The messages of the page in chronological order.
+        """
+        if user_id is None:
+            logger.debug("No user_id provided, returning empty list")
+            return []
+        with self.ReadSession() as sess:
+            row = sess.execute(
+                select(self.table.c.run_id, self.table.c.memory).where(
+                    self.table.c.run_id == run_id,
+                    self.table.c.user_id == user_id
+                )
+            ).first()
+            if row is None:
+                return []
+            decrypted_row = self._decrypt_sensitive_data(row)
+            if 'chat_history' in (decrypted_row.get('memory') or {}):
+                # Legacy row, migrate it first
+                self._attach_chat_history(sess, decrypted_row)
+
+            stop = before
+            if stop is None:
+                stop = sess.execute(
+                    select(func.count()).where(self.messages_table.c.run_id == run_id)
+                ).scalar_one()
+            start = 0 if limit is None else max(stop - limit, 0)
+            return self._load_messages(sess, run_id, start=start, stop=stop)
+
+    def get_lazy_chat_history(
+        self,
+        run_id: str,
+        user_id: Optional[str],
+        page_size: int = 50,
+    ) -> "LazyChatHistory":
+        """Get a read-only sequence over the chat history of a run that loads pages on demand."""
+        return LazyChatHistory(self, run_id, user_id, page_size=page_size)
+
+    def _load_codec_dicts(self) -> None:
+        """Register the stored zstd dictionaries, newer dictionaries win for writes."""
+        try:
+            with self.ReadSession() as sess:
+                rows = sess.execute(
+                    select(self.codec_dicts_table).order_by(self.codec_dicts_table.c.created_at)
+                ).fetchall()
+        except Exception as e:
+            logger.error(f"Error loading compression dictionaries of {self.table_name}: {e}")
+            return
+        for row in rows:
+            try:
+                self.codec.add_dictionary(row.column, row.data)
+            except ImportError as e:
+                logger.warning(f"Cannot load compression dictionary {row.dict_id}: {e}")
+                return
+
+    def train_compression_dictionary(
+        self,
+        column: Literal["assistant_data", "run_data", "user_data", "task_data"],
+        sample_size: int = 1000,
+        dict_size: int = 112640,
+    ) -> int:
+        """
+        Train a zstd dictionary on the existing values of a column and use it for new writes.
+
+        Small JSON documents share most of their keys, a dictionary lets zstd compress them
+        well even though each one is too short to compress on its own.
+        Rows written before keep their own codec byte and stay readable.
+
+        :param column: The compressed column to train on.
+        :param sample_size: Number of most recently updated rows to sample.
+        :param dict_size: Maximum dictionary size in bytes.
+        :return: The ID of the new dictionary.
+        """
+        if not isinstance(self.table.c[column].type, CompressedJSON):
+            raise ValueError(f"Column {column} is not compressed")
+        with self.ReadSession() as sess:
+            samples = sess.execute(
+                select(self.table.c[column])
+                .where(self.table.c[column].isnot(None))
+                .order_by(self.table.c.updated_at.desc())
+                .limit(sample_size)
+            ).scalars().all()
+        dict_data = train_zstd_dictionary(samples, dict_size=dict_size)
+        dict_id = self.codec.add_dictionary(column, dict_data)
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                delete(self.codec_dicts_table).where(self.codec_dicts_table.c.dict_id == dict_id)
+            )
+            sess.execute(
+                self.codec_dicts_table.insert().values(dict_id=dict_id, column=column, data=dict_data)
+            )
+        logger.info(f"Trained zstd dictionary {dict_id} on {len(samples)} values of {self.table_name}.{column}")
+        return dict_id
+
+    def _reencrypt_column(
+        self,
+        table: Table,
+        key_columns: List[str],
+        column: str,
+        batch_size: int,
+    ) -> int:
+        """Re-encrypt the values of one encrypted column that need it, in keyset-paginated batches."""
+        needs_reencryption = getattr(self.encryptor, "needs_reencryption", None)
+        if needs_reencryption is None:
+            return 0
+
+        count = 0
+        last_key = None
+        keys = [table.c[k] for k in key_columns]
+        while True:
+            stmt = select(*keys, table.c[column]).order_by(*keys).limit(batch_size)
+            if last_key is not None:
+                stmt = stmt.where(tuple_(*keys) > tuple_(*last_key))
+            with self.ReadSession() as sess:
+                rows = sess.execute(stmt).fetchall()
+            if not rows:
+                return count
+            last_key = tuple(rows[-1][:len(keys)])
+
+            updates = []
+            for row in rows:
+                value = row[len(keys)]
+                if isinstance(value, str) and value and needs_reencryption(value):
+                    updates.append((row[:len(keys)], value, self.encryptor.encrypt(self.encryptor.decrypt(value))))
+            if not updates:
+                continue
+            with self.Session() as sess, sess.begin():
+                for key, old_value, new_value in updates:
+                    # Only replace the value if it was not rewritten in the meantime,
+                    # compared as the raw JSON text stored in the column
+                    result = sess.execute(
+                        update(table)
+                        .where(
+                            *[k == v for k, v in zip(keys, key)],
+                            type_coerce(table.c[column], String) == json.dumps(old_value)
+                        )
+                        .values(**{column: new_value})
+                    )
+                    count += result.rowcount
+
+    def reencrypt_rows(self, batch_size: int = 200) -> int:
+        """
+        Re-encrypt stored runs and messages written in an older format or with a rotated-out key.
+
+        :return: The number of values re-encrypted.
+        """
+        start_time = time.time()
+        count = 0
+        for column in ('llm', 'memory'):
+            count += self._reencrypt_column(self.table, ['run_id'], column, batch_size)
+        count += self._reencrypt_column(self.messages_table, ['run_id', 'seq'], 'message', batch_size)
+        if count:
+            logger.info(f"Re-encrypted {count} values of {self.table_name} in {time.time() - start_time:.2f}s")
+        return count
+
+    def start_background_reencryption(self, batch_size: int = 200) -> None:
+        """Run `reencrypt_rows` once per process and table in a daemon thread."""
+        key = (str(self.db_engine.url), self.table_name)
+        with _REENCRYPTION_LOCK:
+            if key in _REENCRYPTION_STARTED:
+                return
+            _REENCRYPTION_STARTED.add(key)
+
+        def _run():
+            try:
+                self.reencrypt_rows(batch_size=batch_size)
+            except Exception as e:
+                logger.error(f"Error re-encrypting {self.table_name}: {e}")
+
+        Thread(target=_run, daemon=True, name=f"reencrypt-{self.table_name}").start()
+
     def delete_table(self) -> None:
         if self.table_exists():
             logger.debug(f"Deleting table: {self.table_name}")
             self.table.drop(self.db_engine)
+        if self.blob_store is not None and inspect(self.db_engine).has_table(self.messages_table.name):
+            with self.Session() as sess, sess.begin():
+                self._release_blob_refs(sess)
+        self.messages_table.drop(self.db_engine, checkfirst=True)
+        self.codec_dicts_table.drop(self.db_engine, checkfirst=True)
     
     def delete_run(self, run_id: str, user_id: Optional[str] = None) -> None:
         if user_id is None:
@@ -381,5 +1140,72 @@ class SqlAssistantStorage(Sqlstorage):
                 self.table.c.run_id == run_id,
                 self.table.c.user_id == user_id
             )
-            sess.execute(stmt)
+            result = sess.execute(stmt)
+            if result.rowcount > 0:
+                self._release_blob_refs(sess, self.messages_table.c.run_id == run_id)
+                sess.execute(
+                    delete(self.messages_table).where(self.messages_table.c.run_id == run_id)
+                )
             logger.info(f"Deleted assistant run: run_id = {run_id}")
+
+
+class LazyChatHistory(Sequence[Dict[str, Any]]):
+    """
+    A read-only sequence over the chat history of a run.
+
+    Messages are loaded and decrypted page by page only when accessed, so taking
+    the last N messages (e.g. `history[-N:]` in `MessageHistoryTransform`) does not
+    load the whole conversation.
+    """
+
+    def __init__(
+        self,
+        storage: SqlAssistantStorage,
+        run_id: str,
+        user_id: Optional[str],
+        page_size: int = 50,
+    ):
+        self._storage = storage
+        self._run_id = run_id
+        self._user_id = user_id
+        self._page_size = page_size
+        self._length: Optional[int] = None
+        self._pages: Dict[int, List[Dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        if self._length is None:
+            self._length = self._storage.count_messages(self._run_id)
+        return self._length
+
+    def _page(self, page: int) -> List[Dict[str, Any]]:
+        if page not in self._pages:
+            stop = min((page + 1) * self._page_size, len(self))
+            self._pages[page] = self._storage.get_chat_history(
+                self._run_id, self._user_id, limit=stop - page * self._page_size, before=stop
+            )
+        return self._pages[page]
+
+    @overload
+    def __getitem__(self, index: int) -> Dict[str, Any]: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Dict[str, Any]]: ...
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1 and stop > start:
+                # Load the covered pages once instead of one query per message
+                return self._storage.get_chat_history(
+                    self._run_id, self._user_id, limit=stop - start, before=stop
+                )
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chat history index out of range")
+        return self._page(index // self._page_size)[index % self._page_size]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for page in range((len(self) + self._page_size - 1) // self._page_size):
+            yield from self._page(page)
@@ -0,0 +1,106 @@
+try:
+    from sqlalchemy.types import String, TypeDecorator
+except ImportError:
+    raise ImportError("`sqlalchemy` not installed")
+
+import json
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from core.compression import (
+    CompressionCodec,
+    compress,
+    decompress,
+    default_codec,
+    resolve_codec,
+    zstandard,
+)
+
+
+class ColumnCodec:
+    """
+    JSON column compression settings shared by all storages of one table.
+
+    Values at least `min_size` bytes long are stored as a BLOB: one codec byte followed by
+    the compressed JSON. Shorter values, and everything written before compression existed,
+    stay plain JSON text, so old rows keep working.
+    """
+
+    def __init__(self, codec: Optional[CompressionCodec] = None, min_size: int = 256):
+        self.codec: CompressionCodec = resolve_codec(codec) if codec else default_codec()
+        self.min_size = min_size
+        # zstd dictionaries: column name -> dictionary used for new writes
+        self.column_dicts: Dict[str, "zstandard.ZstdCompressionDict"] = {}
+        # zstd dictionaries: dictionary ID -> dictionary, for reading old and new rows
+        self.dicts_by_id: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+
+    def add_dictionary(self, column: str, dict_data: bytes) -> int:
+        """Register a trained zstd dictionary for a column, returns its dictionary ID."""
+        if zstandard is None:
+            raise ImportError("`zstandard` not installed, please install it with `pip install zstandard`")
+        zstd_dict = zstandard.ZstdCompressionDict(dict_data)
+        self.dicts_by_id[zstd_dict.dict_id()] = zstd_dict
+        self.column_dicts[column] = zstd_dict
+        return zstd_dict.dict_id()
+
+    def encode(self, column: str, value: Any) -> Any:
+        data = json.dumps(value).encode()
+        if len(data) < self.min_size:
+            return data.decode()
+        zstd_dict = self.column_dicts.get(column) if self.codec == "zstd" else None
+        codec_id, payload = compress(data, self.codec, zstd_dict=zstd_dict)
+        return bytes([codec_id]) + payload
+
+    def decode(self, value: Any) -> Any:
+        if isinstance(value, (bytes, memoryview)):
+            value = bytes(value)
+            return json.loads(decompress(value[0], value[1:], self.dicts_by_id))
+        return json.loads(value)
+
+
+class CompressedJSON(TypeDecorator):
+    """A JSON column that transparently compresses large values with a `ColumnCodec`."""
+
+    impl = String
+    cache_ok = True
+
+    def __init__(self, codec: ColumnCodec, column: str):
+        super().__init__()
+        self.codec = codec
+        self.column = column
+
+    def process_bind_param(self, value: Any, dialect) -> Any:
+        if value is None:
+            return None
+        return self.codec.encode(self.column, value)
+
+    def process_result_value(self, value: Any, dialect) -> Any:
+        if value is None:
+            return None
+        return self.codec.decode(value)
+
+
+def train_zstd_dictionary(samples: List[Any], dict_size: int = 112640) -> bytes:
+    """
+    Train a zstd dictionary on JSON values of one column.
+
+    :param samples: Decoded column values.
+    :param dict_size: Maximum dictionary size in bytes.
+    :return: The raw dictionary.
+    """
+    if zstandard is None:
+        raise ImportError("`zstandard` not installed, please install it with `pip install zstandard`")
+    encoded = [json.dumps(sample).encode() for sample in samples if sample is not None]
+    return zstandard.train_dictionary(dict_size, encoded).as_bytes()
+
+
+_CODECS: Dict[str, ColumnCodec] = {}
+_CODECS_LOCK = Lock()
+
+
+def get_column_codec(key: str) -> ColumnCodec:
+    """Get the process-wide codec of a table, `key` identifies the database and table."""
+    with _CODECS_LOCK:
+        if key not in _CODECS:
+            _CODECS[key] = ColumnCodec()
+        return _CODECS[key]
@@ -0,0 +1,178 @@
+try:
+    from sqlalchemy import event
+    from sqlalchemy.engine import create_engine, Engine
+    from sqlalchemy.orm import Session, sessionmaker
+    from sqlalchemy.pool import QueuePool
+except ImportError:
+    raise ImportError("`sqlalchemy` not installed")
+
+import os
+import time
+from threading import Lock
+from typing import Any, Dict, Optional
+from loguru import logger
+
+
+# PRAGMAs applied to every connection of a file database
+SQLITE_PRAGMAS: Dict[str, Any] = {
+    "journal_mode": "WAL",
+    # WAL makes NORMAL durable across application crashes, only an OS crash can lose the last commits
+    "synchronous": "NORMAL",
+    # Negative values are in KiB, i.e. 64 MiB page cache per connection
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+SQLITE_BUSY_TIMEOUT_MS = 10000
+SQLITE_READ_POOL_SIZE = 4
+
+
+class SQLiteLockStats:
+    """Counters for the time spent waiting on SQLite locks"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.writer_checkouts = 0
+        self.writer_waits = 0
+        self.writer_wait_seconds = 0.0
+        self.max_writer_wait_seconds = 0.0
+        self.busy_errors = 0
+
+    def record_writer_checkout(self, wait_seconds: float, threshold: float = 0.001) -> None:
+        with self._lock:
+            self.writer_checkouts += 1
+            if wait_seconds >= threshold:
+                self.writer_waits += 1
+                self.writer_wait_seconds += wait_seconds
+                self.max_writer_wait_seconds = max(self.max_writer_wait_seconds, wait_seconds)
+
+    def record_busy_error(self) -> None:
+        with self._lock:
+            self.busy_errors += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "writer_checkouts": self.writer_checkouts,
+                "writer_waits": self.writer_waits,
+                "writer_wait_seconds": self.writer_wait_seconds,
+                "max_writer_wait_seconds": self.max_writer_wait_seconds,
+                "busy_errors": self.busy_errors,
+            }
+
+
+class SQLiteEngines:
+    """
+    A pair of engines for one SQLite file: a single writer connection and a pool of read-only connections.
+
+    SQLite allows one writer at a time, so funnelling every write of the process through one
+    connection turns lock contention into an in-process queue that is visible in `stats`,
+    while readers in WAL mode never block on the writer.
+    """
+
+    def __init__(self, writer: Engine, reader: Engine, stats: SQLiteLockStats):
+        self.writer = writer
+        self.reader = reader
+        self.stats = stats
+        self.Session: sessionmaker[Session] = sessionmaker(bind=writer)
+        self.ReadSession: sessionmaker[Session] = sessionmaker(bind=reader)
+
+
+def _apply_pragmas(engine: Engine, read_only: bool) -> None:
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            if read_only:
+                cursor.execute("PRAGMA query_only = ON")
+        finally:
+            cursor.close()
+
+
+def _count_busy_errors(engine: Engine, stats: SQLiteLockStats) -> None:
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context):
+        message = str(context.original_exception).lower()
+        if "database is locked" in message or "database is busy" in message:
+            stats.record_busy_error()
+            logger.warning(f"SQLite lock timeout on {engine.url}: {context.original_exception}")
+
+
+def _timed_queue_pool(stats: SQLiteLockStats) -> type:
+    class _TimedQueuePool(QueuePool):
+        """QueuePool that records how long callers wait for the writer connection"""
+
+        def _do_get(self):
+            start_time = time.perf_counter()
+            connection = super()._do_get()
+            stats.record_writer_checkout(time.perf_counter() - start_time)
+            return connection
+
+    return _TimedQueuePool
+
+
+def create_sqlite_engines(db_file: str, read_pool_size: int = SQLITE_READ_POOL_SIZE) -> SQLiteEngines:
+    """
+    Create tuned writer and reader engines for a SQLite file, see `SQLiteEngines`.
+
+    :param db_file: Path of the database file.
+    :param read_pool_size: Number of pooled read-only connections.
+    """
+    url = f"sqlite:///{db_file}"
+    connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    stats = SQLiteLockStats()
+
+    writer = create_engine(
+        url,
+        connect_args=connect_args,
+        poolclass=_timed_queue_pool(stats),
+        pool_size=1,
+        max_overflow=0,
+        # Waiting callers queue on the single writer instead of failing
+        pool_timeout=SQLITE_BUSY_TIMEOUT_MS / 1000 * 3,
+    )
+    reader = create_engine(
+        url,
+        connect_args=connect_args,
+        poolclass=QueuePool,
+        pool_size=read_pool_size,
+        max_overflow=read_pool_size,
+    )
+    _apply_pragmas(writer, read_only=False)
+    _apply_pragmas(reader, read_only=True)
+    _count_busy_errors(writer, stats)
+    _count_busy_errors(reader, stats)
+    return SQLiteEngines(writer=writer, reader=reader, stats=stats)
+
+
+_ENGINES: Dict[str, SQLiteEngines] = {}
+_ENGINES_LOCK = Lock()
+
+
+def get_sqlite_engines(db_file: str) -> SQLiteEngines:
+    """
+    Get the process-wide engines for a SQLite file, creating them on first use.
+
+    Streamlit re-runs pages and re-creates storages on every interaction, so sharing
+    the engines keeps one writer connection per file for the whole process.
+    """
+    key = os.path.abspath(db_file)
+    with _ENGINES_LOCK:
+        engines = _ENGINES.get(key)
+        if engines is None:
+            engines = create_sqlite_engines(key)
+            _ENGINES[key] = engines
+        return engines
+
+
+def get_sqlite_lock_stats(db_file: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Get the lock wait counters of one or all SQLite files opened by this process."""
+    with _ENGINES_LOCK:
+        if db_file is not None:
+            engines = _ENGINES.get(os.path.abspath(db_file))
+            return {db_file: engines.stats.to_dict()} if engines else {}
+        return {path: engines.stats.to_dict() for path, engines in _ENGINES.items()}
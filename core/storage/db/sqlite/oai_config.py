@@ -1,10 +1,10 @@
 import os
 from typing import List, Optional, Dict
-from sqlalchemy import create_engine, Column, String, Text, DateTime
+from sqlalchemy import Column, String, Text, DateTime
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from core.models.llm import OpenAILikeConfigInStorage
-from core.encryption import FernetEncryptor
+from core.encryption import EnvelopeEncryptor
+from core.storage.db.sqlite.engine import get_sqlite_engines
 from config.constants import (
     OPENAI_LIKE_CONFIGS_BASE_DIR, 
     OPENAI_LIKE_CONFIGS_DB_FILE, 
@@ -31,10 +31,12 @@ class OpenAIConfigDB(Base):
 class OpenAIConfigSQLiteStorage:
     def __init__(self, db_path: str = OPENAI_LIKE_CONFIGS_DB_FILE):
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.engine = create_engine(f"sqlite:///{db_path}")
+        engines = get_sqlite_engines(db_path)
+        self.engine = engines.writer
         Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
-        self.encryptor = FernetEncryptor()
+        self.Session = engines.Session
+        self.ReadSession = engines.ReadSession
+        self.encryptor = EnvelopeEncryptor()
 
     def _encrypt_config(self, config: OpenAILikeConfigInStorage) -> Dict:
         encrypted = config.model_dump()
@@ -56,7 +58,7 @@ class OpenAIConfigSQLiteStorage:
             return db_config.config_id
 
     def get_config(self, user_id: str, config_id: str) -> Optional[OpenAILikeConfigInStorage]:
-        with self.Session() as session:
+        with self.ReadSession() as session:
             result = session.query(OpenAIConfigDB).filter(
                 OpenAIConfigDB.config_id == config_id,
                 OpenAIConfigDB.user_id == user_id
@@ -66,7 +68,7 @@ class OpenAIConfigSQLiteStorage:
             return None
 
     def list_configs(self, user_id: str) -> List[OpenAILikeConfigInStorage]:
-        with self.Session() as session:
+        with self.ReadSession() as session:
             results = session.query(OpenAIConfigDB).filter(
                 OpenAIConfigDB.user_id == user_id
             ).all()
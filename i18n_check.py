@@ -0,0 +1,126 @@
+"""
+提取代码中的 i18n 键并检查语言文件
+
+扫描所有 `i18n("...")` 调用（字符串字面量参数），与 assets/locale 下的语言文件比对：
+
+- 缺失：代码中使用但语言文件中没有的键
+- 未使用：语言文件中有但代码中没有使用的键（动态拼接的键也会出现在这里，仅作提示）
+- 各语言文件之间的键不一致、重复的键、`{}` 占位符不一致
+
+    python i18n_check.py                  # 打印报告
+    python i18n_check.py --check          # 有缺失、不一致或重复的键时以非零状态退出
+    python i18n_check.py --add-missing    # 把缺失的键加入各语言文件（值为键本身，待翻译）
+"""
+import os
+import re
+import ast
+import sys
+import json
+import argparse
+from typing import Dict, List, Set, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCALE_DIR = os.path.join(ROOT_DIR, "assets", "locale")
+SKIP_DIRS = {".git", "__pycache__", ".venv", "venv", "node_modules", "build", "dist"}
+
+_PLACEHOLDER = re.compile(r"\{[^{}]*\}")
+
+
+def extract_keys(root: str = ROOT_DIR) -> Dict[str, Set[str]]:
+    """返回 键 -> 使用它的文件（相对路径）"""
+    keys: Dict[str, Set[str]] = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for filename in filenames:
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    tree = ast.parse(f.read(), filename=path)
+            except (SyntaxError, UnicodeDecodeError) as e:
+                print(f"Skipping {path}: {e}", file=sys.stderr)
+                continue
+            for node in ast.walk(tree):
+                if not (isinstance(node, ast.Call) and node.args):
+                    continue
+                func = node.func
+                name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+                arg = node.args[0]
+                if name == "i18n" and isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                    keys.setdefault(arg.value, set()).add(os.path.relpath(path, root))
+    return keys
+
+
+def load_locale(path: str) -> Tuple[Dict[str, str], List[str]]:
+    """读取语言文件，同时返回重复出现的键（json.load 会静默保留最后一个）"""
+    duplicates: List[str] = []
+
+    def collect(pairs):
+        seen = {}
+        for key, value in pairs:
+            if key in seen:
+                duplicates.append(key)
+            seen[key] = value
+        return seen
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f, object_pairs_hook=collect), duplicates
+
+
+def write_locale(path: str, catalog: Dict[str, str]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--locale-dir", default=LOCALE_DIR, help="语言文件目录")
+    parser.add_argument("--check", action="store_true", help="有缺失、不一致或重复的键时以非零状态退出")
+    parser.add_argument("--add-missing", action="store_true", help="把缺失的键加入各语言文件")
+    parser.add_argument("-v", "--verbose", action="store_true", help="列出使用缺失键的文件")
+    args = parser.parse_args(argv)
+
+    used = extract_keys()
+    locales = {}
+    problems: List[str] = []
+    for filename in sorted(os.listdir(args.locale_dir)):
+        if filename.endswith(".json"):
+            catalog, duplicates = load_locale(os.path.join(args.locale_dir, filename))
+            locales[filename[:-5]] = catalog
+            problems.extend(f"{filename}: duplicate key {key!r}" for key in duplicates)
+
+    all_keys = set().union(*locales.values()) if locales else set()
+    print(f"{len(used)} keys used in code, {len(all_keys)} keys in {len(locales)} locale files")
+
+    for language, catalog in locales.items():
+        missing = sorted(set(used) - set(catalog))
+        for key in missing:
+            where = f"  ({', '.join(sorted(used[key]))})" if args.verbose else ""
+            problems.append(f"{language}: missing {key!r}{where}")
+        for key in sorted(all_keys - set(catalog)):
+            if key not in used:
+                problems.append(f"{language}: missing {key!r} (present in other locales)")
+        for key, value in catalog.items():
+            if sorted(_PLACEHOLDER.findall(key)) != sorted(_PLACEHOLDER.findall(value)):
+                problems.append(f"{language}: placeholders differ for {key!r}: {value!r}")
+
+        if args.add_missing and missing:
+            catalog.update((key, key) for key in missing)
+            write_locale(os.path.join(args.locale_dir, f"{language}.json"), catalog)
+            print(f"Added {len(missing)} keys to {language}.json")
+
+    unused = sorted(all_keys - set(used))
+    if unused:
+        print(f"\n{len(unused)} keys not found as literals in code (may be built dynamically):")
+        print("\n".join(f"    {key!r}" for key in unused))
+
+    if problems:
+        print("\n" + "\n".join(problems), file=sys.stderr)
+    return 1 if args.check and problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+语音识别服务
+
+模型常驻在一个独立的工作进程中（按模型大小做 LRU，最多同时保留 `max_models` 个），
+每条语音只需推理，不再重复加载模型；识别在工作进程中进行，不阻塞 Streamlit 的脚本线程。
+WAV 音频按 `chunk_seconds` 切分后逐段识别，识别出一段即可显示一段。
+
+后端：
+- `openai`：openai-whisper
+- `faster`：faster-whisper（CTranslate2），在 CPU 上以 int8 推理，速度明显快于 openai-whisper
+- `auto`：安装了 faster-whisper 时使用它，否则使用 openai-whisper
+
+后端可以通过环境变量 `WHISPER_BACKEND` 指定。
+"""
+import io
+import importlib.util
+import os
+import wave
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Any, Iterator, Literal, Optional, Tuple, Union
+
+from loguru import logger
+
+from config.constants import WHISPER_MODEL_DIR
+from utils.lazy_imports import get_faster_whisper, get_whisper, lazy_import
+
+WhisperBackend = Literal["auto", "openai", "faster"]
+
+# Whisper 模型的输入采样率
+WHISPER_SAMPLE_RATE = 16000
+
+# 作为下一段提示词的上一段识别结果的最大字符数
+PROMPT_TAIL_CHARS = 200
+
+# WAV 分段：(PCM 数据, 采样宽度, 声道数, 采样率)
+PcmChunk = Tuple[bytes, int, int, int]
+
+
+def resolve_backend(backend: Optional[str] = None) -> str:
+    """确定实际使用的后端，`auto` 时优先使用 faster-whisper"""
+    backend = (backend or os.getenv("WHISPER_BACKEND", "auto")).lower()
+    if backend not in ("auto", "openai", "faster"):
+        raise ValueError(f"Unsupported whisper backend: {backend}")
+    if backend == "auto":
+        # 只检查是否安装，模型在工作进程中导入
+        return "faster" if importlib.util.find_spec("faster_whisper") else "openai"
+    return backend
+
+
+def split_wav(data: bytes, chunk_seconds: float) -> Optional[list]:
+    """
+    把 WAV 音频按时长切分为 PCM 分段，不是 WAV 时返回 None
+
+    Args:
+        data: 音频文件内容
+        chunk_seconds: 每段的时长（秒）
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            sample_width = wav.getsampwidth()
+            channels = wav.getnchannels()
+            rate = wav.getframerate()
+            frames_per_chunk = max(int(rate * chunk_seconds), 1)
+            chunks = []
+            while True:
+                frames = wav.readframes(frames_per_chunk)
+                if not frames:
+                    break
+                chunks.append((frames, sample_width, channels, rate))
+    except (wave.Error, EOFError):
+        return None
+    return chunks
+
+
+# ---------------------------------------------------------------------------
+# 以下函数运行在工作进程中
+
+_worker_models: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+_worker_config = {"max_models": 2, "download_root": WHISPER_MODEL_DIR}
+
+
+def _init_worker(max_models: int, download_root: str) -> None:
+    _worker_config.update(max_models=max_models, download_root=download_root)
+
+
+def _load_model(backend: str, model_name: str) -> Any:
+    key = (backend, model_name)
+    model = _worker_models.get(key)
+    if model is not None:
+        _worker_models.move_to_end(key)
+        return model
+
+    while len(_worker_models) >= _worker_config["max_models"]:
+        evicted, _ = _worker_models.popitem(last=False)
+        logger.info(f"Unloaded whisper model {evicted[1]} ({evicted[0]})")
+
+    download_root = _worker_config["download_root"]
+    if backend == "faster":
+        model = get_faster_whisper().WhisperModel(
+            model_name, device="cpu", compute_type="int8", download_root=download_root
+        )
+    else:
+        model = get_whisper().load_model(name=model_name, download_root=download_root)
+    _worker_models[key] = model
+    logger.info(f"Loaded whisper model {model_name} ({backend})")
+    return model
+
+
+def _pcm_to_audio(chunk: PcmChunk) -> Any:
+    """PCM 分段转换为 16kHz 单声道的 float32 数组"""
+    np = lazy_import("numpy")
+    frames, sample_width, channels, rate = chunk
+    if sample_width == 1:
+        audio = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        audio = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif sample_width == 4:
+        audio = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width}")
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    if rate != WHISPER_SAMPLE_RATE and len(audio):
+        duration = len(audio) / rate
+        target = np.linspace(0, duration, int(duration * WHISPER_SAMPLE_RATE), endpoint=False)
+        audio = np.interp(target, np.arange(len(audio)) / rate, audio).astype(np.float32)
+    return audio
+
+
+def _transcribe(
+    backend: str,
+    model_name: str,
+    audio: Union[PcmChunk, bytes],
+    language: Optional[str],
+    initial_prompt: Optional[str],
+) -> str:
+    model = _load_model(backend, model_name)
+    tmp_path = None
+    if isinstance(audio, tuple):
+        source = _pcm_to_audio(audio)
+    else:
+        # 其它格式交给后端（ffmpeg）解码
+        with tempfile.NamedTemporaryFile(suffix=".audio", delete=False) as f:
+            f.write(audio)
+            tmp_path = source = f.name
+    try:
+        if backend == "faster":
+            segments, _ = model.transcribe(
+                source, language=language, initial_prompt=initial_prompt, vad_filter=True
+            )
+            return "".join(segment.text for segment in segments).strip()
+        result = model.transcribe(source, language=language, initial_prompt=initial_prompt)
+        return result.get("text", "").strip()
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+
+def _warm_up(backend: str, model_name: str) -> None:
+    _load_model(backend, model_name)
+
+# ---------------------------------------------------------------------------
+
+
+class TranscriptionService:
+    """
+    语音识别服务，在所有会话间共享一个工作进程与其中已加载的模型
+    """
+
+    def __init__(
+        self,
+        backend: Optional[WhisperBackend] = None,
+        max_models: int = 2,
+        download_root: str = WHISPER_MODEL_DIR,
+        chunk_seconds: float = 30,
+    ):
+        """
+        Args:
+            backend: 识别后端，默认读取环境变量 `WHISPER_BACKEND`，未设置时为 `auto`
+            max_models: 工作进程中同时保留的模型数，超出时卸载最久未使用的模型
+            download_root: 模型的下载目录
+            chunk_seconds: 流式识别时每段音频的时长（秒），Whisper 每次最多处理 30 秒
+        """
+        self.backend = resolve_backend(backend)
+        self.max_models = max_models
+        self.download_root = download_root
+        self.chunk_seconds = chunk_seconds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn：工作进程不继承 Streamlit 进程中的线程与锁
+                self._executor = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.max_models, self.download_root),
+                )
+            return self._executor
+
+    def _submit(self, fn, *args) -> Any:
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return executor.submit(fn, *args).result()
+            except BrokenProcessPool:
+                # 工作进程崩溃（如内存不足）时重建，已加载的模型随之丢失
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                if attempt:
+                    raise
+                logger.warning("Transcription worker died, restarting")
+
+    def preload(self, model_name: str) -> None:
+        """在后台加载模型，录音结束后立即调用，点击识别时模型通常已就绪"""
+        self._get_executor().submit(_warm_up, self.backend, model_name)
+
+    def stream_transcription(
+        self,
+        data: bytes,
+        model_name: str,
+        language: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        逐段识别音频，每识别完一段产出该段的文本
+
+        上一段结尾的文本作为下一段的提示词，保持分段之间的用词与标点一致。
+
+        Args:
+            data: 音频文件内容，WAV 按时长分段，其它格式整体识别
+            model_name: Whisper 模型名称，如 "base"、"large-v3"
+            language: 语言代码，为 None 时自动检测
+        """
+        chunks = split_wav(data, self.chunk_seconds)
+        if chunks is None:
+            chunks = [data]
+        prompt = None
+        for chunk in chunks:
+            text = self._submit(_transcribe, self.backend, model_name, chunk, language, prompt)
+            if not text:
+                continue
+            # 英文等以空格分词的语言在分段之间补一个空格
+            separator = " " if prompt and text[0].isascii() and text[0].isalnum() else ""
+            prompt = text[-PROMPT_TAIL_CHARS:]
+            yield separator + text
+
+    def transcribe(self, data: bytes, model_name: str, language: Optional[str] = None) -> str:
+        """识别整段音频"""
+        return "".join(self.stream_transcription(data, model_name, language)).strip()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+@lru_cache(maxsize=1)
+def get_transcription_service() -> TranscriptionService:
+    """进程内共享的语音识别服务，Streamlit 的所有会话使用同一个工作进程"""
+    return TranscriptionService()
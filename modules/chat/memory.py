@@ -0,0 +1,200 @@
+import json
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from loguru import logger
+
+
+# summarize(previous_summary, new_messages) -> updated summary
+Summarize = Callable[[str, List[Dict[str, Any]]], str]
+
+SUMMARY_MESSAGE_PREFIX = "Summary of the earlier conversation:\n\n"
+
+_MISSING = object()
+
+
+def _message_fingerprint(message: Dict[str, Any]) -> str:
+    content = [message.get("role"), message.get("content")]
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    """消息的纯文本内容，图片等非文本部分不参与摘要"""
+    content = message.get("content")
+    if isinstance(content, list):
+        return "\n".join(
+            item.get("text", "") for item in content
+            if isinstance(item, dict) and item.get("type") == "text"
+        )
+    return content or ""
+
+
+def format_summary_request(previous_summary: str, messages: Sequence[Dict[str, Any]]) -> str:
+    """把已有摘要与新消息拼成发给摘要模型的用户消息"""
+    transcript = "\n\n".join(f"{m.get('role')}: {_message_text(m)}" for m in messages)
+    return (
+        "<current_summary>\n"
+        f"{previous_summary}\n"
+        "</current_summary>\n\n"
+        "<new_messages>\n"
+        f"{transcript}\n"
+        "</new_messages>"
+    )
+
+
+class ConversationSummaryMemory:
+    """
+    对话的滚动摘要记忆
+
+    较早的消息被逐步合并到一段摘要中，摘要保存在 `AssistantRun.memory["summary"]`，与 `chat_history` 放在一起：
+
+        {"content": "...", "message_count": 24, "last_message": "<sha256>", "updated_at": "..."}
+
+    `message_count` 是摘要覆盖的前缀消息数，`last_message` 是其中最后一条消息的指纹，
+    删除或修改了这部分历史后摘要自动失效。请求模型时用摘要加 token 预算窗口内的消息代替完整历史，
+    摘要覆盖到窗口开始之前，在每次回复后于后台线程中增量更新，不阻塞页面。
+    """
+
+    def __init__(self, keep_recent: int = 8, min_new_messages: int = 4, max_workers: int = 2):
+        """
+        Args:
+            keep_recent: 没有传入 `window_start` 时，最近的多少条消息不合并进摘要
+            min_new_messages: 至少积累多少条新消息才更新一次摘要，减少摘要请求的次数
+            max_workers: 后台摘要线程数
+        """
+        self.keep_recent = keep_recent
+        self.min_new_messages = min_new_messages
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="conversation-summary")
+        self._summaries: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._refreshing: set = set()
+        self._lock = Lock()
+
+    @staticmethod
+    def is_valid(summary: Optional[Dict[str, Any]], chat_history: Sequence[Dict[str, Any]]) -> bool:
+        """摘要覆盖的消息是否仍然与对话历史一致"""
+        if not summary or not summary.get("content"):
+            return False
+        count = summary.get("message_count", 0)
+        if count <= 0 or count > len(chat_history):
+            return False
+        return summary.get("last_message") == _message_fingerprint(chat_history[count - 1])
+
+    def get_summary(
+        self,
+        run_id: str,
+        chat_history: Sequence[Dict[str, Any]],
+        loader: Optional[Callable[[], Optional[Dict[str, Any]]]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        获取对话当前有效的摘要
+
+        Args:
+            run_id: 对话ID
+            chat_history: 对话历史（dict 格式）
+            loader: 进程内没有缓存时调用，从 `AssistantRun.memory` 读取已保存的摘要
+        """
+        with self._lock:
+            summary = self._summaries.get(run_id, _MISSING)
+        if summary is _MISSING:
+            summary = loader() if loader is not None else None
+            with self._lock:
+                summary = self._summaries.setdefault(run_id, summary)
+        return summary if self.is_valid(summary, chat_history) else None
+
+    @staticmethod
+    def summary_message(summary: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """把摘要转换为一条 system 消息，可作为 `TokenBudgetTransform` 的 summarizer 的返回值"""
+        if not summary:
+            return None
+        return {"role": "system", "content": f"{SUMMARY_MESSAGE_PREFIX}{summary['content']}"}
+
+    def invalidate(self, run_id: str) -> None:
+        with self._lock:
+            self._summaries.pop(run_id, None)
+
+    def refresh(
+        self,
+        run_id: str,
+        chat_history: Sequence[Dict[str, Any]],
+        summarize: Summarize,
+        on_update: Optional[Callable[[Dict[str, Any]], None]] = None,
+        window_start: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        把摘要之后、发送给模型的窗口之前的消息合并进摘要（同步操作）
+
+        Args:
+            run_id: 对话ID
+            chat_history: 对话历史（dict 格式）
+            summarize: 根据已有摘要与新消息生成新摘要
+            on_update: 摘要更新后调用，用于持久化
+            window_start: 按 token 预算发送给模型的第一条消息的索引（见 `TokenBudgetTransform.window_start`），
+                为 0 时完整的对话历史都在预算内，不生成摘要；为 None 时保留最近 `keep_recent` 条
+
+        Returns:
+            Optional[Dict[str, Any]]: 更新后的摘要，不需要更新时返回 None
+        """
+        if window_start == 0:
+            return None
+        with self._lock:
+            summary = self._summaries.get(run_id)
+        start = summary["message_count"] if self.is_valid(summary, chat_history) else 0
+        end = len(chat_history) - self.keep_recent if window_start is None else min(window_start, len(chat_history))
+        # 不要在一问一答之间截断
+        while end > start and chat_history[end - 1].get("role") == "user":
+            end -= 1
+        if end - start < self.min_new_messages:
+            return None
+
+        content = summarize(summary["content"] if start else "", list(chat_history[start:end]))
+        if not content:
+            return None
+        new_summary = {
+            "content": content,
+            "message_count": end,
+            "last_message": _message_fingerprint(chat_history[end - 1]),
+            "updated_at": datetime.now().isoformat(),
+        }
+        with self._lock:
+            self._summaries[run_id] = new_summary
+        if on_update is not None:
+            on_update(new_summary)
+        logger.info(f"Summarized {end - start} messages of run_id {run_id}, {end} messages covered")
+        return new_summary
+
+    def refresh_async(
+        self,
+        run_id: str,
+        chat_history: Sequence[Dict[str, Any]],
+        summarize: Summarize,
+        on_update: Optional[Callable[[Dict[str, Any]], None]] = None,
+        window_start: Optional[int] = None,
+    ) -> Optional[Future]:
+        """在后台线程中执行 `refresh`，同一对话已有摘要任务在运行时直接返回 None"""
+        if window_start == 0:
+            return None
+        with self._lock:
+            if run_id in self._refreshing:
+                return None
+            self._refreshing.add(run_id)
+        if isinstance(chat_history, list):
+            # 调用方可能继续修改列表；`LazyChatHistory` 等按需加载的序列只在后台线程中读取需要的消息
+            chat_history = list(chat_history)
+
+        def _run():
+            try:
+                return self.refresh(run_id, chat_history, summarize, on_update, window_start)
+            except Exception as e:
+                logger.error(f"Error summarizing conversation of run_id {run_id}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(run_id)
+
+        return self._executor.submit(_run)
+
+
+# 进程内共享的摘要记忆
+conversation_memory = ConversationSummaryMemory()
@@ -1,8 +1,20 @@
-from typing import List, Dict, Tuple, Optional, TypeVar, Generic, Union
-from core.models.app import MessageType
+import re
+import json
+import math
+import time
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, List, Dict, Tuple, Optional, TypeVar, Generic, Union, Sequence
+from core.models.app import BaseMessage, MessageType
+from loguru import logger
 
 import unittest
 
+if TYPE_CHECKING:
+    import tiktoken
+
 
 T = TypeVar('T')
 
@@ -83,14 +95,251 @@ class ListLimiter(Generic[T]):
 
 
 class MessageHistoryTransform(ListLimiter[Union[Dict, MessageType]]):
+    """Keeps the most recent messages of a chat history.
+
+    The history may also be a lazily loaded sequence such as `LazyChatHistory`;
+    only the kept window is then loaded from storage.
+    """
+
     def __init__(self, max_size: Optional[int] = None):
         super().__init__(max_size)
 
-    def transform(self, items: List[MessageType]) -> List[MessageType]:
+    def transform(self, items: Sequence[MessageType]) -> List[MessageType]:
+        if not isinstance(items, list):
+            return list(super().transform(items))
         return super().transform(items)
     
-    def transform_with_logs(self, items: List[MessageType]) -> Tuple[List[MessageType], str]:
-        return super().transform_with_logs(items)
+    def transform_with_logs(self, items: Sequence[MessageType]) -> Tuple[List[MessageType], str]:
+        result = self.transform(items)
+        return result, self._generate_log(len(items), len(result))
+
+
+# Tokens added by the chat format around every message, see the OpenAI cookbook
+TOKENS_PER_MESSAGE = 4
+# Flat estimate for an image part, the cost of a high detail 512x512 tile plus the base cost
+TOKENS_PER_IMAGE = 255
+DEFAULT_ENCODING = "cl100k_base"
+# Seconds to wait before trying again to load an encoding that failed to load
+ENCODING_RETRY_INTERVAL = 300
+
+_encodings: Dict[Optional[str], "tiktoken.Encoding"] = {}
+_encoding_failures: Dict[Optional[str], float] = {}
+_encodings_lock = Lock()
+
+
+def _load_encoding(model: Optional[str]) -> "tiktoken.Encoding":
+    import tiktoken
+
+    if model:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+    return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def get_encoding(model: Optional[str] = None) -> Optional["tiktoken.Encoding"]:
+    """Get the tiktoken encoding of a model, cached per model.
+
+    Unknown models use cl100k_base. Returns None if tiktoken or its encoding files are unavailable,
+    in which case token counts are estimated from the text length. Only loaded encodings are cached;
+    a failed load is tried again after `ENCODING_RETRY_INTERVAL` seconds.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        if time.monotonic() < _encoding_failures.get(model, -math.inf):
+            return None
+        try:
+            encoding = _load_encoding(model)
+        except ImportError:
+            logger.warning("`tiktoken` not installed, token counts will be estimated")
+        except Exception as e:
+            logger.warning(f"Failed to load tiktoken encoding for {model}, token counts will be estimated: {e}")
+        if encoding is None:
+            _encoding_failures[model] = time.monotonic() + ENCODING_RETRY_INTERVAL
+            return None
+        _encoding_failures.pop(model, None)
+        _encodings[model] = encoding
+        return encoding
+
+
+class TokenCounter:
+    """Counts the tokens of chat messages.
+
+    A message's count is kept in its `token_count` field (on `BaseMessage` objects, or as a key of
+    dict messages). Callers set it before the message is appended to the chat history, so it is
+    stored with the history and read back instead of re-tokenizing. Messages without a count are
+    counted once and cached in memory by content hash; use `get_token_counter` to share that cache.
+    """
+
+    def __init__(self, model: Optional[str] = None, cache_size: int = 4096, estimate: bool = False):
+        """
+        Args:
+            model (Optional[str]): Model name used to choose the tiktoken encoding.
+            cache_size (int): Number of message counts to keep in memory.
+            estimate (bool): Always estimate counts from the text length instead of using tiktoken.
+        """
+        self._model = model
+        self._estimate = estimate
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = Lock()
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        encoding = None if self._estimate else get_encoding(self._model)
+        if encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def _count_content(self, content: Any) -> int:
+        if isinstance(content, str):
+            return self.count_text(content)
+        tokens = 0
+        for part in content or []:
+            part_type = part.get("type") if isinstance(part, dict) else getattr(part, "type", None)
+            if part_type == "text":
+                tokens += self.count_text(part["text"] if isinstance(part, dict) else part.text)
+            elif part_type == "image_url":
+                tokens += TOKENS_PER_IMAGE
+        return tokens
+
+    def _count_uncached(self, role: Optional[str], content: Any) -> int:
+        if isinstance(content, list):
+            # Content parts may be pydantic models, which json.dumps cannot hash directly
+            content = [part.model_dump() if hasattr(part, "model_dump") else part for part in content]
+        key = hashlib.sha256(json.dumps([role, content], sort_keys=True, default=str).encode()).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        tokens = TOKENS_PER_MESSAGE + self._count_content(content)
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_message(self, message: Union[Dict, MessageType]) -> int:
+        """Counts the tokens of one message, including the chat format overhead.
+
+        The count is stored in the message's `token_count`, and an existing count is returned as is.
+        """
+        if isinstance(message, BaseMessage):
+            if message.token_count is None:
+                message.token_count = self._count_uncached(message.role, message.content)
+            return message.token_count
+
+        if isinstance(message.get("token_count"), int):
+            return message["token_count"]
+        return self._count_uncached(message.get("role"), message.get("content"))
+
+    def count_messages(self, messages: Sequence[Union[Dict, MessageType]]) -> int:
+        return sum(self.count_message(message) for message in messages)
+
+
+@lru_cache(maxsize=32)
+def get_token_counter(model: Optional[str] = None) -> TokenCounter:
+    """Shared `TokenCounter` of a model, so its cache is kept across transforms and Streamlit reruns."""
+    return TokenCounter(model)
+
+
+def _message_role(message: Union[Dict, MessageType]) -> Optional[str]:
+    return message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+
+
+class TokenBudgetTransform:
+    """Keeps as much of the latest chat history as fits into a token budget.
+
+    System messages are always kept. Then turns are added from the newest backwards until the
+    budget is used up; the latest message is kept even if it alone exceeds the budget. The dropped
+    middle of the history is either left out or replaced by the message returned from `summarizer`.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        model: Optional[str] = None,
+        max_messages: Optional[int] = None,
+        summarizer: Optional[Callable[[List[Union[Dict, MessageType]]], Optional[Union[Dict, MessageType]]]] = None,
+        token_counter: Optional[TokenCounter] = None,
+    ):
+        """
+        Args:
+            max_tokens (int): Token budget of the returned history, including system messages.
+            model (Optional[str]): Model name used to choose the tiktoken encoding.
+            max_messages (Optional[int]): Optional message count limit, as in `MessageHistoryTransform`.
+            summarizer (Optional[Callable]): Called with the dropped messages, may return a message that
+                replaces them (e.g. a summary); its tokens count against the budget.
+            token_counter (Optional[TokenCounter]): Counter to use, defaults to the shared counter of `model`.
+        """
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be greater than 0")
+        ListLimiter._validate_max_size(max_messages)
+        self._max_tokens = max_tokens
+        self._max_messages = max_messages
+        self._summarizer = summarizer
+        self.token_counter = token_counter or get_token_counter(model)
+
+    def _select(self, items: List[Union[Dict, MessageType]]) -> Tuple[List, List, int]:
+        """Returns the system messages, the kept history and the token budget left after them."""
+        system_messages = [m for m in items if _message_role(m) == "system"]
+        history = [m for m in items if _message_role(m) != "system"]
+        if self._max_messages:
+            history = history[-self._max_messages:]
+
+        budget = self._max_tokens - self.token_counter.count_messages(system_messages)
+        start = len(history)
+        while start > 0:
+            tokens = self.token_counter.count_message(history[start - 1])
+            if tokens > budget and start < len(history):
+                break
+            budget -= tokens
+            start -= 1
+        # Do not start the window with an answer whose question was dropped
+        while start < len(history) - 1 and _message_role(history[start]) != "user":
+            budget += self.token_counter.count_message(history[start])
+            start += 1
+        return system_messages, history[start:], budget
+
+    def window_start(self, items: Sequence[Union[Dict, MessageType]]) -> int:
+        """Index of the first kept message among the non-system messages of `items`.
+
+        Everything before it is left out of the prompt, so it is what a rolling summary has to cover;
+        0 means the whole history fits into the budget.
+        """
+        if not isinstance(items, list):
+            items = list(items)
+        _, kept, _ = self._select(items)
+        return sum(1 for m in items if _message_role(m) != "system") - len(kept)
+
+    def transform(self, items: Sequence[Union[Dict, MessageType]]) -> List[Union[Dict, MessageType]]:
+        """Selects the messages to send; the returned messages are the same objects as in `items`."""
+        if not isinstance(items, list):
+            items = list(items)
+        system_messages, kept, budget = self._select(items)
+        non_system = [m for m in items if _message_role(m) != "system"]
+        dropped = non_system[:len(non_system) - len(kept)]
+        if dropped and self._summarizer is not None:
+            summary = self._summarizer(dropped)
+            if summary is not None:
+                # Make room for the summary, always keeping the latest message
+                summary_tokens = self.token_counter.count_message(summary)
+                while summary_tokens > budget and len(kept) > 1:
+                    budget += self.token_counter.count_message(kept[0])
+                    kept = kept[1:]
+                kept = [summary] + kept
+        return system_messages + kept
+
+    def transform_with_logs(self, items: Sequence[Union[Dict, MessageType]]) -> Tuple[List[Union[Dict, MessageType]], str]:
+        result = self.transform(items)
+        tokens = self.token_counter.count_messages(result)
+        return result, f"Kept {len(result)} of {len(items)} messages, {tokens} tokens of {self._max_tokens}."
 
 
 class TagProcessor:
@@ -111,6 +360,8 @@ class TagProcessor:
         self._validate_tags(start_tag, end_tag)
         self._start_tag = start_tag
         self._end_tag = end_tag
+        # Matches either tag, so every scan is a single pass over the text
+        self._tag_pattern = re.compile(f"{re.escape(start_tag)}|{re.escape(end_tag)}")
 
     def add(self, text: str, if_newline: bool = True) -> str:
         """Adds a new tagged section to the text.
@@ -146,39 +397,51 @@ class TagProcessor:
         Returns:
             Tuple[str, str]: The first occurrence of the tagged section if found and the rest of the text, otherwise an empty string and the original text.
         """
-        start_index = text.find(self._start_tag)
-        if start_index == -1:
-            return "", text
-
-        end_index = self._find_matching_end_tag(text, start_index)
-        if end_index == -1:
+        spans = self.find_spans(text, limit=1)
+        if not spans:
             return "", text
 
+        start_index, end_index = spans[0]
         return text[start_index:end_index], text[:start_index] + text[end_index:]
 
-    def _find_matching_end_tag(self, text: str, start_index: int) -> int:
-        """Finds the matching end tag for the start tag at the given index.
+    def find_spans(self, text: str, limit: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Finds the outermost balanced tagged sections in a single pass.
+
+        Nested sections belong to their outermost section. End tags outside any section are ignored,
+        and scanning stops at a start tag that is never closed.
 
         Args:
-            text (str): The text to be checked.
-            start_index (int): The index of the start tag.
+            text (str): The text to be scanned.
+            limit (Optional[int]): Stop after this many sections.
 
         Returns:
-            int: The index of the matching end tag, or -1 if not found.
+            List[Tuple[int, int]]: (start, end) indexes of each section, including its tags.
         """
-        tag_depth = 1
-        index = start_index + len(self._start_tag)
-
-        while index < len(text):
-            if text.startswith(self._start_tag, index):
-                tag_depth += 1
-            elif text.startswith(self._end_tag, index):
-                tag_depth -= 1
-                if tag_depth == 0:
-                    return index + len(self._end_tag)
-            index += 1
-
-        return -1
+        spans = []
+        depth = 0
+        section_start = 0
+        for match in self._tag_pattern.finditer(text):
+            if match.group() == self._start_tag:
+                if depth == 0:
+                    section_start = match.start()
+                depth += 1
+            elif depth > 0:
+                depth -= 1
+                if depth == 0:
+                    spans.append((section_start, match.end()))
+                    if limit is not None and len(spans) >= limit:
+                        break
+        return spans
+
+    def _replace_spans(self, text: str, spans: List[Tuple[int, int]], replacement: str) -> str:
+        parts = []
+        position = 0
+        for start_index, end_index in spans:
+            parts.append(text[position:start_index])
+            parts.append(replacement)
+            position = end_index
+        parts.append(text[position:])
+        return "".join(parts)
 
     def extract_all(self, text: str) -> Tuple[List[str], str]:
         """Detects if the text contains any section enclosed by the specified tags and returns all occurrences and the rest of the text.
@@ -189,26 +452,9 @@ class TagProcessor:
         Returns:
             Tuple[List[str], str]: A Tuple containing a list of all occurrences of the tagged section if found and the rest of the text, otherwise an empty list and the original text.
         """
-        occurrences = []
-        remaining_text = text
-
-        while True:
-            start_index = remaining_text.find(self._start_tag)
-            if start_index == -1:
-                break  # No more start tags found, exit loop
-
-            end_index = self._find_matching_end_tag(remaining_text, start_index)
-            if end_index == -1:
-                break  # No matching end tag found, exit loop
-
-            # Extract the tagged section
-            tagged_section = remaining_text[start_index:end_index]
-            occurrences.append(tagged_section)
-
-            # Remove the tagged section from the remaining text
-            remaining_text = remaining_text[:start_index] + remaining_text[end_index:]
-
-        return occurrences, remaining_text
+        spans = self.find_spans(text)
+        occurrences = [text[start_index:end_index] for start_index, end_index in spans]
+        return occurrences, self._replace_spans(text, spans, "")
 
     def modify(self, text: str, replacement: str) -> str:
         """Modifies the first occurrence of the tagged section with the given replacement.
@@ -220,15 +466,7 @@ class TagProcessor:
         Returns:
             str: The modified text.
         """
-        start_index = text.find(self._start_tag)
-        if start_index == -1:
-            return text
-
-        end_index = self._find_matching_end_tag(text, start_index)
-        if end_index == -1:
-            return text
-
-        return text[:start_index] + replacement + text[end_index:]
+        return self._replace_spans(text, self.find_spans(text, limit=1), replacement)
 
     def delete(self, text: str) -> str:
         """Deletes the first occurrence of the tagged section.
@@ -253,9 +491,7 @@ class TagProcessor:
         Returns:
             str: The modified text.
         """
-        while self.detect(text):
-            text = self.modify(text, replacement)
-        return text
+        return self._replace_spans(text, self.find_spans(text), replacement)
 
     def delete_all(self, text: str) -> str:
         """Deletes all occurrences of the tagged sections.
@@ -270,6 +506,10 @@ class TagProcessor:
         deleted_text = self.modify_all(text, "")
         return deleted_text.lstrip("\n")
 
+    def stream_parser(self) -> "TagStreamParser":
+        """Creates a parser that splits streamed chunks into tagged and untagged text, see `TagStreamParser`."""
+        return TagStreamParser(self._start_tag, self._end_tag)
+
     def process_with_logs(self, text: str, operation: str, replacement: Optional[str] = None) -> Tuple[str, str]:
         """Processes the text with the specified operation and returns both the result and a log message.
 
@@ -340,6 +580,92 @@ class TagProcessor:
         return f"No changes made during {operation} operation."
 
 
+class TagStreamParser:
+    """Splits a stream of text chunks into text inside and outside tagged sections.
+
+    Each chunk is scanned once: only a trailing piece that could be the beginning of a tag
+    split across chunks is kept back until the next chunk arrives.
+    The outermost tags are dropped, nested tags are kept as part of the tagged text.
+    """
+
+    def __init__(self, start_tag: str, end_tag: str):
+        """
+        Args:
+            start_tag (str): The starting tag (e.g., "<think>").
+            end_tag (str): The ending tag (e.g., "</think>").
+        """
+        TagProcessor._validate_tags(start_tag, end_tag)
+        self._start_tag = start_tag
+        self._end_tag = end_tag
+        self._tag_pattern = re.compile(f"{re.escape(start_tag)}|{re.escape(end_tag)}")
+        self._pending = ""
+        self._depth = 0
+
+    @property
+    def inside(self) -> bool:
+        """Whether the stream is currently inside a tagged section."""
+        return self._depth > 0
+
+    def feed(self, chunk: str) -> List[Tuple[bool, str]]:
+        """Processes the next chunk.
+
+        Args:
+            chunk (str): The next piece of the stream.
+
+        Returns:
+            List[Tuple[bool, str]]: (inside_tags, text) pieces in stream order, adjacent pieces of the same kind merged.
+        """
+        buffer = self._pending + chunk
+        segments: List[Tuple[bool, str]] = []
+        position = 0
+        for match in self._tag_pattern.finditer(buffer):
+            self._emit(segments, self.inside, buffer[position:match.start()])
+            tag = match.group()
+            if tag == self._start_tag:
+                if self._depth > 0:
+                    self._emit(segments, True, tag)
+                self._depth += 1
+            elif self._depth > 1:
+                self._depth -= 1
+                self._emit(segments, True, tag)
+            elif self._depth == 1:
+                self._depth = 0
+            else:
+                # An end tag outside any section is plain text
+                self._emit(segments, False, tag)
+            position = match.end()
+
+        tail = buffer[position:]
+        keep = self._partial_tag_length(tail)
+        self._emit(segments, self.inside, tail[:len(tail) - keep])
+        self._pending = tail[len(tail) - keep:]
+        return segments
+
+    def flush(self) -> List[Tuple[bool, str]]:
+        """Returns the text kept back at the end of the stream."""
+        segments: List[Tuple[bool, str]] = []
+        self._emit(segments, self.inside, self._pending)
+        self._pending = ""
+        return segments
+
+    def _partial_tag_length(self, text: str) -> int:
+        """Length of the longest suffix of `text` that is a proper prefix of a tag."""
+        for length in range(min(len(text), max(len(self._start_tag), len(self._end_tag)) - 1), 0, -1):
+            suffix = text[-length:]
+            if self._start_tag.startswith(suffix) or self._end_tag.startswith(suffix):
+                return length
+        return 0
+
+    @staticmethod
+    def _emit(segments: List[Tuple[bool, str]], inside: bool, text: str) -> None:
+        if not text:
+            return
+        if segments and segments[-1][0] == inside:
+            segments[-1] = (inside, segments[-1][1] + text)
+        else:
+            segments.append((inside, text))
+
+
 class ReasoningContentTagProcessor(TagProcessor):
     """A tag processor for handling reasoning content tags."""
 
@@ -393,6 +719,24 @@ class TestTagProcessor(unittest.TestCase):
         self.assertEqual(self.processor.process_with_logs("<think>Hello, world!</think>", "modify", "Hi, universe!"), ("Hi, universe!", "Performed modify operation. Text changed from '<think>Hello, world!</think>' to 'Hi, universe!'."))
         self.assertEqual(self.processor.process_with_logs("Hello, world!", "modify", "Hi, universe!"), ("Hello, world!", "No changes made during modify operation."))
 
+    def test_nested_and_unbalanced_tags(self):
+        self.assertEqual(self.processor.extract_all("a<think>b<think>c</think>d</think>e"), (["<think>b<think>c</think>d</think>"], "ae"))
+        self.assertEqual(self.processor.extract_all("</think>a<think>b</think><think>c"), (["<think>b</think>"], "</think>a<think>c"))
+        self.assertEqual(self.processor.modify_all("</think>x<think>", "Hi"), "</think>x<think>")
+        self.assertEqual(self.processor.find_spans("<think>a</think>b<think>c</think>"), [(0, 16), (17, 33)])
+
+    def test_stream_parser(self):
+        parser = self.processor.stream_parser()
+        segments = []
+        for chunk in ["<th", "ink>reas", "on<think>x</think>", "ing</thi", "nk>ans", "wer<", "/b>"]:
+            segments.extend(parser.feed(chunk))
+        segments.extend(parser.flush())
+        reasoning = "".join(text for inside, text in segments if inside)
+        content = "".join(text for inside, text in segments if not inside)
+        self.assertEqual(reasoning, "reason<think>x</think>ing")
+        self.assertEqual(content, "answer</b>")
+        self.assertFalse(parser.inside)
+
     def test_validate_tags(self):
         with self.assertRaises(ValueError):
             TagProcessor("", "</think>")
@@ -405,5 +749,70 @@ class TestTagProcessor(unittest.TestCase):
         with self.assertRaises(ValueError):
             TagProcessor("<think>", "think>")
 
+class TestTokenBudgetTransform(unittest.TestCase):
+    def setUp(self):
+        # Length-based counts keep the test independent of downloaded encodings
+        self.counter = TokenCounter(estimate=True)
+        self.messages = [
+            {"role": "system", "content": "s" * 40},
+            {"role": "user", "content": "a" * 400},
+            {"role": "assistant", "content": "b" * 40},
+            {"role": "user", "content": "c" * 40},
+            {"role": "assistant", "content": "d" * 40},
+        ]
+
+    def test_keeps_system_and_latest_turns(self):
+        transform = TokenBudgetTransform(max_tokens=60, token_counter=self.counter)
+        result = transform.transform(self.messages)
+        self.assertEqual([m["content"][0] for m in result], ["s", "c", "d"])
+
+    def test_keeps_latest_message_over_budget(self):
+        transform = TokenBudgetTransform(max_tokens=10, token_counter=self.counter)
+        self.assertEqual([m["content"][0] for m in transform.transform(self.messages)], ["s", "d"])
+
+    def test_summarizer_replaces_dropped_messages(self):
+        summaries = []
+
+        def summarizer(dropped):
+            summaries.append(len(dropped))
+            return {"role": "system", "content": "summary"}
+
+        transform = TokenBudgetTransform(max_tokens=80, summarizer=summarizer, token_counter=self.counter)
+        result = transform.transform(self.messages)
+        self.assertEqual(summaries, [2])
+        self.assertEqual([m["content"] for m in result[:2]], ["s" * 40, "summary"])
+
+    def test_window_start(self):
+        transform = TokenBudgetTransform(max_tokens=60, token_counter=self.counter)
+        self.assertEqual(transform.window_start(self.messages), 2)
+        self.assertEqual(TokenBudgetTransform(max_tokens=1000, token_counter=self.counter).window_start(self.messages), 0)
+
+    def test_caches_count_on_message_objects(self):
+        from core.models.app import UserMessage, TextContent
+        message = UserMessage(content=[TextContent(text="x" * 40)])
+        self.assertEqual(self.counter.count_message(message), TOKENS_PER_MESSAGE + 10)
+        self.assertEqual(message.token_count, TOKENS_PER_MESSAGE + 10)
+
+    def test_uses_stored_count_of_dict_messages(self):
+        message = {"role": "user", "content": "x" * 40, "token_count": 3}
+        self.assertEqual(self.counter.count_message(message), 3)
+        self.assertIs(get_token_counter("gpt-4o"), get_token_counter("gpt-4o"))
+
+    def test_failed_encoding_is_not_cached(self):
+        from unittest import mock
+        model = "test-model-without-encoding"
+        try:
+            with mock.patch(f"{__name__}._load_encoding", side_effect=OSError("offline")):
+                self.assertIsNone(get_encoding(model))
+            with mock.patch(f"{__name__}._load_encoding", return_value="encoding"):
+                # Still within the retry interval
+                self.assertIsNone(get_encoding(model))
+                _encoding_failures[model] = 0
+                self.assertEqual(get_encoding(model), "encoding")
+        finally:
+            _encodings.pop(model, None)
+            _encoding_failures.pop(model, None)
+
+
 if __name__ == "__main__":
     unittest.main()
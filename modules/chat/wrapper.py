@@ -1,53 +1,177 @@
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
 from openai import Stream
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 
+from modules.chat.transform import ReasoningContentTagProcessor
+
+
+REASONING_BEGIN_MARKER = "<think>"
+REASONING_END_MARKER = "</think>"
+
+
+class StreamEventType(str, Enum):
+    REASONING = "reasoning"
+    CONTENT = "content"
+    TOOL_CALL = "tool_call"
+    USAGE = "usage"
+
+
+class StreamEvent(NamedTuple):
+    """A typed piece of a streamed completion.
+
+    `text` is set for reasoning and content deltas, `data` holds the tool call delta or the usage object.
+    """
+    type: StreamEventType
+    text: str = ""
+    data: Any = None
 
-def stream_with_reasoning_content_wrapper(stream: Stream[ChatCompletionChunk]):
-    """Wrap a generator that yields ChatCompletionChunk objects into a function that yields reasoning_content and content."""
-    # 初始化变量
-    REASONING_BEGIN_MARKER = "<think>"
-    REASONING_END_MARKER = "</think>"
-    reasoning_content = ""
-    content = ""
-    reasoning_started = False  # 标记是否已经开始输出 reasoning_content
+
+StreamSubscriber = Callable[[StreamEvent], None]
+
+
+def iter_stream_events(
+    stream: Iterable[ChatCompletionChunk],
+    split_think_tags: bool = True,
+) -> Iterator[StreamEvent]:
+    """Turn a stream of ChatCompletionChunk objects into typed events.
+
+    Args:
+        stream: The completion stream.
+        split_think_tags: Models that put their reasoning inside `<think>` tags in the content
+            get those parts emitted as reasoning events, split while streaming.
+    """
+    tag_parser = ReasoningContentTagProcessor().stream_parser() if split_think_tags else None
 
     for chunk in stream:
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            yield StreamEvent(StreamEventType.USAGE, data=usage)
+        if not chunk.choices:
+            continue
         delta = chunk.choices[0].delta
-        new_reasoning_content = ""
-        new_content = ""
-
-        try:
-            if delta.reasoning_content:
-                new_reasoning_content = delta.reasoning_content
-        except AttributeError:
-            pass
-
-        try:
-            if delta.content:
-                new_content = delta.content
-        except AttributeError:
-            pass
-
-        # 更新累积内容
-        reasoning_content += new_reasoning_content
-        content += new_content
-
-        # 优先输出 reasoning_content
-        if new_reasoning_content:
+
+        reasoning_content = getattr(delta, "reasoning_content", None)
+        if reasoning_content:
+            yield StreamEvent(StreamEventType.REASONING, reasoning_content)
+
+        content = getattr(delta, "content", None)
+        if content:
+            if tag_parser is None:
+                yield StreamEvent(StreamEventType.CONTENT, content)
+            else:
+                for inside, text in tag_parser.feed(content):
+                    yield StreamEvent(StreamEventType.REASONING if inside else StreamEventType.CONTENT, text)
+
+        for tool_call in getattr(delta, "tool_calls", None) or []:
+            yield StreamEvent(StreamEventType.TOOL_CALL, data=tool_call)
+
+    if tag_parser is not None:
+        for inside, text in tag_parser.flush():
+            yield StreamEvent(StreamEventType.REASONING if inside else StreamEventType.CONTENT, text)
+
+
+class StreamAccumulator:
+    """Collects stream events into lists and joins them only when the totals are read.
+
+    Pass an instance as a subscriber of `publish_stream_events` to get the full
+    reasoning, content, tool calls and usage once the stream is done.
+    """
+
+    def __init__(self):
+        self._reasoning_parts: List[str] = []
+        self._content_parts: List[str] = []
+        self._tool_calls: Dict[int, Dict[str, Any]] = {}
+        self.usage: Any = None
+
+    def __call__(self, event: StreamEvent) -> None:
+        if event.type == StreamEventType.REASONING:
+            self._reasoning_parts.append(event.text)
+        elif event.type == StreamEventType.CONTENT:
+            self._content_parts.append(event.text)
+        elif event.type == StreamEventType.TOOL_CALL:
+            self._add_tool_call(event.data)
+        elif event.type == StreamEventType.USAGE:
+            self.usage = event.data
+
+    def _add_tool_call(self, tool_call: Any) -> None:
+        # Tool call deltas share an index, the name arrives once and the arguments in pieces
+        entry = self._tool_calls.setdefault(
+            getattr(tool_call, "index", len(self._tool_calls)),
+            {"id": None, "type": "function", "function": {"name": "", "arguments": []}},
+        )
+        if getattr(tool_call, "id", None):
+            entry["id"] = tool_call.id
+        function = getattr(tool_call, "function", None)
+        if function is not None:
+            if function.name:
+                entry["function"]["name"] += function.name
+            if function.arguments:
+                entry["function"]["arguments"].append(function.arguments)
+
+    @property
+    def reasoning_content(self) -> str:
+        if len(self._reasoning_parts) > 1:
+            self._reasoning_parts = ["".join(self._reasoning_parts)]
+        return self._reasoning_parts[0] if self._reasoning_parts else ""
+
+    @property
+    def content(self) -> str:
+        if len(self._content_parts) > 1:
+            self._content_parts = ["".join(self._content_parts)]
+        return self._content_parts[0] if self._content_parts else ""
+
+    @property
+    def tool_calls(self) -> List[Dict[str, Any]]:
+        return [
+            {**entry, "function": {**entry["function"], "arguments": "".join(entry["function"]["arguments"])}}
+            for _, entry in sorted(self._tool_calls.items())
+        ]
+
+
+def publish_stream_events(
+    stream: Iterable[ChatCompletionChunk],
+    subscribers: Optional[Iterable[StreamSubscriber]] = None,
+    split_think_tags: bool = True,
+) -> Iterator[StreamEvent]:
+    """Yield the events of a stream, handing each one to every subscriber first.
+
+    Persistence (`StreamAccumulator`), UI rendering and token accounting can all consume
+    the same stream this way without buffering it or reading it twice.
+    """
+    subscribers = list(subscribers or [])
+    for event in iter_stream_events(stream, split_think_tags=split_think_tags):
+        for subscriber in subscribers:
+            subscriber(event)
+        yield event
+
+
+def stream_with_reasoning_content_wrapper(
+    stream: Stream[ChatCompletionChunk],
+    subscribers: Optional[Iterable[StreamSubscriber]] = None,
+):
+    """Wrap a generator that yields ChatCompletionChunk objects into a function that yields reasoning_content and content.
+
+    Reasoning is wrapped in `<think>` markers so the text can be written with `st.write_stream`.
+    Nothing is accumulated here; pass a `StreamAccumulator` in `subscribers` to get the totals.
+    """
+    reasoning_started = False  # 标记是否已经开始输出 reasoning_content
+
+    for event in publish_stream_events(stream, subscribers):
+        if event.type == StreamEventType.REASONING:
             if not reasoning_started:
                 # 如果是第一次输出 reasoning_content，添加开始标志
                 yield REASONING_BEGIN_MARKER
                 reasoning_started = True
-            yield new_reasoning_content
-        else:
-            # 如果没有新的 reasoning_content，则输出 content
-            if new_content:
-                # 如果之前有 reasoning_content 输出，先添加结束标志
-                if reasoning_started:
-                    yield REASONING_END_MARKER
-                    reasoning_started = False
-                yield new_content
+            yield event.text
+        elif event.type == StreamEventType.CONTENT:
+            # 如果之前有 reasoning_content 输出，先添加结束标志
+            if reasoning_started:
+                yield REASONING_END_MARKER
+                reasoning_started = False
+            yield event.text
 
     # 如果循环结束后仍有未结束的 reasoning_content，添加结束标志
     if reasoning_started:
-        yield REASONING_END_MARKER
\ No newline at end of file
+        yield REASONING_END_MARKER
@@ -5,6 +5,7 @@ from modules.llm.openai import OpenAILLM
 from modules.rag.base import BaseRAG
 from modules.retrievers.vector.chroma import ChromaRetriever
 from modules.types.rag import BaseRAGResponse
+from utils.log.logger_config import shorten
 
 
 class BasicRAG(BaseRAG):
@@ -67,7 +68,7 @@ class BasicRAG(BaseRAG):
             documents=documents,
             system_prompt=system_prompt if system_prompt is not None else None,
         )
-        logger.info(f"System prompt: {system_prompt}")
+        logger.opt(lazy=True).debug("System prompt: {}", lambda: shorten(system_prompt))
         return BaseRAGResponse(
             response_id=str(uuid4()),
             answer=self.llm.invoke(
@@ -93,7 +94,7 @@ class BasicRAG(BaseRAG):
             query=query,
             documents=documents,
         )
-        logger.info(f"Prompt is wrapped, actual prompt: {prompt}")
+        logger.opt(lazy=True).debug("Prompt is wrapped, actual prompt: {}", lambda: shorten(prompt))
         return BaseRAGResponse(
             response_id=str(uuid4()),
             answer=self.llm.invoke(
@@ -5,6 +5,7 @@ from modules.retrievers.base import BaseContextualRetriever
 from modules.llm.openai import OpenAILLM
 from modules.types.rag import BaseRAGResponse
 from modules.rag.base import BaseRAG
+from utils.log.logger_config import shorten
 from typing import Union, List, Dict, Any, Optional, Generator
 
 
@@ -25,9 +26,16 @@ class ConversationRAG(BaseRAG):
     def _build_system_prompt_with_documents_and_messages(
         self,
         documents: Union[List[Dict[str, str]], str],
-        messages: List[Dict[str, Any]],
+        messages: Optional[List[Dict[str, Any]]] = None,
         system_prompt: Optional[str] = None,
+        summary: Optional[str] = None,
     ) -> str:
+        """
+        Build the system prompt from the retrieved documents.
+
+        The chat history is sent as messages, so `messages` is only written into the prompt when given
+        explicitly; `summary` is the rolling summary of the turns that are no longer sent.
+        """
         if system_prompt is None:
             system_prompt = self.default_system_prompt
 
@@ -43,25 +51,14 @@ class ConversationRAG(BaseRAG):
             except Exception as e:
                 raise f"Unsupported document format: {e}"
 
-        messages_to_str = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
-
-        prompt_template = (
-            "{system_prompt}"
-            "\n\n"
-            "<chat_history>"
-            "\n\n"
-            "{messages}"
-            "\n\n"
-            "<context>"
-            "\n\n"
-            "{documents}"
-        )
-
-        return prompt_template.format(
-            system_prompt=system_prompt,
-            documents=documents,
-            messages=messages_to_str
-        )
+        sections = [system_prompt]
+        if summary:
+            sections.append(f"<conversation_summary>\n\n{summary}")
+        if messages:
+            messages_to_str = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+            sections.append(f"<chat_history>\n\n{messages_to_str}")
+        sections.append(f"<context>\n\n{documents}")
+        return "\n\n".join(sections)
 
     def _build_query_prompt_with_documents_and_messages(
         self,
@@ -91,15 +88,17 @@ class ConversationRAG(BaseRAG):
         query: str,
         system_prompt: Optional[str] = None,
         stream: bool = False,
+        summary: Optional[str] = None,
     ) -> BaseRAGResponse:
         """
         Invoke the RAG model with the given query and system prompt.
-        The context messages and source documents will be combinded into system prompt, which means the system prompt will be updated with the new context messages and source documents.
+        The source documents and the conversation summary will be combinded into system prompt, while the context messages are sent as messages, so the history is only sent once.
         
         Args:
             query (str): The query to be answered.
             system_prompt (str, optional): The system prompt to be used. Defaults to None.
             stream (bool, optional): Whether to stream the response. Defaults to False.
+            summary (str, optional): Rolling summary of the turns older than the context messages. Defaults to None.
         
         Returns:
             BaseRAGResponse: The response from the RAG model.
@@ -108,10 +107,10 @@ class ConversationRAG(BaseRAG):
         documents = retrieve_result.get("result")
         system_prompt = self._build_system_prompt_with_documents_and_messages(
             documents=documents,
-            messages=self.retriever.context_messages,
-            system_prompt=system_prompt if system_prompt is not None else None,
+            system_prompt=system_prompt,
+            summary=summary,
         )
-        logger.info(f"ConversationRAG's system prompt: {system_prompt[:100]}......")
+        logger.opt(lazy=True).debug("ConversationRAG's system prompt: {}", lambda: shorten(system_prompt))
 
         # 在ConversationRAG中，messages是不包含query的，所以这里需要将query添加到messages中
         # deepcopy是为了防止messages被修改
@@ -172,7 +171,7 @@ class ConversationRAG(BaseRAG):
             documents=documents,
             messages=messages,
         )
-        logger.info(f"Prompt is wrapped, actual prompt: {prompt}")
+        logger.opt(lazy=True).debug("Prompt is wrapped, actual prompt: {}", lambda: shorten(prompt))
 
         # 在ConversationRAG中，messages是不包含query的，所以这里需要将query添加到messages中
         messages.append({"role": "user", "content": query})
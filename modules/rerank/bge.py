@@ -1,8 +1,7 @@
 import os
-from typing import List, Dict, Union, Optional, Sequence
-from sentence_transformers import CrossEncoder
-from huggingface_hub import snapshot_download
+from typing import Any, List, Dict, Union, Optional, Sequence
 from modules.types.document import Document
+from utils.lazy_imports import get_huggingface_hub, get_sentence_transformers
 from modules.rerank.base import BaseDocumentCompressor
 
 
@@ -15,8 +14,8 @@ class BgeRerank(BaseDocumentCompressor):
     top_n: int = 10   
     """Number of documents to return."""
     # model:CrossEncoder = CrossEncoder(os.path.join('embedding model',model_name))
-    model:CrossEncoder = None
-    """CrossEncoder instance to use for reranking."""
+    model: Any = None
+    """CrossEncoder instance to use for reranking, sentence_transformers is imported when the model is loaded."""
 
     def __init__(self, model_name: Optional[str] = None, top_n: Optional[int] = None):
         super().__init__()
@@ -27,13 +26,14 @@ class BgeRerank(BaseDocumentCompressor):
         self.define_model()
 
     def define_model(self):
+        CrossEncoder = get_sentence_transformers().CrossEncoder
         model_path = os.path.join('embeddings',self.model_name)
         try:
-            self.model:CrossEncoder = CrossEncoder(model_name=model_path)
+            self.model = CrossEncoder(model_name=model_path)
         except:
-            snapshot_download(repo_id="BAAI/"+self.model_name,
-                              local_dir=model_path)
-            self.model:CrossEncoder = CrossEncoder(model_name=model_path)
+            get_huggingface_hub().snapshot_download(repo_id="BAAI/"+self.model_name,
+                                                    local_dir=model_path)
+            self.model = CrossEncoder(model_name=model_path)
 
     def bge_rerank(self,query,docs):
         model_inputs =  [[query, doc] for doc in docs]
@@ -1,8 +1,14 @@
+import os
+import re
 import json
-import networkx as nx
-import matplotlib.pyplot as plt
-from typing import List, Optional, Sequence, Type, Union, Generator
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Type, Union, Generator
+from config.constants import GRAPH_EXTRACTION_CACHE_DIR
 from modules.llm.openai import OpenAILLM
+from utils.lazy_imports import get_networkx, get_pyplot
+from modules.retrievers.graph.store import KnowledgeGraphStore, chunk_hash, node_key
 from loguru import logger
 from modules.types.graph import (
     Node,
@@ -12,7 +18,78 @@ from modules.types.graph import (
     UnstructuredRelation,
 )
 
+if TYPE_CHECKING:
+    import networkx as nx
+
 DEFAULT_NODE_TYPE = "Node"
+# 抽取提示词或输出格式变化时递增，使旧的抽取缓存失效
+EXTRACTION_PROMPT_VERSION = 1
+
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL)
+_THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+_DEFAULT_CACHE = object()
+
+
+def parse_json_response(text: str) -> Dict[str, Any]:
+    """解析模型返回的 JSON，允许外层的 Markdown 代码块、<think> 推理内容与前后说明文字"""
+    text = _THINK_BLOCK.sub("", text or "").strip()
+    fence = _JSON_FENCE.search(text)
+    if fence:
+        text = fence.group(1)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end + 1])
+
+
+def _document_text(document: Any) -> str:
+    return getattr(document, "page_content", document)
+
+
+def _to_node(data: Dict[str, Any]) -> Node:
+    return Node(
+        id=str(data["id"]),
+        type=data.get("type") or DEFAULT_NODE_TYPE,
+        properties=data.get("properties") or {},
+    )
+
+
+class ExtractionCache:
+    """按分块内容与提示词缓存 LLM 的抽取结果（解析后的 JSON），重复构建图谱时不再调用 LLM"""
+
+    def __init__(self, cache_dir: str = GRAPH_EXTRACTION_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def key(text: str, prompt_fingerprint: str) -> str:
+        return chunk_hash(f"{prompt_fingerprint}\0{text}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable extraction cache entry {key}: {e}")
+            return None
+
+    def put(self, key: str, parsed_response: Dict[str, Any]) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(parsed_response, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write extraction cache entry {key}: {e}")
 
 
 def create_simple_model(
@@ -73,7 +150,16 @@ class LLMGraphTransformer:
         node_properties: Union[bool, List[str]] = False,
         relationship_properties: Union[bool, List[str]] = False,
         max_retries: int = 3,  # 添加最大重试次数参数
+        max_workers: int = 4,
+        cache: Optional["ExtractionCache"] = _DEFAULT_CACHE,
+        checkpoint_interval: int = 50,
     ):
+        """
+        Args:
+            max_workers: 同时抽取的分块数
+            cache: 抽取结果缓存，默认使用 `GRAPH_EXTRACTION_CACHE_DIR`，为 None 时不缓存
+            checkpoint_interval: 合并进图谱时每隔多少个分块保存一次
+        """
         self.llm = llm
         self.allowed_nodes = allowed_nodes
         self.allowed_relationships = allowed_relationships
@@ -82,6 +168,13 @@ class LLMGraphTransformer:
         self.node_properties = node_properties
         self.relationship_properties = relationship_properties
         self.max_retries = max_retries  # 保存最大重试次数
+        self.max_workers = max_workers
+        self.cache = ExtractionCache() if cache is _DEFAULT_CACHE else cache
+        self.checkpoint_interval = max(checkpoint_interval, 1)
+        # 提示词变化时缓存自动失效
+        self._prompt_fingerprint = hashlib.sha256(
+            f"v{EXTRACTION_PROMPT_VERSION}\0{system_prompt}\0{self.prompt}\0{self._format()}".encode()
+        ).hexdigest()
 
     def _default_prompt(self) -> str:
         return (
@@ -137,110 +230,153 @@ class LLMGraphTransformer:
             ]
         }"""
 
-    def process_response(self, document: str) -> GraphDocument:
-        messages = [
+    def _messages(self, text: str) -> List[Dict[str, str]]:
+        return [
             {"role": "system", "content": system_prompt},
             {
                 "role": "user",
-                "content": self.prompt.format(input=document, format=self._format()),
+                "content": self.prompt.format(input=text, format=self._format()),
             },
         ]
 
+    def _invoke(self, text: str) -> str:
+        response = self.llm.invoke(self._messages(text))
+        logger.debug(f"Response: {response}")
+
+        if isinstance(response, Generator):
+            # 如果是流式响应，我们需要收集所有的内容
+            return "".join(
+                chunk.choices[0].delta.content
+                for chunk in response
+                if chunk.choices[0].delta.content is not None
+            )
+        return response.choices[0].message.content
+
+    def _extract(self, text: str) -> Optional[Dict[str, Any]]:
+        """调用 LLM 抽取一个分块，结果按分块内容与提示词缓存；多次重试仍失败时返回 None"""
+        cache_key = ExtractionCache.key(text, self._prompt_fingerprint)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
         for attempt in range(self.max_retries):
+            full_response = ""
             try:
-                response = self.llm.invoke(messages)
-
-                logger.debug(f"Response: {response}")
-
-                if isinstance(response, Generator):
-                    # 如果是流式响应，我们需要收集所有的内容
-                    full_response = "".join(
-                        chunk.choices[0].delta.content
-                        for chunk in response
-                        if chunk.choices[0].delta.content is not None
-                    )
-                else:
-                    full_response = response.choices[0].message.content
-
-                parsed_response = json.loads(full_response)
-                break  # 如果成功解析，跳出循环
+                full_response = self._invoke(text)
+                parsed_response = parse_json_response(full_response)
+                if self.cache is not None:
+                    self.cache.put(cache_key, parsed_response)
+                return parsed_response
             except json.JSONDecodeError:
-                # 如果JSON解析失败，则可能是包裹在Markdown的json代码块中
-                if full_response.startswith("```json"):
-                    logger.debug(
-                        "Attempting to parse response wrapped in Markdown JSON code block"
-                    )
-                    full_response = full_response[7:-3]
-                    logger.debug(f"Parsed response: {full_response}")
-                    try:
-                        parsed_response = json.loads(full_response)
-                        break  # 如果成功解析，跳出循环
-                    except json.JSONDecodeError:
-                        if attempt == self.max_retries - 1:
-                            logger.error(f"JSON parsing failed: {full_response}")
-                            return GraphDocument(nodes=[], relationships=[])
-                else:
-                    if attempt == self.max_retries - 1:
-                        logger.error(f"JSON parsing failed: {full_response}")
-                        return GraphDocument(nodes=[], relationships=[])
+                if attempt == self.max_retries - 1:
+                    logger.error(f"JSON parsing failed: {full_response}")
             except Exception as e:
                 if attempt == self.max_retries - 1:
                     logger.error(f"Error in processing response: {str(e)}")
-                    return GraphDocument(nodes=[], relationships=[])
+            if attempt < self.max_retries - 1:
+                logger.warning(f"Attempt {attempt + 1} failed, retrying...")
+        return None
 
-            logger.warning(f"Attempt {attempt + 1} failed, retrying...")
+    def _build_graph_document(self, parsed_response: Dict[str, Any], document: Any) -> GraphDocument:
+        # 按合并键索引节点，关系端点的查找为 O(1)
+        nodes_by_id: Dict[str, Node] = {}
 
-        nodes = [Node(**node) for node in parsed_response.get("nodes", [])]
-        relationships = []
-        for rel in parsed_response.get("relationships", []):
-            source = rel.get("source")
-            target = rel.get("target")
-
-            # 处理 source
-            if isinstance(source, str):
-                source_node = next((node for node in nodes if node.id == source), None)
-                if source_node is None:
-                    source_node = Node(id=source, type=DEFAULT_NODE_TYPE)
-                    nodes.append(source_node)
-            elif isinstance(source, dict):
-                source_node = Node(**source)
+        def resolve(endpoint: Any) -> Optional[Node]:
+            if isinstance(endpoint, dict) and endpoint.get("id"):
+                node = _to_node(endpoint)
+            elif isinstance(endpoint, str) and endpoint:
+                node = Node(id=endpoint, type=DEFAULT_NODE_TYPE)
             else:
-                continue  # 跳过无效的 source
-
-            # 处理 target
-            if isinstance(target, str):
-                target_node = next((node for node in nodes if node.id == target), None)
-                if target_node is None:
-                    target_node = Node(id=target, type=DEFAULT_NODE_TYPE)
-                    nodes.append(target_node)
-            elif isinstance(target, dict):
-                target_node = Node(**target)
-            else:
-                continue  # 跳过无效的 target
+                return None
+            # 已有的节点优先，只有 id 的端点不会覆盖带类型的节点
+            return nodes_by_id.setdefault(node_key(node.id), node)
+
+        for node in parsed_response.get("nodes", []):
+            if isinstance(node, dict) and node.get("id"):
+                node = _to_node(node)
+                nodes_by_id.setdefault(node_key(node.id), node)
 
+        relationships = []
+        for rel in parsed_response.get("relationships", []):
+            if not isinstance(rel, dict) or not rel.get("type"):
+                continue
+            source_node = resolve(rel.get("source"))
+            target_node = resolve(rel.get("target"))
+            if source_node is None or target_node is None:
+                continue  # 跳过无效的端点
             relationships.append(
                 Relationship(source=source_node, target=target_node, type=rel["type"])
             )
 
-        if self.strict_mode:
-            nodes = [node for node in nodes if node.type in self.allowed_nodes]
+        nodes = list(nodes_by_id.values())
+        # 只按设置了的白名单过滤
+        if self.strict_mode and self.allowed_nodes:
+            allowed_nodes = set(self.allowed_nodes)
+            nodes = [node for node in nodes if node.type in allowed_nodes]
             relationships = [
                 rel
                 for rel in relationships
-                if rel.type in self.allowed_relationships
-                and rel.source.type in self.allowed_nodes
-                and rel.target.type in self.allowed_nodes
+                if rel.source.type in allowed_nodes and rel.target.type in allowed_nodes
             ]
+        if self.strict_mode and self.allowed_relationships:
+            allowed_relationships = set(self.allowed_relationships)
+            relationships = [rel for rel in relationships if rel.type in allowed_relationships]
 
         return GraphDocument(nodes=nodes, relationships=relationships, source=document)
 
+    def _process(self, document: Any) -> Optional[GraphDocument]:
+        parsed_response = self._extract(_document_text(document))
+        if parsed_response is None:
+            return None
+        return self._build_graph_document(parsed_response, document)
+
+    def process_response(self, document: str) -> GraphDocument:
+        return self._process(document) or GraphDocument(nodes=[], relationships=[])
+
     def convert_to_graph_documents(
-        self, documents: Sequence[str]
+        self,
+        documents: Sequence[Any],
+        graph_store: Optional[KnowledgeGraphStore] = None,
+        on_progress: Optional[Callable[[int, int], None]] = None,
     ) -> List[GraphDocument]:
-        return [self.process_response(document) for document in documents]
+        """
+        并发抽取多个分块
+
+        Args:
+            documents: 分块文本（或带 `page_content` 的 Document）
+            graph_store: 指定时每个分块完成后立即合并进图谱，并每隔 `checkpoint_interval` 个分块把新的分块追加到图谱日志，
+                中断后重新运行时已抽取的分块直接命中缓存
+            on_progress: 每完成一个分块调用一次，参数为已完成数与总数
+
+        Returns:
+            List[GraphDocument]: 与 `documents` 顺序一致，抽取失败的分块为空图
+        """
+        results: List[GraphDocument] = [GraphDocument(nodes=[], relationships=[]) for _ in documents]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="graph-extraction") as executor:
+            futures = {executor.submit(self._process, document): index for index, document in enumerate(documents)}
+            for completed, future in enumerate(as_completed(futures), start=1):
+                index = futures[future]
+                try:
+                    graph_document = future.result()
+                except Exception as e:
+                    logger.error(f"Error extracting graph from chunk {index}: {str(e)}")
+                    graph_document = None
+                if graph_document is not None:
+                    results[index] = graph_document
+                    if graph_store is not None:
+                        graph_store.merge(graph_document, chunk_hash(_document_text(documents[index])))
+                        if completed % self.checkpoint_interval == 0:
+                            graph_store.save()
+                if on_progress is not None:
+                    on_progress(completed, len(documents))
+        if graph_store is not None:
+            graph_store.save()
+        return results
 
     @staticmethod
-    def _create_knowledge_graph(graph_document: GraphDocument) -> nx.Graph:
+    def _create_knowledge_graph(graph_document: GraphDocument) -> "nx.Graph":
+        nx = get_networkx()
         G = nx.Graph()
         
         # 添加节点
@@ -254,7 +390,9 @@ class LLMGraphTransformer:
         return G
     
     @staticmethod
-    def _visualize_knowledge_graph(G: nx.Graph, output_file: str = 'knowledge_graph.png'):
+    def _visualize_knowledge_graph(G: "nx.Graph", output_file: str = 'knowledge_graph.png'):
+        nx = get_networkx()
+        plt = get_pyplot()
         plt.figure(figsize=(12, 8))
         pos = nx.spring_layout(G)
         
@@ -279,6 +417,7 @@ class LLMGraphTransformer:
         output_path: str = 'knowledge_graph.png'
     ):
         # 合并多个GraphDocument
+        nx = get_networkx()
         combined_graph = nx.Graph()
         for doc in graph_documents:
             G = cls._create_knowledge_graph(doc)
@@ -0,0 +1,306 @@
+import os
+import json
+import math
+import sqlite3
+import asyncio
+from contextlib import closing
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from config.constants import KNOWLEDGE_GRAPH_INDEX_FILE
+from modules.retrievers.base import BaseRetriever
+from modules.retrievers.graph.store import KnowledgeGraphStore, chunk_hash, node_key
+
+# 参与匹配的实体名称最短长度，过短的名称误匹配太多
+MIN_ENTITY_KEY_LENGTH = 2
+
+_SCHEMA = """
+CREATE TABLE entities (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL
+);
+CREATE TABLE entity_chunks (
+    entity_id INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (entity_id, chunk_id)
+) WITHOUT ROWID;
+CREATE TABLE edges (
+    source_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    target_id INTEGER NOT NULL,
+    PRIMARY KEY (source_id, type, target_id)
+) WITHOUT ROWID;
+CREATE INDEX edges_by_target ON edges (target_id);
+CREATE TABLE chunks (
+    chunk_id TEXT PRIMARY KEY,
+    page_content TEXT NOT NULL,
+    metadata TEXT
+) WITHOUT ROWID;
+"""
+
+Fact = Tuple[int, str, int]
+
+
+def _is_word_char(char: str) -> bool:
+    # 只有 ASCII 字母数字需要按词边界匹配，中文等可以在任意位置开始
+    return char.isascii() and char.isalnum()
+
+
+def _document_fields(document: Any) -> Tuple[str, Dict[str, Any]]:
+    if isinstance(document, str):
+        return document, {}
+    if isinstance(document, dict):
+        return document["page_content"], document.get("metadatas") or document.get("metadata") or {}
+    return document.page_content, dict(getattr(document, "metadata", {}) or {})
+
+
+class GraphIndex:
+    """
+    知识图谱的磁盘索引（SQLite），检索时只查询需要的行，不加载整个图谱
+
+    - `entity_chunks`：实体 -> 提到它的分块（倒排索引）
+    - `edges`：按起点的主键与按终点的索引即为出边与入边的邻接表
+    - `chunks`：分块的文本与元数据，检索结果直接从这里读取
+    """
+
+    def __init__(self, path: str = KNOWLEDGE_GRAPH_INDEX_FILE):
+        self.path = path
+        self._keys: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        self._lengths: List[int] = []
+        if os.path.exists(path):
+            self._load_entities()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每次查询使用独立的只读连接，可以在多个线程中同时检索
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def _load_entities(self) -> None:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT id, key, name FROM entities").fetchall()
+        self._names = {entity_id: name for entity_id, _, name in rows}
+        self._keys = {key: entity_id for entity_id, key, _ in rows if len(key) >= MIN_ENTITY_KEY_LENGTH}
+        self._lengths = sorted({len(key) for key in self._keys}, reverse=True)
+
+    @classmethod
+    def build(
+        cls,
+        store: KnowledgeGraphStore,
+        documents: Iterable[Any],
+        path: str = KNOWLEDGE_GRAPH_INDEX_FILE,
+    ) -> "GraphIndex":
+        """
+        由图谱与分块重建索引，写入临时文件后替换，重建期间旧索引仍可查询
+
+        Args:
+            store: 知识图谱
+            documents: 抽取图谱时使用的分块：文本、`{"page_content", "metadatas"}` 字典或 Document
+            path: 索引文件路径
+        """
+        nodes, edges = store.snapshot()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(_SCHEMA)
+            entity_ids = {key: entity_id for entity_id, key in enumerate(nodes, start=1)}
+            conn.executemany(
+                "INSERT INTO entities (id, key, name, type, chunk_count) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (entity_ids[key], key, node["id"], node["type"], len(node["sources"]))
+                    for key, node in nodes.items()
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO entity_chunks (entity_id, chunk_id) VALUES (?, ?)",
+                ((entity_ids[key], chunk_id) for key, node in nodes.items() for chunk_id in node["sources"]),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO edges (source_id, type, target_id) VALUES (?, ?, ?)",
+                (
+                    (entity_ids[edge["source"]], edge["type"], entity_ids[edge["target"]])
+                    for edge in edges
+                    if edge["source"] in entity_ids and edge["target"] in entity_ids
+                ),
+            )
+            rows = []
+            for document in documents:
+                text, metadata = _document_fields(document)
+                rows.append((chunk_hash(text), text, json.dumps(metadata, ensure_ascii=False, default=str)))
+            conn.executemany("INSERT OR REPLACE INTO chunks (chunk_id, page_content, metadata) VALUES (?, ?, ?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        logger.info(f"Built graph index with {len(nodes)} entities, {len(edges)} relationships and {len(rows)} chunks")
+        return cls(path)
+
+    def match_entities(self, text: str) -> List[int]:
+        """
+        找出文本中提到的实体，返回实体 id
+
+        在每个可能的起点按实体名称的长度从长到短查表，先匹配到的最长名称优先，
+        耗时与文本长度乘以不同名称长度的数量成正比，与实体数量无关。
+        """
+        text = node_key(text)
+        found: List[int] = []
+        i, n = 0, len(text)
+        while i < n:
+            if i > 0 and _is_word_char(text[i - 1]) and _is_word_char(text[i]):
+                i += 1
+                continue
+            matched = None
+            for length in self._lengths:
+                end = i + length
+                if end > n or (end < n and _is_word_char(text[end - 1]) and _is_word_char(text[end])):
+                    continue
+                entity_id = self._keys.get(text[i:end])
+                if entity_id is not None:
+                    matched = (entity_id, end)
+                    break
+            if matched is None:
+                i += 1
+            else:
+                if matched[0] not in found:
+                    found.append(matched[0])
+                i = matched[1]
+        return found
+
+    def expand(self, seeds: List[int], hops: int, max_entities: int) -> Tuple[Dict[int, int], List[Fact]]:
+        """
+        沿关系（不分方向）向外扩展 `hops` 跳
+
+        Returns:
+            实体 id -> 跳数，以及经过的关系 (起点, 类型, 终点)
+        """
+        distances = {entity_id: 0 for entity_id in seeds[:max_entities]}
+        facts: List[Fact] = []
+        seen_facts = set()
+        frontier = list(distances)
+        with closing(self._connect()) as conn:
+            for hop in range(1, hops + 1):
+                if not frontier or len(distances) >= max_entities:
+                    break
+                placeholders = ",".join("?" * len(frontier))
+                rows = conn.execute(
+                    f"SELECT source_id, type, target_id FROM edges WHERE source_id IN ({placeholders}) "
+                    f"UNION SELECT source_id, type, target_id FROM edges WHERE target_id IN ({placeholders})",
+                    frontier * 2,
+                ).fetchall()
+                frontier = []
+                for fact in rows:
+                    source_id, _, target_id = fact
+                    for entity_id in (source_id, target_id):
+                        if entity_id not in distances and len(distances) < max_entities:
+                            distances[entity_id] = hop
+                            frontier.append(entity_id)
+                    # 下一跳会再次查到已经经过的关系
+                    if source_id in distances and target_id in distances and fact not in seen_facts:
+                        seen_facts.add(fact)
+                        facts.append(fact)
+        return distances, facts
+
+    def rank_chunks(self, distances: Dict[int, int], k: int) -> List[Dict[str, Any]]:
+        """
+        按分块提到的实体打分：离问题中的实体越近、提到它的分块越少，得分越高
+        """
+        if not distances:
+            return []
+        entity_ids = list(distances)
+        placeholders = ",".join("?" * len(entity_ids))
+        scores: Dict[str, float] = {}
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT ec.chunk_id, ec.entity_id, e.chunk_count FROM entity_chunks ec "
+                f"JOIN entities e ON e.id = ec.entity_id WHERE ec.entity_id IN ({placeholders})",
+                entity_ids,
+            ).fetchall()
+            for chunk_id, entity_id, chunk_count in rows:
+                weight = 1 / (distances[entity_id] + 1) / math.sqrt(max(chunk_count, 1))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + weight
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            results = []
+            for chunk_id, score in ranked:
+                row = conn.execute(
+                    "SELECT page_content, metadata FROM chunks WHERE chunk_id = ?", (chunk_id,)
+                ).fetchone()
+                if row is None:
+                    continue  # 分块已从知识库中删除
+                results.append({
+                    "page_content": row[0],
+                    "metadatas": json.loads(row[1]) if row[1] else {},
+                    "score": score,
+                })
+                if len(results) >= k:
+                    break
+        return results
+
+    def format_fact(self, fact: Fact) -> str:
+        source_id, rel_type, target_id = fact
+        return f"{self._names.get(source_id, source_id)} -[{rel_type}]-> {self._names.get(target_id, target_id)}"
+
+
+class GraphRetriever(BaseRetriever):
+    """
+    基于知识图谱的检索器
+
+    在问题中匹配实体，沿关系扩展 `hops` 跳，返回提到这些实体的分块。结果格式与其它检索器相同
+    （包含 `page_content` 与 `metadatas`），可以直接作为 `EnsembleRetriever` 的一员，
+    多跳问题所需的分块不必依赖向量检索召回更多结果。
+    """
+
+    def __init__(
+        self,
+        index: Optional[GraphIndex] = None,
+        k: int = 6,
+        hops: int = 2,
+        max_entities: int = 64,
+        max_facts: int = 20,
+    ):
+        """
+        Args:
+            index: 图谱索引，默认读取 `KNOWLEDGE_GRAPH_INDEX_FILE`
+            k: 返回的分块数
+            hops: 从问题中的实体向外扩展的跳数
+            max_entities: 扩展时最多访问的实体数，避免经过高度数节点后结果过多
+            max_facts: `invoke_format_to_str` 中列出的关系数
+        """
+        self.index = index or GraphIndex()
+        self.k = k
+        self.hops = hops
+        self.max_entities = max_entities
+        self.max_facts = max_facts
+
+    def _retrieve(self, query: str) -> Tuple[List[Dict[str, Any]], List[Fact]]:
+        seeds = self.index.match_entities(query)
+        if not seeds:
+            return [], []
+        distances, facts = self.index.expand(seeds, self.hops, self.max_entities)
+        results = self.index.rank_chunks(distances, self.k)
+        logger.info(f"Graph retrieval matched {len(seeds)} entities, expanded to {len(distances)}, retrieved {len(results)} documents")
+        return results, facts
+
+    def invoke(self, query: str) -> List[Dict[str, Any]]:
+        return self._retrieve(query)[0]
+
+    def invoke_format_to_str(self, query: str) -> Dict[str, Any]:
+        """检索结果格式化为字符串，检索到的关系放在文档之前"""
+        results, facts = self._retrieve(query)
+        parts = []
+        if facts:
+            parts.append("Knowledge graph:\n" + "\n".join(
+                f"- {self.index.format_fact(fact)}" for fact in facts[:self.max_facts]
+            ))
+        parts.extend(f"Document {i+1}: \n{doc['page_content']}" for i, doc in enumerate(results))
+        page_content = [doc["page_content"] for doc in results]
+        metadatas = [doc["metadatas"] for doc in results]
+        return dict(result="\n\n".join(parts), page_content=page_content, metadatas=metadatas)
+
+    async def ainvoke(self, query: str) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.invoke, query)
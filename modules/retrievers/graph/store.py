@@ -0,0 +1,288 @@
+import os
+import json
+import hashlib
+from threading import RLock
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from config.constants import KNOWLEDGE_GRAPH_FILE
+from modules.types.graph import GraphDocument, Node, Relationship
+from utils.lazy_imports import get_networkx
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+# 存储格式变化时递增
+GRAPH_STORE_VERSION = 1
+# 增量日志至少积累这么多条记录、且超过分块数时才合并进快照
+COMPACT_MIN_RECORDS = 1000
+
+EdgeKey = Tuple[str, str, str]
+
+
+def chunk_hash(text: str) -> str:
+    """分块的标识：分块内容的 sha256"""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def node_key(node_id: str) -> str:
+    """节点的合并键：忽略大小写与首尾空白，不同分块中的 "OpenAI" 与 "openai" 视为同一实体"""
+    return " ".join(node_id.split()).casefold()
+
+
+class KnowledgeGraphStore:
+    """
+    持久化的知识图谱，逐个合并各分块抽取出的 GraphDocument
+
+    每个节点与关系记录来自哪些分块（`sources`，分块内容的哈希），同一分块再次合并时先撤销它之前的贡献，
+    因此重复导入是幂等的；删除分块时只移除不再被任何分块引用的节点与关系。
+
+    `path` 处是完整快照，之后每个分块的合并与删除追加到 `path` + ".log" 的 JSONL 日志中，
+    `save` 只写入新增的记录；日志记录数超过分块数（且不少于 `COMPACT_MIN_RECORDS`）时才重写快照并清空日志。
+    加载时读取快照后按顺序重放日志，合并与删除都是幂等的，压缩中途中断也不会丢失数据。
+    """
+
+    def __init__(self, path: Optional[str] = KNOWLEDGE_GRAPH_FILE):
+        """
+        Args:
+            path: 图谱 JSON 快照的路径，为 None 时只保存在内存中
+        """
+        self.path = path
+        self.log_path = f"{path}.log" if path else None
+        self._lock = RLock()
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+        self._edges: Dict[EdgeKey, Dict[str, Any]] = {}
+        # 分块哈希 -> 该分块贡献的节点与关系
+        self._chunks: Dict[str, Dict[str, Set]] = {}
+        # 尚未写入日志的记录，以及日志中已有的记录数
+        self._pending: List[str] = []
+        self._log_records = 0
+        if path and os.path.exists(path):
+            self._load()
+        if self.log_path and os.path.exists(self.log_path) and not self._replay_log():
+            # 日志末尾不完整，重写快照，避免之后追加的记录接在损坏的行后面
+            self.compact()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable knowledge graph {self.path}: {e}")
+            return
+        if data.get("version") != GRAPH_STORE_VERSION:
+            logger.warning(f"Ignoring knowledge graph {self.path} of version {data.get('version')}")
+            return
+        for key, node in data.get("nodes", {}).items():
+            node["sources"] = set(node.get("sources", []))
+            self._nodes[key] = node
+            for chunk_id in node["sources"]:
+                self._chunk_entry(chunk_id)["nodes"].add(key)
+        for edge in data.get("edges", []):
+            key = (edge["source"], edge["type"], edge["target"])
+            edge["sources"] = set(edge.get("sources", []))
+            self._edges[key] = edge
+            for chunk_id in edge["sources"]:
+                self._chunk_entry(chunk_id)["edges"].add(key)
+
+    def _replay_log(self) -> bool:
+        """按顺序重放日志，日志完整时返回 True"""
+        try:
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable knowledge graph log {self.log_path}: {e}")
+            return True
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 写入中断的最后一行
+                logger.warning(f"Ignoring truncated record in knowledge graph log {self.log_path}")
+                return False
+            if record["op"] == "merge":
+                self._merge(
+                    [Node(**node) for node in record["nodes"]],
+                    [Relationship(**rel) for rel in record["relationships"]],
+                    record["chunk_id"],
+                )
+            elif record["op"] == "remove":
+                self._remove_chunk(record["chunk_id"])
+            self._log_records += 1
+        return True
+
+    def _record(self, record: Dict[str, Any]) -> None:
+        if self.log_path:
+            self._pending.append(json.dumps(record, ensure_ascii=False, default=str))
+
+    def _chunk_entry(self, chunk_id: str) -> Dict[str, Set]:
+        return self._chunks.setdefault(chunk_id, {"nodes": set(), "edges": set()})
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    @property
+    def num_relationships(self) -> int:
+        return len(self._edges)
+
+    def has_chunk(self, chunk_id: str) -> bool:
+        with self._lock:
+            return chunk_id in self._chunks
+
+    def _add_node(self, node: Node, chunk_id: str) -> str:
+        key = node_key(node.id)
+        entry = self._nodes.get(key)
+        if entry is None:
+            entry = self._nodes[key] = {"id": node.id, "type": node.type, "properties": {}, "sources": set()}
+        elif entry["type"] == "Node" and node.type != "Node":
+            # 先前只作为关系端点出现的节点，用更具体的类型代替默认类型
+            entry["type"] = node.type
+        entry["properties"].update(node.properties)
+        entry["sources"].add(chunk_id)
+        self._chunk_entry(chunk_id)["nodes"].add(key)
+        return key
+
+    def merge(self, graph_document: GraphDocument, chunk_id: str) -> None:
+        """
+        合并一个分块的抽取结果
+
+        Args:
+            graph_document: 分块抽取出的图
+            chunk_id: 分块内容的哈希
+        """
+        with self._lock:
+            self._merge(graph_document.nodes, graph_document.relationships, chunk_id)
+            self._record({
+                "op": "merge",
+                "chunk_id": chunk_id,
+                "nodes": [node.model_dump() for node in graph_document.nodes],
+                "relationships": [rel.model_dump() for rel in graph_document.relationships],
+            })
+
+    def _merge(self, nodes: List[Node], relationships: List[Relationship], chunk_id: str) -> None:
+        self._remove_chunk(chunk_id)
+        for node in nodes:
+            self._add_node(node, chunk_id)
+        for rel in relationships:
+            source = self._add_node(rel.source, chunk_id)
+            target = self._add_node(rel.target, chunk_id)
+            key = (source, rel.type, target)
+            edge = self._edges.get(key)
+            if edge is None:
+                edge = self._edges[key] = {
+                    "source": source, "type": rel.type, "target": target, "properties": {}, "sources": set()
+                }
+            edge["properties"].update(rel.properties)
+            edge["sources"].add(chunk_id)
+            self._chunk_entry(chunk_id)["edges"].add(key)
+        self._chunk_entry(chunk_id)
+
+    def remove_chunk(self, chunk_id: str) -> None:
+        """移除一个分块的贡献，不再被引用的节点与关系一并删除"""
+        with self._lock:
+            if self._remove_chunk(chunk_id):
+                self._record({"op": "remove", "chunk_id": chunk_id})
+
+    def _remove_chunk(self, chunk_id: str) -> bool:
+        entry = self._chunks.pop(chunk_id, None)
+        if entry is None:
+            return False
+        for key in entry["edges"]:
+            edge = self._edges.get(key)
+            if edge is not None:
+                edge["sources"].discard(chunk_id)
+                if not edge["sources"]:
+                    del self._edges[key]
+        for key in entry["nodes"]:
+            node = self._nodes.get(key)
+            if node is not None:
+                node["sources"].discard(chunk_id)
+                if not node["sources"]:
+                    del self._nodes[key]
+        return True
+
+    def get_node(self, node_id: str) -> Optional[Node]:
+        with self._lock:
+            entry = self._nodes.get(node_key(node_id))
+        if entry is None:
+            return None
+        return Node(id=entry["id"], type=entry["type"], properties=dict(entry["properties"]))
+
+    def relationships(self) -> List[Relationship]:
+        with self._lock:
+            return [
+                Relationship(
+                    source=Node(id=self._nodes[s]["id"], type=self._nodes[s]["type"]),
+                    target=Node(id=self._nodes[t]["id"], type=self._nodes[t]["type"]),
+                    type=rel_type,
+                    properties=dict(edge["properties"]),
+                )
+                for (s, rel_type, t), edge in self._edges.items()
+            ]
+
+    def to_graph_document(self) -> GraphDocument:
+        with self._lock:
+            nodes = [
+                Node(id=entry["id"], type=entry["type"], properties=dict(entry["properties"]))
+                for entry in self._nodes.values()
+            ]
+        return GraphDocument(nodes=nodes, relationships=self.relationships())
+
+    def snapshot(self) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+        """当前节点（合并键 -> 节点）与关系的副本，`sources` 为分块哈希的列表"""
+        with self._lock:
+            nodes = {key: {**entry, "sources": sorted(entry["sources"])} for key, entry in self._nodes.items()}
+            edges = [{**edge, "sources": sorted(edge["sources"])} for edge in self._edges.values()]
+        return nodes, edges
+
+    def to_networkx(self) -> "nx.MultiDiGraph":
+        """转换为 networkx 图，节点以合并键标识，`id` 属性为原始名称"""
+        G = get_networkx().MultiDiGraph()
+        with self._lock:
+            for key, entry in self._nodes.items():
+                G.add_node(key, id=entry["id"], type=entry["type"], **entry["properties"])
+            for (source, rel_type, target), edge in self._edges.items():
+                G.add_edge(source, target, key=rel_type, type=rel_type, **edge["properties"])
+        return G
+
+    def save(self, force: bool = False) -> None:
+        """
+        把新的合并与删除追加到日志，日志过长时压缩为快照，没有变化时跳过
+
+        Args:
+            force: 立即重写快照并清空日志
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if self._pending:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write("".join(f"{record}\n" for record in self._pending))
+                self._log_records += len(self._pending)
+                self._pending = []
+            if force or self._log_records > max(COMPACT_MIN_RECORDS, len(self._chunks)):
+                self.compact()
+
+    def compact(self) -> None:
+        """重写完整快照（先写临时文件再替换）并清空日志"""
+        if not self.path:
+            return
+        with self._lock:
+            nodes, edges = self.snapshot()
+            payload = json.dumps(
+                {"version": GRAPH_STORE_VERSION, "nodes": nodes, "edges": edges},
+                ensure_ascii=False,
+                default=str,
+            )
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+            # 快照已包含日志中的全部记录，尚未写入日志的记录也已包含在快照中
+            self._pending = []
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self._log_records = 0
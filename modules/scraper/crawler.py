@@ -0,0 +1,448 @@
+import os
+import re
+import json
+import time
+import queue
+import asyncio
+import hashlib
+from html.parser import HTMLParser
+from threading import Event, Lock, Thread
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urldefrag, urljoin, urlparse
+from xml.etree import ElementTree
+
+import httpx
+from fake_useragent import UserAgent
+from loguru import logger
+
+from config.constants import CRAWL_STATE_DIR
+from modules.scraper.url import JinaScraper
+
+
+# 不会包含正文的链接
+_SKIPPED_EXTENSIONS = re.compile(
+    r"\.(png|jpe?g|gif|svg|webp|ico|css|js|zip|gz|tar|rar|7z|exe|dmg|mp3|mp4|avi|mov|woff2?|ttf|pdf)$",
+    re.IGNORECASE,
+)
+# Jina Reader 返回的 Markdown 中的链接
+_MARKDOWN_LINK = re.compile(r"\]\((https?://[^)\s]+)\)")
+
+
+class CrawlState:
+    """
+    每个 URL 上次抓取的 ETag、Last-Modified、内容哈希与页面链接，保存在 JSON 文件中
+
+    再次导入时发送条件请求，服务器返回 304 或内容哈希不变的页面不再重新分块与嵌入，
+    未变化页面的链接从记录中读取，仍可继续发现其下的页面。
+    新的或变化的页面只有在调用方嵌入成功后才通过 `commit` 记录，
+    嵌入失败或中途停止的页面下次导入时会重新抓取。
+    记录按知识库分开保存（见 `for_collection`），同一个网站导入另一个知识库时仍会完整抓取。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: 记录文件路径，为 None 时只保存在内存中
+        """
+        self.path = path
+        self._lock = Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable crawl state {path}: {e}")
+
+    @classmethod
+    def for_collection(cls, collection_id: str, state_dir: str = CRAWL_STATE_DIR) -> "CrawlState":
+        """知识库 `collection_id` 的抓取记录"""
+        return cls(os.path.join(state_dir, f"{quote(collection_id, safe='')}.json"))
+
+    def get(self, url: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._entries.get(url, {}))
+
+    def update(self, url: str, **entry: Any) -> None:
+        with self._lock:
+            self._entries[url] = {k: v for k, v in entry.items() if v}
+
+    def commit(self, results: Iterable[Dict]) -> None:
+        """记录已经嵌入的抓取结果（结果中的 `state`）并保存"""
+        for result in results:
+            if result.get("state"):
+                self.update(result["url"], **result["state"])
+        self.save()
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps(self._entries, ensure_ascii=False)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+class HostThrottle:
+    """按主机限制请求间隔，不同主机之间互不等待"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._next_request: Dict[str, float] = {}
+
+    async def wait(self, host: str) -> None:
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            wait = self._next_request.get(host, 0.0) - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_request[host] = loop.time() + self.delay
+
+    def back_off(self, host: str, seconds: float) -> None:
+        """服务器要求限流（429/503）时推迟该主机的下一次请求"""
+        loop = asyncio.get_running_loop()
+        self._next_request[host] = max(self._next_request.get(host, 0.0), loop.time() + seconds)
+
+
+class _PageParser(HTMLParser):
+    """提取页面标题与链接"""
+
+    def __init__(self):
+        super().__init__()
+        self.title = ""
+        self.links: List[str] = []
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+        elif tag == "title":
+            self._in_title = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+
+
+def html_to_markdown(html: str) -> str:
+    """把 HTML 转为 Markdown，没有安装 html2text 时退回提取纯文本"""
+    try:
+        import html2text
+    except ImportError:
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(html, "html.parser").get_text("\n", strip=True)
+    converter = html2text.HTML2Text()
+    converter.body_width = 0
+    converter.ignore_images = True
+    return converter.handle(html)
+
+
+class AsyncUrlCrawler:
+    """
+    并发的网页抓取器，用于把整个文档站点导入知识库
+
+    - 共享 httpx 连接池，按主机限制请求间隔，代替每次请求前的随机等待
+    - 使用 ETag/Last-Modified 条件请求，未变化的页面不再返回内容
+    - 从 sitemap.xml 与页面链接中发现新页面，只跟随起始 URL 同一主机、同一路径前缀下的链接
+    - 每抓取完一个页面就产出结果，调用方可以边抓取边分块、嵌入
+    """
+
+    def __init__(
+        self,
+        max_pages: int = 500,
+        max_depth: int = 2,
+        concurrency: int = 16,
+        per_host_delay: float = 0.2,
+        timeout: float = 10.0,
+        use_sitemap: bool = True,
+        use_jina: bool = False,
+        state: Optional[CrawlState] = None,
+    ):
+        """
+        Args:
+            max_pages: 最多抓取的页面数
+            max_depth: 从起始 URL 开始跟随链接的层数，0 表示只抓取起始 URL（与 sitemap 中的页面）
+            concurrency: 同时进行的请求数
+            per_host_delay: 同一主机两次请求之间的最小间隔（秒）
+            timeout: 单次请求的超时时间（秒）
+            use_sitemap: 是否读取起始 URL 所在站点的 sitemap.xml
+            use_jina: 是否通过 Jina Reader 获取页面的 Markdown
+            state: 条件请求使用的抓取记录，为 None 时每次都完整抓取
+        """
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.use_sitemap = use_sitemap
+        self.use_jina = use_jina
+        self.state = state
+        self._throttle = HostThrottle(per_host_delay)
+        self._ua = UserAgent()
+
+    @staticmethod
+    def _normalize(url: str) -> str:
+        return urldefrag(url)[0]
+
+    @staticmethod
+    def _in_scope(url: str, prefixes: List[Tuple[str, str]]) -> bool:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or _SKIPPED_EXTENSIONS.search(parsed.path):
+            return False
+        return any(parsed.netloc == host and parsed.path.startswith(path) for host, path in prefixes)
+
+    @staticmethod
+    def _scope_prefix(url: str) -> Tuple[str, str]:
+        parsed = urlparse(url)
+        path = parsed.path if parsed.path.endswith("/") else parsed.path.rsplit("/", 1)[0] + "/"
+        return parsed.netloc, path
+
+    async def _get(self, client: httpx.AsyncClient, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        host = urlparse(url).netloc
+        for attempt in range(3):
+            await self._throttle.wait(host)
+            response = await client.get(url, headers=headers)
+            if response.status_code not in (429, 503) or attempt == 2:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            self._throttle.back_off(host, min(float(retry_after) if retry_after.isdigit() else 2.0 ** (attempt + 1), 30.0))
+        return response
+
+    async def _sitemap_urls(self, client: httpx.AsyncClient, start_url: str, limit: int) -> List[str]:
+        """读取站点的 sitemap.xml，支持 sitemap index"""
+        parsed = urlparse(start_url)
+        pending = [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"]
+        urls: List[str] = []
+        while pending and len(urls) < limit:
+            try:
+                response = await self._get(client, pending.pop(0))
+                if response.status_code != 200:
+                    continue
+                root = ElementTree.fromstring(response.content)
+            except (httpx.HTTPError, ElementTree.ParseError) as e:
+                logger.debug(f"No usable sitemap for {start_url}: {e}")
+                continue
+            for element in root.iter():
+                if element.tag.endswith("}loc") or element.tag == "loc":
+                    loc = (element.text or "").strip()
+                    if not loc:
+                        continue
+                    if root.tag.endswith("sitemapindex"):
+                        pending.append(loc)
+                    else:
+                        urls.append(loc)
+        return urls[:limit]
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str, depth: int) -> Dict:
+        entry = self.state.get(url) if self.state else {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        request_url = JinaScraper.url_prefix + url if self.use_jina else url
+
+        result = {"url": url, "depth": depth, "links": []}
+        try:
+            response = await self._get(client, request_url, headers=headers)
+        except httpx.TimeoutException:
+            return {**result, "status": "error", "status_code": 408, "message": "Request timed out"}
+        except httpx.HTTPError as e:
+            return {**result, "status": "error", "status_code": 400, "message": f"Request error: {str(e)}"}
+
+        if response.status_code == 304:
+            return {**result, "status": "not_modified", "status_code": 304, "links": entry.get("links", [])}
+        if response.status_code >= 400:
+            return {**result, "status": "error", "status_code": response.status_code, "message": response.reason_phrase}
+
+        content_type = response.headers.get("Content-Type", "")
+        if self.use_jina or "markdown" in content_type or "text/plain" in content_type:
+            content = response.text
+            title = content.split("\n", 1)[0].removeprefix("Title:").strip()
+            links = _MARKDOWN_LINK.findall(content)
+        elif "html" in content_type:
+            parser = _PageParser()
+            parser.feed(response.text)
+            title = parser.title.strip()
+            links = [urljoin(str(response.url), href) for href in parser.links]
+            content = html_to_markdown(response.text)
+        else:
+            return {**result, "status": "skipped", "status_code": response.status_code, "message": content_type}
+
+        links = list(dict.fromkeys(self._normalize(link) for link in links))
+        content_hash = hashlib.sha256(content.encode()).hexdigest()
+        page_state = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_hash": content_hash,
+            "links": links,
+        }
+        if entry.get("content_hash") == content_hash:
+            # 内容未变化，之前的分块仍然有效，可以直接更新记录
+            if self.state:
+                self.state.update(url, **page_state)
+            status = "not_modified"
+        else:
+            # 新的或变化的页面由调用方嵌入后再 `CrawlState.commit`
+            status = "success"
+        return {
+            **result,
+            "status": status,
+            "status_code": response.status_code,
+            "title": title or url,
+            "content": content,
+            "links": links,
+            "state": page_state,
+        }
+
+    async def crawl(self, start_urls: Iterable[str]) -> AsyncIterator[Dict]:
+        """
+        抓取起始 URL 及其链接的页面，按完成顺序产出结果
+
+        结果的 `status` 为 "success"（新的或变化的页面，带 `content` 与 `title`）、
+        "not_modified"、"skipped"（非网页内容）或 "error"（带 `message`）。
+        "success" 的结果带有 `state`，页面嵌入完成后交给 `CrawlState.commit` 记录。
+        """
+        start_urls = [self._normalize(url) for url in start_urls]
+        prefixes = [self._scope_prefix(url) for url in start_urls]
+        seen = set()
+        pending: asyncio.Queue = asyncio.Queue()
+        results: asyncio.Queue = asyncio.Queue()
+
+        def enqueue(url: str, depth: int) -> None:
+            url = self._normalize(url)
+            if url in seen or len(seen) >= self.max_pages:
+                return
+            seen.add(url)
+            pending.put_nowait((url, depth))
+
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(
+            limits=limits,
+            timeout=self.timeout,
+            follow_redirects=True,
+            headers={"User-Agent": self._ua.random},
+        ) as client:
+            for url in start_urls:
+                enqueue(url, 0)
+            if self.use_sitemap:
+                for start_url in start_urls:
+                    # sitemap 中的页面已经是完整列表，不再跟随它们的链接
+                    for url in await self._sitemap_urls(client, start_url, self.max_pages):
+                        if self._in_scope(url, prefixes):
+                            enqueue(url, self.max_depth)
+
+            async def worker():
+                while True:
+                    url, depth = await pending.get()
+                    try:
+                        result = await self._fetch(client, url, depth)
+                        if depth < self.max_depth:
+                            for link in result["links"]:
+                                if self._in_scope(link, prefixes):
+                                    enqueue(link, depth + 1)
+                        await results.put(result)
+                    except Exception as e:
+                        await results.put({"url": url, "depth": depth, "status": "error", "status_code": 500, "message": f"Unknown error: {str(e)}"})
+                    finally:
+                        pending.task_done()
+
+            async def close_when_done():
+                await pending.join()
+                await results.put(None)
+
+            tasks = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+            tasks.append(asyncio.create_task(close_when_done()))
+            start_time = time.perf_counter()
+            fetched = 0
+            try:
+                while True:
+                    result = await results.get()
+                    if result is None:
+                        break
+                    fetched += 1
+                    yield result
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if self.state:
+                    self.state.save()
+            logger.info(f"Crawled {fetched} pages in {time.perf_counter() - start_time:.1f}s")
+
+    def iter_crawl(self, start_urls: Iterable[str]) -> Iterator[Dict]:
+        """
+        同步迭代 `crawl` 的结果，抓取在后台线程的事件循环中进行
+
+        用于 Streamlit 等同步代码：每得到一个页面就可以分块、嵌入并更新进度。
+        调用方提前停止迭代（break、异常或生成器被回收）时，后台的抓取会被取消，
+        连接池随之关闭，尚未 `commit` 的页面不会被记录。
+        """
+        results: "queue.Queue" = queue.Queue(maxsize=self.concurrency * 2)
+        done = object()
+        stop = Event()
+        running: Dict[str, Any] = {}
+
+        async def _put(result: Dict) -> bool:
+            # 不阻塞事件循环，调用方停止后不再等待队列空间
+            while not stop.is_set():
+                try:
+                    results.put_nowait(result)
+                    return True
+                except queue.Full:
+                    await asyncio.sleep(0.05)
+            return False
+
+        async def _consume():
+            running["loop"] = asyncio.get_running_loop()
+            running["task"] = asyncio.current_task()
+            if stop.is_set():
+                return
+            crawl = self.crawl(start_urls)
+            try:
+                async for result in crawl:
+                    if not await _put(result):
+                        break
+            finally:
+                await crawl.aclose()
+
+        def _run():
+            try:
+                asyncio.run(_consume())
+            except asyncio.CancelledError:
+                logger.info("Crawler cancelled")
+            except Exception as e:
+                logger.error(f"Crawler stopped: {e}")
+            finally:
+                while not stop.is_set():
+                    try:
+                        results.put(done, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+
+        Thread(target=_run, daemon=True, name="url-crawler").start()
+        try:
+            while True:
+                result = results.get()
+                if result is done:
+                    return
+                yield result
+        finally:
+            stop.set()
+            if "task" in running:
+                try:
+                    running["loop"].call_soon_threadsafe(running["task"].cancel)
+                except RuntimeError:
+                    # 事件循环已经结束
+                    pass
@@ -2,6 +2,7 @@ import requests
 from bs4 import BeautifulSoup
 from typing import List, Optional, Literal
 from fake_useragent import UserAgent
+from urllib.parse import urlparse
 import time
 import random
 
@@ -13,6 +14,9 @@ class UrlScraper:
         self.ua = UserAgent()
         self.min_delay = 1
         self.max_delay = 5
+        # 复用连接，并记录每个主机上次请求的时间
+        self.session = requests.Session()
+        self._last_request = {}
 
     def manage_tags(
         self, action: Literal["add", "remove", "set"], tags: Optional[List[str]] = None
@@ -39,16 +43,22 @@ class UrlScraper:
             "Upgrade-Insecure-Requests": "1",
         }
 
-    def random_delay(self):
-        delay = random.uniform(self.min_delay, self.max_delay)
-        time.sleep(delay)
+    def random_delay(self, url: str):
+        """只在同一主机的两次请求之间等待，首次访问某个主机时不等待"""
+        host = urlparse(url).netloc
+        last_request = self._last_request.get(host)
+        if last_request is not None:
+            delay = random.uniform(self.min_delay, self.max_delay) - (time.monotonic() - last_request)
+            if delay > 0:
+                time.sleep(delay)
+        self._last_request[host] = time.monotonic()
 
     def scrape(self, url: str) -> dict:
         try:
-            self.random_delay()
+            self.random_delay(url)
 
             headers = self.get_headers()
-            response = requests.get(url, headers=headers, timeout=self.timeout)
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
             response.raise_for_status()
 
             soup = BeautifulSoup(response.text, "html.parser")
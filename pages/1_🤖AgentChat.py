@@ -324,13 +324,21 @@ if not st.session_state.get('authentication_status'):
 
 if not os.path.exists(CHAT_HISTORY_DIR):
     os.makedirs(CHAT_HISTORY_DIR)
-chat_history_storage = SqlAssistantStorage(
-    table_name=AGENT_CHAT_HISTORY_DB_TABLE,
-    db_file=CHAT_HISTORY_DB_FILE,
-)
-if not chat_history_storage.table_exists():
-    chat_history_storage.create()
-dialog_processor = AgenChatDialogProcessor(storage=chat_history_storage)
+
+
+@st.cache_resource
+def get_dialog_processor() -> AgenChatDialogProcessor:
+    """进程内共享的对话处理器，脚本重新运行时复用同一个写缓冲与处理线程"""
+    chat_history_storage = SqlAssistantStorage(
+        table_name=AGENT_CHAT_HISTORY_DB_TABLE,
+        db_file=CHAT_HISTORY_DB_FILE,
+    )
+    if not chat_history_storage.table_exists():
+        chat_history_storage.create()
+    return AgenChatDialogProcessor(storage=chat_history_storage)
+
+
+dialog_processor = get_dialog_processor()
 oailike_config_processor = OAILikeConfigProcessor()
 team_template_manager = AgentTemplateFileManager(user_id=st.session_state['email'])
 
@@ -340,10 +348,10 @@ i18n = I18nAuto(
     language=SUPPORTED_LANGUAGES[language]
 )
 
-run_id_list = [run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])]
+run_id_list = [run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])]
 if len(run_id_list) == 0:
     create_default_dialog(dialog_processor, priority="normal", user_id=st.session_state['email'])
-    run_id_list = [run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])]
+    run_id_list = [run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])]
 
 if "agent_chat_current_run_id_index" not in st.session_state:
     st.session_state.agent_chat_current_run_id_index = 0
@@ -408,7 +416,11 @@ with st.sidebar:
 
             def saved_dialog_change_callback():
                 try:
-                    selected_run = st.session_state.agent_chat_saved_dialog
+                    # 对话列表只包含摘要信息，切换时再加载完整对话
+                    selected_run = dialog_processor.get_dialog(
+                        run_id=st.session_state.agent_chat_saved_dialog.run_id,
+                        user_id=st.session_state['email']
+                    )
                     current_run_state = AgentChatState(
                         current_run_id=st.session_state.agent_chat_run_id,
                         user_id=st.session_state['email'],
@@ -433,7 +445,7 @@ with st.sidebar:
                     # 加载新对话状态    
                     st.session_state.agent_chat_run_id = selected_run.run_id
                     st.session_state.agent_chat_current_run_id_index = [
-                        run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])
+                        run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])
                     ].index(st.session_state.agent_chat_run_id)
                     st.session_state.agent_chat_team_template_index = get_team_template_index()
                     st.session_state.agent_chat_team_template = selected_run.assistant_data["template"]
@@ -448,7 +460,7 @@ with st.sidebar:
 
             saved_dialog = dialogs_container.radio(
                 label=i18n("Saved dialog"),
-                options=dialog_processor.get_all_dialogs(user_id=st.session_state['email']),
+                options=dialog_processor.list_dialogs(user_id=st.session_state['email']),
                 format_func=lambda x: (
                     x.run_name[:15] + "..." if len(x.run_name) > 15 else x.run_name
                 ),
@@ -497,12 +509,12 @@ with st.sidebar:
                         run_id=st.session_state.agent_chat_run_id,
                         user_id=st.session_state['email']
                     )
-                    if len(dialog_processor.get_all_dialogs(user_id=st.session_state['email'])) == 0:
+                    if len(dialog_processor.list_dialogs(user_id=st.session_state['email'])) == 0:
                         st.session_state.agent_chat_run_id = create_default_dialog(dialog_processor, priority="high", user_id=st.session_state['email'])
                     else:
-                        while st.session_state.agent_chat_current_run_id_index >= len(dialog_processor.get_all_dialogs(user_id=st.session_state['email'])):
+                        while st.session_state.agent_chat_current_run_id_index >= len(dialog_processor.list_dialogs(user_id=st.session_state['email'])):
                             st.session_state.agent_chat_current_run_id_index -= 1
-                        st.session_state.agent_chat_run_id = dialog_processor.get_all_dialogs(user_id=st.session_state['email'])[
+                        st.session_state.agent_chat_run_id = dialog_processor.list_dialogs(user_id=st.session_state['email'])[
                             st.session_state.agent_chat_current_run_id_index
                         ].run_id
                     current_run = dialog_processor.get_dialog(
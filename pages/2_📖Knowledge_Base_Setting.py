@@ -23,6 +23,7 @@ from utils.chroma_utils import get_chroma_file_info
 from utils.text_splitter.text_splitter_utils import (
     text_split_execute,
     url_text_split_execute,
+    split_web_page,
     _SUPPORTED_FILE_TYPES,
 )
 from utils.basic_utils import datetime_serializer
@@ -40,6 +41,9 @@ from loguru import logger
 
 from utils.log.logger_config import setup_logger
 
+# 网站抓取时每攒够多少个分块嵌入一次
+CRAWL_EMBED_BATCH_SIZE = 256
+
 # 全局变量声明
 global chroma_vectorstore_processor, chroma_collection_processor
 chroma_vectorstore_processor = None
@@ -554,6 +558,103 @@ with st.container(border=True):
                     with st.expander(label=i18n("Content Preview"), expanded=False):
                         st.write(st.session_state.url_scrape_result["content"])
 
+                with st.expander(label=i18n("Crawl Website"), expanded=False):
+                    crawl_depth_column, crawl_pages_column = st.columns(2)
+                    with crawl_depth_column:
+                        crawl_depth = st.number_input(
+                            label=i18n("Link Depth"),
+                            min_value=0,
+                            max_value=5,
+                            value=2,
+                            step=1,
+                            help=i18n("How many levels of links under the URL to follow. Pages listed in the sitemap are always included."),
+                        )
+                    with crawl_pages_column:
+                        crawl_max_pages = st.number_input(
+                            label=i18n("Max Pages"),
+                            min_value=1,
+                            max_value=5000,
+                            value=200,
+                            step=1,
+                        )
+                    crawl_use_jina = st.checkbox(
+                        label=i18n("Parse pages with Jina Reader"),
+                        value=False,
+                    )
+                    crawl_button = st.button(
+                        label=i18n("Crawl and Embed"),
+                        use_container_width=True,
+                        help=i18n("Pages are chunked and embedded as they are fetched. Unchanged pages are skipped when a site is crawled again."),
+                    )
+
+                if crawl_button:
+                    if url_input:
+                        from modules.scraper.crawler import AsyncUrlCrawler, CrawlState
+
+                        crawl_state = CrawlState.for_collection(chroma_collection_processor.collection_id)
+                        crawler = AsyncUrlCrawler(
+                            max_pages=crawl_max_pages,
+                            max_depth=crawl_depth,
+                            use_jina=crawl_use_jina,
+                            state=crawl_state,
+                        )
+                        embedding_model_config = chroma_collection_processor.embedding_model_config
+                        split_chunk_size = chroma_collection_processor.get_embedding_model_max_seq_len()
+                        progress_bar = st.progress(0.0)
+                        pending_docs = []
+                        # 新的或内容有变化的页面，嵌入前先删除它们之前的分块，嵌入成功后才记录抓取状态
+                        pending_pages = []
+
+                        def embed_pending_pages():
+                            chroma_collection_processor.delete_documents_by_url([page["url"] for page in pending_pages])
+                            if pending_docs:
+                                chroma_collection_processor.add_documents(documents=pending_docs)
+                            crawl_state.commit(pending_pages)
+                            pending_docs.clear()
+                            pending_pages.clear()
+
+                        counts = {"success": 0, "not_modified": 0, "skipped": 0, "error": 0}
+                        try:
+                            for index, result in enumerate(crawler.iter_crawl([url_input]), start=1):
+                                counts[result["status"]] += 1
+                                progress_bar.progress(
+                                    min(index / crawl_max_pages, 1.0),
+                                    text=f"{index} · {result['url']}",
+                                )
+                                if result["status"] == "error":
+                                    logger.warning(f"Failed to crawl {result['url']}: {result['message']}")
+                                if result["status"] != "success":
+                                    continue
+                                pending_pages.append(result)
+                                if result["content"].strip():
+                                    pending_docs.extend(
+                                        split_web_page(
+                                            result["content"],
+                                            result["title"],
+                                            url=result["url"],
+                                            split_chunk_size=split_chunk_size,
+                                            embedding_type=embedding_model_config.embedding_type,
+                                            embedding_model_name_or_path=embedding_model_config.embedding_model_name_or_path,
+                                        )
+                                    )
+                                # 攒够一批分块就嵌入，不必等整个站点抓取完成
+                                if len(pending_docs) >= CRAWL_EMBED_BATCH_SIZE:
+                                    embed_pending_pages()
+                            if pending_pages:
+                                embed_pending_pages()
+                            progress_bar.progress(1.0)
+                            st.session_state.document_counter += 1
+                            st.toast(i18n("Crawl completed!"), icon="✅")
+                            st.caption(
+                                i18n("Embedded pages") + f": {counts['success']}  ·  "
+                                + i18n("Unchanged pages") + f": {counts['not_modified']}  ·  "
+                                + i18n("Failed pages") + f": {counts['error']}"
+                            )
+                        except Exception as e:
+                            st.error(f"Error crawling website: {str(e)}")
+                    else:
+                        st.toast(i18n("Please enter a URL."), icon="🚨")
+
             def clear_file_callback():
                 st.session_state["file_uploader_key"] += 1
                 st.session_state.url_input = ""
@@ -572,8 +673,10 @@ with st.container(border=True):
                     label=i18n("Chunk Size"),
                     value=chroma_collection_processor.get_embedding_model_max_seq_len(),
                     step=1,
+                    help=i18n("Chunk size and overlap are measured in tokens of the embedding model."),
                 )
                 split_overlap = st.number_input(label=i18n("Overlap"), value=0, step=1)
+                embedding_model_config = chroma_collection_processor.embedding_model_config
 
             upload_and_split = st.button(
                 label=i18n("Upload and Split Files"), 
@@ -591,6 +694,8 @@ with st.container(border=True):
                             file=file,
                             split_chunk_size=split_chunk_size,
                             split_overlap=split_overlap,
+                            embedding_type=embedding_model_config.embedding_type,
+                            embedding_model_name_or_path=embedding_model_config.embedding_model_name_or_path,
                         )
                         st.session_state.pages.extend(splitted_docs)
                         st.toast(i18n("Files chunked successfully! Please continue to embed at the next step."), icon="✅")
@@ -603,6 +708,8 @@ with st.container(border=True):
                         url_content=st.session_state.url_scrape_result,
                         split_chunk_size=split_chunk_size,
                         split_overlap=split_overlap,
+                        embedding_type=embedding_model_config.embedding_type,
+                        embedding_model_name_or_path=embedding_model_config.embedding_model_name_or_path,
                     )
                     st.session_state.pages.extend(splitted_docs)
                     st.toast(i18n("URL content parsed successfully! Please continue to embed at the next step."), icon="✅")
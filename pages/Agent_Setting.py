@@ -20,7 +20,7 @@ from utils.basic_utils import (
     model_selector, 
     oai_model_config_selector
 )
-from utils.log.logger_config import setup_logger
+from utils.log.logger_config import setup_logger, redact_secrets
 from utils.user_login_utils import(
     load_and_create_authenticator,
 )
@@ -162,7 +162,7 @@ def create_agent_team_form(
             "llm": get_client_config_model(st.session_state[f"llm_config_list_{form_key}"][0]),
             "template_type": st.session_state.agent_team_type.lower(),
         }
-        logger.debug(f"template_config: {template_config}")
+        logger.opt(lazy=True).debug("template_config: {}", lambda: redact_secrets(template_config))
         
         if selected_team_type == AgentTemplateType.REFLECTION.value:
             template_config.update({
@@ -2,7 +2,7 @@ import os
 import base64
 import asyncio
 from datetime import datetime
-from typing import Optional, List, Dict, Union, Literal, Tuple
+from typing import Optional, List, Dict, Union, Literal, Tuple, Sequence, Callable
 from uuid import uuid4
 from copy import deepcopy
 from io import BytesIO
@@ -31,17 +31,22 @@ from core.models.app import (
     SerializationMode,
 )
 from core.storage.db.sqlite.assistant import SqlAssistantStorage
+from core.storage.blob import get_blob_store, resolve_messages_images
 from modules.chat.transform import (
-    MessageHistoryTransform, 
-    ReasoningContentTagProcessor
+    TokenBudgetTransform,
+    TokenCounter,
+    ReasoningContentTagProcessor,
+    get_token_counter,
 )
-from modules.chat.wrapper import stream_with_reasoning_content_wrapper
+from modules.chat.memory import ConversationSummaryMemory, conversation_memory
+from modules.chat.wrapper import StreamAccumulator, stream_with_reasoning_content_wrapper
 from utils.basic_utils import (
     model_selector,
     oai_model_config_selector,
     config_list_postprocess,
     user_input_constructor,
     generate_new_run_name_with_llm_for_the_first_time,
+    create_conversation_summarizer,
 )
 from utils.log.logger_config import (
     setup_logger,
@@ -68,6 +73,7 @@ from config.constants import (
     I18N_DIR,
     LOGO_DIR,
     DEFAULT_DIALOG_TITLE,
+    DEFAULT_HISTORY_TOKEN_BUDGET,
     DEFAULT_SYSTEM_PROMPT,
     ANSWER_USER_WITH_TOOLS_SYSTEM_PROMPT,
     SUMMARY_PROMPT,
@@ -196,13 +202,21 @@ oailike_config_processor = OAILikeConfigProcessor()
 
 if not os.path.exists(CHAT_HISTORY_DIR):
     os.makedirs(CHAT_HISTORY_DIR)
-chat_history_storage = SqlAssistantStorage(
-    table_name=CHAT_HISTORY_DB_TABLE,
-    db_file=CHAT_HISTORY_DB_FILE,
-)
-dialog_processor = ClassicChatDialogProcessor(storage=chat_history_storage)
-if not chat_history_storage.table_exists():
-    chat_history_storage.create()
+
+
+@st.cache_resource
+def get_dialog_processor() -> ClassicChatDialogProcessor:
+    """进程内共享的对话处理器，脚本重新运行时复用同一个写缓冲与处理线程"""
+    chat_history_storage = SqlAssistantStorage(
+        table_name=CHAT_HISTORY_DB_TABLE,
+        db_file=CHAT_HISTORY_DB_FILE,
+    )
+    if not chat_history_storage.table_exists():
+        chat_history_storage.create()
+    return ClassicChatDialogProcessor(storage=chat_history_storage)
+
+
+dialog_processor = get_dialog_processor()
 
 
 logo_path = os.path.join(LOGO_DIR, "RAGENT_logo.png")
@@ -254,10 +268,10 @@ if not st.session_state.get('authentication_status'):
 
 # 初始化session state时添加错误处理
 try:
-    run_id_list = [run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])]
+    run_id_list = [run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])]
     if len(run_id_list) == 0:
         create_default_dialog(dialog_processor, priority="normal")
-        run_id_list = [run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])]
+        run_id_list = [run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])]
 except Exception as e:
     logger.error(f"Error initializing dialogs: {e}")
     keep_login_or_logout_and_redirect_to_login_page(
@@ -279,18 +293,20 @@ if "chat_config_list" not in st.session_state:
     st.session_state.chat_config_list = [
         dialog_processor.get_dialog(
             run_id=st.session_state.run_id, 
-            user_id=st.session_state['email']
+            user_id=st.session_state['email'],
+            with_chat_history=False
         ).llm
     ]
-# initialize chat history
-if "chat_history" not in st.session_state:
-    db_chat_history = dialog_processor.get_dialog(
+if "history_token_budget" not in st.session_state:
+    st.session_state.history_token_budget = dialog_processor.get_history_token_budget(
         run_id=st.session_state.run_id,
         user_id=st.session_state['email']
-    ).memory["chat_history"]
-    
-    # Convert dict messages to message objects
-    st.session_state.chat_history = transform_chat_history(db_chat_history)
+    ) or DEFAULT_HISTORY_TOKEN_BUDGET
+# 对话历史按需分页加载，只读取渲染窗口与发送给模型的最近消息
+chat_history = dialog_processor.get_lazy_chat_history(
+    run_id=st.session_state.run_id,
+    user_id=st.session_state['email']
+)
 
 # 中断回复生成
 if "if_interrupt_reply_generating" not in st.session_state:
@@ -431,13 +447,13 @@ def create_user_message(prompt: str, images: Optional[Union[List[BytesIO], Bytes
         updated_at=datetime.now()
     )
     if images:
-        # 将BytesIO对象转换为base64编码的字符串
-        if isinstance(images, list):
-            image_base64_list = [f"data:image/jpeg;base64,{base64.b64encode(image.getvalue()).decode('utf-8')}" for image in images]
-            basic_user_message.content.extend([ImageContent(type="image_url", image_url=image_base64) for image_base64 in image_base64_list])
-        else:
-            image_base64 = f"data:image/jpeg;base64,{base64.b64encode(images.getvalue()).decode('utf-8')}"
-            basic_user_message.content.append(ImageContent(type="image_url", image_url=image_base64))
+        # 将图片保存到 blob 存储，消息中只保留引用
+        if not isinstance(images, list):
+            images = [images]
+        blob_store = get_blob_store()
+        basic_user_message.content.extend(
+            [ImageContent(type="image_url", image_url=blob_store.put(image.getvalue(), "image/jpeg")) for image in images]
+        )
     return basic_user_message
 
 # Add assistant message to chat history
@@ -488,11 +504,11 @@ def process_assistant_response(response: Dict, if_stream: bool = True) -> Tuple[
         else:
             # 处理流式响应
             try:
-                total_response = st.write_stream(stream_with_reasoning_content_wrapper(response))
-                if tag_processor.detect(total_response):
-                    reasoning_content, response_content = tag_processor.extract(total_response)
-                else:
-                    response_content = total_response
+                # 推理内容与回答在流式输出时已分开，结束后各拼接一次
+                accumulator = StreamAccumulator()
+                st.write_stream(stream_with_reasoning_content_wrapper(response, subscribers=[accumulator]))
+                reasoning_content = accumulator.reasoning_content
+                response_content = accumulator.content
             except Exception as e:
                 logger.error(f"Error in stream processing: {e}")
                 response_content = "Error processing stream response"
@@ -504,20 +520,100 @@ def process_assistant_response(response: Dict, if_stream: bool = True) -> Tuple[
         st.error(i18n("Failed to process assistant response"))
         return "", ""
 
-def prepare_messages(chat_history: List[MessageType], system_prompt: str, history_length: int) -> List[Dict]:
-    """准备发送给模型的消息列表"""
-    max_msg_transform = MessageHistoryTransform(max_size=history_length)
-    processed_messages = max_msg_transform.transform(deepcopy(chat_history))
-    
+def get_conversation_summary(chat_history_data: Sequence[Dict]) -> Optional[Dict]:
+    """获取当前对话有效的滚动摘要，进程内没有缓存时从数据库读取"""
+    run_id = st.session_state.run_id
+    user_id = st.session_state['email']
+
+    def _load():
+        dialog = dialog_processor.get_dialog(run_id=run_id, user_id=user_id, with_chat_history=False)
+        return (dialog.memory or {}).get("summary") if dialog else None
+
+    return conversation_memory.get_summary(run_id, chat_history_data, loader=_load)
+
+
+def get_history_token_counter() -> TokenCounter:
+    """当前模型共享的 token 计数器，计数缓存在多次重新运行之间保留"""
+    return get_token_counter(st.session_state.chat_config_list[0].get("model"))
+
+
+def create_history_transform(
+    history_length: int,
+    history_token_budget: Optional[int] = None,
+    summarizer: Optional[Callable] = None,
+) -> TokenBudgetTransform:
+    """发送给模型的历史消息窗口，同时受条数与 token 预算限制"""
+    return TokenBudgetTransform(
+        max_tokens=history_token_budget or DEFAULT_HISTORY_TOKEN_BUDGET,
+        model=st.session_state.chat_config_list[0].get("model"),
+        max_messages=history_length,
+        summarizer=summarizer,
+        token_counter=get_history_token_counter(),
+    )
+
+
+def refresh_conversation_summary(
+    chat_history_data: Sequence[Dict],
+    system_prompt: str,
+    history_length: int,
+    history_token_budget: Optional[int] = None,
+) -> None:
+    """在后台把发送给模型的窗口之前的消息合并进滚动摘要，并保存到 memory 中"""
+    run_id = st.session_state.run_id
+    user_id = st.session_state['email']
+    # 窗口与 `prepare_messages` 相同，只需要最近 history_length 条消息
+    offset = max(len(chat_history_data) - history_length, 0)
+    window_start = offset + create_history_transform(history_length, history_token_budget).window_start(
+        [{"role": "system", "content": system_prompt}, *chat_history_data[offset:]]
+    )
+    conversation_memory.refresh_async(
+        run_id,
+        chat_history_data,
+        summarize=create_conversation_summarizer(
+            model_type=st.session_state.model_type,
+            llm_config=st.session_state.chat_config_list[0],
+        ),
+        on_update=lambda summary: dialog_processor.update_memory_summary(
+            run_id=run_id, user_id=user_id, summary=summary
+        ),
+        window_start=window_start,
+    )
+
+
+def prepare_messages(
+    chat_history: List[MessageType],
+    system_prompt: str,
+    history_length: int,
+    history_token_budget: Optional[int] = None,
+    summary: Optional[Dict] = None,
+) -> List[Dict]:
+    """
+    准备发送给模型的消息列表，历史消息同时受条数与 token 预算限制
+
+    窗口之外的较早消息由滚动摘要 `summary` 代替（如果有）。
+    """
     system_message = SystemMessage(
         content=system_prompt,
         created_at=datetime.now(),
         updated_at=datetime.now()
     )
-    processed_messages.insert(0, system_message)
+
+    def summarizer(dropped: List[MessageType]) -> Optional[SystemMessage]:
+        summary_message = ConversationSummaryMemory.summary_message(summary)
+        if summary_message is None:
+            return None
+        return SystemMessage(
+            content=summary_message["content"],
+            created_at=datetime.now(),
+            updated_at=datetime.now()
+        )
+
+    history_transform = create_history_transform(history_length, history_token_budget, summarizer)
+    # 新消息在追加到对话历史前已经计算了 token 数，选出窗口后再复制
+    processed_messages = deepcopy(history_transform.transform([system_message, *chat_history]))
     
-    # 使用MODEL模式序列化消息
-    return [msg.to_dict(mode=SerializationMode.MODEL) for msg in processed_messages]
+    # 使用MODEL模式序列化消息，并将图片引用解析为 data URL
+    return resolve_messages_images([msg.to_dict(mode=SerializationMode.MODEL) for msg in processed_messages])
 
 def get_response_and_display_assistant_message(
     processed_messages: List[Dict],
@@ -555,19 +651,18 @@ def create_and_display_chat_round(
         # 显示用户消息
         display_user_message(prompt, image_uploader)
         
-        # 添加用户消息到历史记录
+        # 添加用户消息到历史记录，只追加新消息
         user_message = create_user_message(prompt=prompt, images=image_uploader)
-        st.session_state.chat_history.append(user_message)
-        
-        # 更新数据库中的对话历史
-        chat_history_data = [msg.to_dict(mode=SerializationMode.MODEL) 
-                           for msg in st.session_state.chat_history]
-        
-        dialog_processor.update_chat_history(
+        # token 数随消息一起保存，之后读取历史时不必重新计算
+        get_history_token_counter().count_message(user_message)
+        dialog_processor.append_messages(
             run_id=st.session_state.run_id,
             user_id=st.session_state['email'],
-            chat_history=chat_history_data
+            messages=[user_message.to_dict(mode=SerializationMode.STORAGE)]
         )
+        # 只读取发送给模型的最近消息
+        recent_history = transform_chat_history(chat_history[max(len(chat_history) - history_length, 0):])
+        recent_history.append(user_message)
         
         # 显示助手响应
         with st.chat_message("assistant", avatar=ai_avatar):
@@ -597,9 +692,11 @@ def create_and_display_chat_round(
                     )
                     
                     processed_messages = prepare_messages(
-                        st.session_state.chat_history,
+                        recent_history,
                         system_prompt,
-                        history_length
+                        history_length,
+                        st.session_state.get("history_token_budget"),
+                        summary=get_conversation_summary(chat_history),
                     )
                     
                     # 创建聊天处理器
@@ -620,13 +717,24 @@ def create_and_display_chat_round(
                             content=response_content,
                             reasoning_content=reasoning_content
                         )
-                        st.session_state.chat_history.append(assistant_message)
+                        get_history_token_counter().count_message(assistant_message)
+                        recent_history.append(assistant_message)
                         
                         # 保存对话历史
-                        dialog_processor.update_chat_history(
+                        dialog_processor.append_messages(
                             run_id=st.session_state.run_id,
                             user_id=st.session_state['email'],
-                            chat_history=[msg.to_dict(mode=SerializationMode.STORAGE) for msg in st.session_state.chat_history]
+                            messages=[assistant_message.to_dict(mode=SerializationMode.STORAGE)]
+                        )
+                        # 后台更新滚动摘要，不阻塞本轮回复
+                        refresh_conversation_summary(
+                            dialog_processor.get_lazy_chat_history(
+                                run_id=st.session_state.run_id,
+                                user_id=st.session_state['email']
+                            ),
+                            system_prompt,
+                            history_length,
+                            st.session_state.get("history_token_budget"),
                         )
                     
             # 清空中断按钮
@@ -638,7 +746,7 @@ def create_and_display_chat_round(
                 # 为使用默认对话名称的对话生成一个内容摘要的新名称
                 try:
                     asyncio.run(generate_new_run_name_with_llm_for_the_first_time(
-                        chat_history=[msg.to_dict(mode=SerializationMode.MODEL) for msg in st.session_state.chat_history],
+                        chat_history=[msg.to_dict(mode=SerializationMode.MODEL) for msg in recent_history],
                         run_id=st.session_state.run_id,
                         user_id=st.session_state['email'],
                         dialog_processor=dialog_processor,
@@ -687,7 +795,8 @@ with st.sidebar:
                 return options.index(
                     dialog_processor.get_dialog(
                         run_id=st.session_state.run_id,
-                        user_id=st.session_state['email']
+                        user_id=st.session_state['email'],
+                        with_chat_history=False
                     ).assistant_data["model_type"]
                 )
             except:
@@ -1002,7 +1111,8 @@ with st.sidebar:
                 try:
                     return dialog_processor.get_dialog(
                         run_id=run_id,
-                        user_id=st.session_state['email']
+                        user_id=st.session_state['email'],
+                        with_chat_history=False
                     ).assistant_data[
                         "system_prompt"
                     ]
@@ -1026,7 +1136,12 @@ with st.sidebar:
                 # 暂时取消防抖，防止频繁切换对话时，出现卡顿
                 # if debounced_dialog_change():
                 try:
-                    selected_run = st.session_state.saved_dialog
+                    # 对话列表只包含摘要信息，切换时再加载完整对话
+                    selected_run = dialog_processor.get_dialog(
+                        run_id=st.session_state.saved_dialog.run_id,
+                        user_id=st.session_state['email'],
+                        with_chat_history=False
+                    )
                     current_chat_state = ClassicChatState(
                         user_id=st.session_state['email'],
                         config_list=st.session_state.chat_config_list,
@@ -1059,7 +1174,9 @@ with st.sidebar:
                     st.session_state.run_id = selected_run.run_id
                     st.session_state.current_run_id_index = run_id_list.index(st.session_state.run_id)
                     st.session_state.chat_config_list = [selected_run.llm] if selected_run.llm else []
-                    st.session_state.chat_history = transform_chat_history(selected_run.memory["chat_history"])
+                    st.session_state.history_token_budget = (
+                        (selected_run.run_data or {}).get("history_token_budget") or DEFAULT_HISTORY_TOKEN_BUDGET
+                    )
                     st.session_state.system_prompt = selected_run.assistant_data.get("system_prompt", "")
 
                     logger.info(f"Chat dialog changed, from {current_chat_state.current_run_id} to {selected_run.run_id}")
@@ -1070,7 +1187,7 @@ with st.sidebar:
 
             saved_dialog = dialogs_container.radio(
                 label=i18n("Saved dialog"),
-                options=dialog_processor.get_all_dialogs(user_id=st.session_state['email']),
+                options=dialog_processor.list_dialogs(user_id=st.session_state['email']),
                 format_func=lambda x: (
                     x.run_name[:15] + "..." if len(x.run_name) > 15 else x.run_name
                 ),
@@ -1090,9 +1207,9 @@ with st.sidebar:
                     st.session_state.run_id = new_chat_state.current_run_id
                     st.session_state.run_name = new_chat_state.run_name
                     st.session_state.system_prompt = new_chat_state.system_prompt
-                    st.session_state.chat_history = new_chat_state.chat_history
                     st.session_state.current_run_id_index = 0
                     st.session_state.chat_config_list = new_chat_state.config_list
+                    st.session_state.history_token_budget = DEFAULT_HISTORY_TOKEN_BUDGET
                     logger.info(
                         f"Add a new chat dialog, added dialog name: {st.session_state.run_name}, added dialog id: {st.session_state.run_id}"
                     )
@@ -1109,21 +1226,24 @@ with st.sidebar:
                         run_id=st.session_state.run_id,
                         user_id=st.session_state['email']
                     )
-                    if len(dialog_processor.get_all_dialogs(user_id=st.session_state['email'])) == 0:
+                    if len(dialog_processor.list_dialogs(user_id=st.session_state['email'])) == 0:
                         new_chat_state = create_default_dialog(dialog_processor, priority="high")
                         st.session_state.run_id = new_chat_state.current_run_id
                     else:
-                        while st.session_state.current_run_id_index >= len(dialog_processor.get_all_dialogs(user_id=st.session_state['email'])):
+                        while st.session_state.current_run_id_index >= len(dialog_processor.list_dialogs(user_id=st.session_state['email'])):
                             st.session_state.current_run_id_index -= 1
-                        st.session_state.run_id = dialog_processor.get_all_dialogs(user_id=st.session_state['email'])[
+                        st.session_state.run_id = dialog_processor.list_dialogs(user_id=st.session_state['email'])[
                             st.session_state.current_run_id_index
                         ].run_id
                     current_run = dialog_processor.get_dialog(
                         run_id=st.session_state.run_id,
-                        user_id=st.session_state['email']
+                        user_id=st.session_state['email'],
+                        with_chat_history=False
                     )
-                    st.session_state.chat_history = transform_chat_history(current_run.memory["chat_history"])
                     st.session_state.chat_config_list = [current_run.llm]
+                    st.session_state.history_token_budget = (
+                        (current_run.run_data or {}).get("history_token_budget") or DEFAULT_HISTORY_TOKEN_BUDGET
+                    )
                     logger.info(
                         f"Delete a chat dialog, deleted dialog name: {st.session_state.saved_dialog.run_name}, deleted dialog id: {st.session_state.run_id}"
                     )
@@ -1174,7 +1294,8 @@ with st.sidebar:
                 label=i18n("Dialog name"),
                 value=dialog_processor.get_dialog(
                     run_id=st.session_state.run_id,
-                    user_id=st.session_state['email']
+                    user_id=st.session_state['email'],
+                    with_chat_history=False
                 ).run_name,
                 key="run_name",
                 on_change=dialog_name_change_callback,
@@ -1185,7 +1306,8 @@ with st.sidebar:
                 height=300,
                 value=dialog_processor.get_dialog(
                     run_id=st.session_state.run_id,
-                    user_id=st.session_state['email']
+                    user_id=st.session_state['email'],
+                    with_chat_history=False
                 ).assistant_data.get("system_prompt", ""),
                 key="system_prompt",
                 on_change=system_prompt_change_callback,
@@ -1200,16 +1322,31 @@ with st.sidebar:
                 key="history_length",
             )
 
+            def history_token_budget_change_callback():
+                dialog_processor.update_history_token_budget(
+                    run_id=st.session_state.run_id,
+                    user_id=st.session_state['email'],
+                    history_token_budget=st.session_state.history_token_budget,
+                )
+
+            dialog_details_settings_popover.number_input(
+                label=i18n("History token budget"),
+                min_value=256,
+                step=1024,
+                help=i18n("The maximum number of tokens of the system prompt and history sent to the llm."),
+                key="history_token_budget",
+                on_change=history_token_budget_change_callback,
+            )
+
             delete_previous_round_button_col, clear_button_col = (
                 dialog_details_tab.columns(2)
             )
 
             def clear_chat_history_callback():
-                st.session_state.chat_history = []
-                dialog_processor.update_chat_history(
+                dialog_processor.truncate_chat_history(
                     run_id=st.session_state.run_id,
                     user_id=st.session_state['email'],
-                    chat_history=[],  # 空列表不需要转换
+                    length=0,
                 )
                 st.session_state.current_run_id_index = run_id_list.index(
                     st.session_state.run_id
@@ -1221,18 +1358,26 @@ with st.sidebar:
                 # 删除最后一轮对话
                 # 如果前一条是用户消息，后一条是助手消息，则两条都删除
                 # 如果后一条是用户消息，则只删除用户消息
+                # 回调在脚本重新运行之前执行，重新读取对话历史，只加载最后两条消息
+                history = dialog_processor.get_lazy_chat_history(
+                    run_id=st.session_state.run_id,
+                    user_id=st.session_state['email']
+                )
+                last_messages = history[-2:]
                 if (
-                    len(st.session_state.chat_history) >= 2
-                    and st.session_state.chat_history[-1].role == "assistant"
-                    and st.session_state.chat_history[-2].role == "user"
+                    len(last_messages) == 2
+                    and last_messages[-1]["role"] == "assistant"
+                    and last_messages[-2]["role"] == "user"
                 ):
-                    st.session_state.chat_history = st.session_state.chat_history[:-2]
-                elif len(st.session_state.chat_history) > 0:  # 确保至少有一条消息
-                    st.session_state.chat_history = st.session_state.chat_history[:-1]
-                dialog_processor.update_chat_history(
+                    length = len(history) - 2
+                elif len(last_messages) > 0:  # 确保至少有一条消息
+                    length = len(history) - 1
+                else:
+                    return
+                dialog_processor.truncate_chat_history(
                     run_id=st.session_state.run_id,
                     user_id=st.session_state['email'],
-                    chat_history=[msg.to_dict(mode=SerializationMode.MODEL) for msg in st.session_state.chat_history]
+                    length=length
                 )
                 logger.info(f"Dialog {st.session_state.run_id} chat history deleted")
 
@@ -1253,8 +1398,12 @@ with st.sidebar:
                 use_container_width=True,
             )
             if export_button:
+                # 导出时才加载完整的对话历史
                 export_dialog(
-                    chat_history=[msg.to_dict(mode=SerializationMode.EXPORT) for msg in st.session_state.chat_history],
+                    chat_history=[
+                        msg.to_dict(mode=SerializationMode.EXPORT)
+                        for msg in transform_chat_history(chat_history)
+                    ],
                     chat_name=st.session_state.run_name,
                     model_name=st.session_state.model,
                 )
@@ -1284,7 +1433,7 @@ st.title(st.session_state.run_name)
 st.html(get_style(style_type="USER_CHAT", st_version=st.__version__))
 st.html(get_style(style_type="ASSISTANT_CHAT", st_version=st.__version__))
 
-write_chat_history([msg.to_dict(mode=SerializationMode.STORAGE) for msg in st.session_state.chat_history])
+write_chat_history(chat_history)
 back_to_top(back_to_top_placeholder0, back_to_top_placeholder1)
 back_to_bottom(back_to_top_bottom_placeholder0, back_to_top_bottom_placeholder1)
 if st.session_state.model == None:
@@ -13,6 +13,7 @@ from config.constants import (
     I18N_DIR,
     SUPPORTED_LANGUAGES,
     DEFAULT_DIALOG_TITLE,
+    DEFAULT_HISTORY_TOKEN_BUDGET,
     LOGO_DIR,
     CHAT_HISTORY_DIR,
     CHAT_HISTORY_DB_FILE,
@@ -44,6 +45,7 @@ from utils.basic_utils import (
     dict_filter,
     config_list_postprocess,
     generate_new_run_name_with_llm_for_the_first_time,
+    create_conversation_summarizer,
 )
 from utils.log.logger_config import setup_logger, log_dict_changes
 from utils.st_utils import (
@@ -55,11 +57,17 @@ from utils.st_utils import (
     float_chat_input_with_audio_recorder,
     get_style,
     get_combined_style,
+    get_chat_history_window,
+    get_message_render_blocks,
+    render_message_blocks,
+    USER_AVATAR,
+    AI_AVATAR,
 )
 from utils.user_login_utils import load_and_create_authenticator
 
 from modules.types.rag import BaseRAGResponse
-from modules.chat.transform import MessageHistoryTransform
+from modules.chat.memory import conversation_memory
+from modules.chat.transform import TokenBudgetTransform, get_token_counter
 from assets.styles.css.components_css import CUSTOM_RADIO_STYLE
 
 import streamlit as st
@@ -130,19 +138,32 @@ def create_default_rag_dialog(
     return new_chat_state
 
 
-def save_rag_chat_history() -> None:
+def count_message_tokens(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Set `token_count` of the messages before they are saved,
+    so the token budget does not have to count them again when the history is read back.
+    """
+    token_counter = get_token_counter(st.session_state.rag_chat_config_list[0].get("model"))
+    for message in messages:
+        message["token_count"] = token_counter.count_message(message)
+    return messages
+
+
+def save_rag_chat_history(messages: List[Dict[str, Any]]) -> None:
     """
     Save chat history to database.
-    Always update the chat entirely, including chat history and sources.
+    Only the new messages are appended, and the sources of the dialog are updated.
     """
-    dialog_processor.update_chat_history(
+    count_message_tokens(messages)
+    dialog_processor.append_messages(
         run_id=st.session_state.rag_run_id,
         user_id=st.session_state['email'],
-        chat_history=st.session_state.custom_rag_chat_history,
-        task_data={"source_documents": st.session_state.custom_rag_sources},
-        assistant_data={
-            "model_type": st.session_state.model_type,
-        },
+        messages=messages,
+    )
+    dialog_processor.update_source_documents(
+        run_id=st.session_state.rag_run_id,
+        user_id=st.session_state['email'],
+        source_documents=st.session_state.custom_rag_sources,
     )
 
 
@@ -265,17 +286,15 @@ def display_rag_sources(
 
 # @st.cache_data
 def write_custom_rag_chat_history(chat_history, _sources) -> None:
-    # 将SVG编码为base64
-    user_avatar = f"data:image/svg+xml;base64,{base64.b64encode(USER_AVATAR_SVG.encode('utf-8')).decode('utf-8')}"
-    ai_avatar = f"data:image/svg+xml;base64,{base64.b64encode(AI_AVATAR_SVG.encode('utf-8')).decode('utf-8')}"
-
-    for message in chat_history:
+    # 只渲染最近的消息，更早的消息分页加载
+    start = get_chat_history_window(len(chat_history), window_key="custom_rag_chat_history")
+    for message in chat_history[start:]:
         with st.chat_message(
             message["role"],
-            avatar=user_avatar if message["role"] == "user" else ai_avatar,
+            avatar=USER_AVATAR if message["role"] == "user" else AI_AVATAR,
         ):
             st.html(f"<span class='rag-chat-{message['role']}'></span>")
-            st.markdown(message["content"])
+            render_message_blocks(get_message_render_blocks(message))
 
             if message["role"] == "assistant":
                 rag_sources = _sources[message["response_id"]]
@@ -312,16 +331,16 @@ def handle_response(response: Union[BaseRAGResponse, Dict[str, Any]], if_stream:
         response["response_id"] if isinstance(response, dict) else response.response_id
     )
 
-    st.session_state.custom_rag_chat_history.append(
-        {
-            "role": "assistant",
-            "content": answer,
-            "response_id": response_id,
-        }
-    )
-
     # 保存聊天记录
-    save_rag_chat_history()
+    save_rag_chat_history(
+        [
+            {
+                "role": "assistant",
+                "content": answer,
+                "response_id": response_id,
+            }
+        ]
+    )
 
     # 展示引用源
     response_sources = st.session_state.custom_rag_sources[response_id]
@@ -352,17 +371,25 @@ ai_avatar = f"data:image/svg+xml;base64,{base64.b64encode(AI_AVATAR_SVG.encode('
 
 if not os.path.exists(CHAT_HISTORY_DIR):
     os.makedirs(CHAT_HISTORY_DIR)
-chat_history_storage = SqlAssistantStorage(
-    table_name=RAG_CHAT_HISTORY_DB_TABLE,
-    db_file=CHAT_HISTORY_DB_FILE,
-)
-dialog_processor = RAGChatDialogProcessor(
-    storage=chat_history_storage,
-    logger=logger,
-)
-if not chat_history_storage.table_exists():
-    chat_history_storage.create()
-    logger.info("Created new RAG chat history table")
+
+
+@st.cache_resource
+def get_dialog_processor() -> RAGChatDialogProcessor:
+    """进程内共享的对话处理器，脚本重新运行时复用同一个写缓冲与处理线程"""
+    chat_history_storage = SqlAssistantStorage(
+        table_name=RAG_CHAT_HISTORY_DB_TABLE,
+        db_file=CHAT_HISTORY_DB_FILE,
+    )
+    if not chat_history_storage.table_exists():
+        chat_history_storage.create()
+        logger.info("Created new RAG chat history table")
+    return RAGChatDialogProcessor(
+        storage=chat_history_storage,
+        logger=logger,
+    )
+
+
+dialog_processor = get_dialog_processor()
 
 
 language = os.getenv("LANGUAGE", "简体中文")
@@ -405,7 +432,7 @@ if not st.session_state.get('authentication_status'):
 
 # 初始化对话列表
 try:
-    rag_run_id_list = [run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])]
+    rag_run_id_list = [run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])]
 except Exception as e:
     logger.error(f"Error getting all dialogs: {e}")
     keep_login_or_logout_and_redirect_to_login_page(
@@ -422,7 +449,7 @@ if len(rag_run_id_list) == 0:
         priority="normal"
     )
     # 重新获取对话列表
-    rag_run_id_list = [run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])]
+    rag_run_id_list = [run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])]
 
 # 初始化当前对话索引
 if "rag_current_run_id_index" not in st.session_state:
@@ -444,9 +471,15 @@ if "rag_chat_config_list" not in st.session_state:
     st.session_state.rag_chat_config_list = [
         dialog_processor.get_dialog(
             run_id=st.session_state.rag_run_id,
-            user_id=st.session_state['email']
+            user_id=st.session_state['email'],
+            with_chat_history=False
         ).llm
     ]
+if "rag_history_token_budget" not in st.session_state:
+    st.session_state.rag_history_token_budget = dialog_processor.get_history_token_budget(
+        run_id=st.session_state.rag_run_id,
+        user_id=st.session_state['email']
+    ) or DEFAULT_HISTORY_TOKEN_BUDGET
 if "knowledge_base_config" not in st.session_state:
     logger.info("Initializing knowledge base config")
     kb_config = dialog_processor.get_knowledge_base_config(
@@ -478,17 +511,17 @@ if "knowledge_base_config" not in st.session_state:
     st.session_state.hybrid_retrieve_weight = kb_config.get("hybrid_retrieve_weight", 0.5)
     logger.info(f"Initialized session state: {dict_filter(st.session_state, ['query_mode_toggle', 'selected_collection_file', 'is_rerank', 'is_hybrid_retrieve', 'hybrid_retrieve_weight'])}")
 
-# Initialize RAG chat history, to avoid error when reloading the page
-if "custom_rag_chat_history" not in st.session_state:
-    st.session_state.custom_rag_chat_history = dialog_processor.get_dialog(
-        run_id=st.session_state.rag_run_id,
-        user_id=st.session_state['email']
-    ).memory["chat_history"]
+# RAG 对话历史按需分页加载，只读取渲染窗口与发送给模型的最近消息
+rag_chat_history = dialog_processor.get_lazy_chat_history(
+    run_id=st.session_state.rag_run_id,
+    user_id=st.session_state['email']
+)
 if "custom_rag_sources" not in st.session_state:
     try:
         st.session_state.custom_rag_sources = dialog_processor.get_dialog(
             run_id=st.session_state.rag_run_id,
-            user_id=st.session_state['email']
+            user_id=st.session_state['email'],
+            with_chat_history=False
         ).task_data["source_documents"]
     except TypeError:
         # TypeError 意味着数据库中没有这个 run_id 的source_documents，因此初始化
@@ -639,16 +672,36 @@ def create_and_display_rag_chat_round(
         st.markdown(prompt)
         st.html(get_style(style_type="RAG_USER_CHAT", st_version=st.__version__))
 
-    # Add user message to chat history
-    st.session_state.custom_rag_chat_history.append({"role": "user", "content": prompt})
+    # 对消息的数量与 token 数进行限制，窗口之外的较早消息由滚动摘要代替
+    run_id = st.session_state.rag_run_id
+    user_id = st.session_state['email']
+
+    # Add user message to chat history, only the new message is written
+    user_message = {"role": "user", "content": prompt}
+    count_message_tokens([user_message])
+    dialog_processor.append_messages(run_id=run_id, user_id=user_id, messages=[user_message])
+    # 只读取发送给模型的最近消息
+    recent_history = rag_chat_history[max(len(rag_chat_history) - history_length, 0):]
+    recent_history.append(user_message)
+
+    def _load_summary():
+        dialog = dialog_processor.get_dialog(run_id=run_id, user_id=user_id, with_chat_history=False)
+        return (dialog.memory or {}).get("summary") if dialog else None
 
-    # 对消息的数量进行限制
-    max_msg_transfrom = MessageHistoryTransform(
-        max_size=history_length
+    summary = conversation_memory.get_summary(
+        run_id, rag_chat_history, loader=_load_summary
     )
-    processed_messages = max_msg_transfrom.transform(
-        deepcopy(st.session_state.custom_rag_chat_history)
+    history_transform = TokenBudgetTransform(
+        max_tokens=st.session_state.get("rag_history_token_budget") or DEFAULT_HISTORY_TOKEN_BUDGET,
+        model=st.session_state.rag_chat_config_list[0].get("model"),
+        max_messages=history_length,
     )
+    processed_messages = deepcopy(
+        history_transform.transform(recent_history)
+    )
+    if len(processed_messages) == len(rag_chat_history) + 1:
+        # 完整的对话历史都在窗口内
+        summary = None
     # 在 invoke 的 messages 中去除 response_id
     processed_messages = [
         dict_filter(item, ["role", "content"]) for item in processed_messages
@@ -681,6 +734,7 @@ def create_and_display_rag_chat_round(
                         hybrid_retriever_weight=hybrid_retrieve_weight,
                         stream=if_stream,
                         selected_file=selected_file,
+                        summary=summary["content"] if summary else None,
                     )
                 except Exception as e:
                     response = dict(error=str(e))
@@ -690,6 +744,23 @@ def create_and_display_rag_chat_round(
             st.html(get_style(style_type="RAG_ASSISTANT_CHAT", st_version=st.__version__))
             interrupt_button_placeholder.empty()
 
+    # 后台更新滚动摘要，不阻塞本轮回复，摘要覆盖到发送给模型的窗口之前
+    history = dialog_processor.get_lazy_chat_history(run_id=run_id, user_id=user_id)
+    offset = max(len(history) - history_length, 0)
+    window_start = offset + history_transform.window_start(history[offset:])
+    conversation_memory.refresh_async(
+        run_id,
+        history,
+        summarize=create_conversation_summarizer(
+            model_type=st.session_state.model_type,
+            llm_config=st.session_state.rag_chat_config_list[0],
+        ),
+        on_update=lambda summary: dialog_processor.update_memory_summary(
+            run_id=run_id, user_id=user_id, summary=summary
+        ),
+        window_start=window_start,
+    )
+
 
 # 在知识库设置发生变化时保存配置
 def update_knowledge_base_config():
@@ -872,7 +943,12 @@ with st.sidebar:
                 """对话切换回调函数"""
                 if debounced_dialog_change():
                     try:
-                        selected_run = st.session_state.rag_saved_dialog
+                        # 对话列表只包含摘要信息，切换时再加载完整对话
+                        selected_run = dialog_processor.get_dialog(
+                            run_id=st.session_state.rag_saved_dialog.run_id,
+                            user_id=st.session_state['email'],
+                            with_chat_history=False
+                        )
                         current_run_id = st.session_state.rag_run_id
                         
                         # 如果是同一个对话，不进行更新
@@ -882,18 +958,19 @@ with st.sidebar:
                         # 更新对话ID和索引
                         st.session_state.rag_run_id = selected_run.run_id
                         st.session_state.rag_current_run_id_index = [
-                            run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])
+                            run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])
                         ].index(st.session_state.rag_run_id)
                         
                         # 更新配置
                         st.session_state.rag_chat_config_list = [selected_run.llm] if selected_run.llm else []
+                        st.session_state.rag_history_token_budget = (
+                            (selected_run.run_data or {}).get("history_token_budget") or DEFAULT_HISTORY_TOKEN_BUDGET
+                        )
                         
-                        # 更新聊天历史和源文档
+                        # 更新源文档，聊天历史在脚本重新运行时按需加载
                         try:
-                            st.session_state.custom_rag_chat_history = selected_run.memory["chat_history"]
                             st.session_state.custom_rag_sources = selected_run.task_data["source_documents"]
                         except (TypeError, ValidationError):
-                            st.session_state.custom_rag_chat_history = []
                             st.session_state.custom_rag_sources = {}
                             
                         # 恢复知识库配置
@@ -907,7 +984,7 @@ with st.sidebar:
 
             saved_dialog = dialogs_container.radio(
                 label=i18n("Saved dialog"),
-                options=dialog_processor.get_all_dialogs(user_id=st.session_state['email']),
+                options=dialog_processor.list_dialogs(user_id=st.session_state['email']),
                 format_func=lambda x: (
                     x.run_name[:15] + "..." if len(x.run_name) > 15 else x.run_name
                 ),
@@ -929,7 +1006,7 @@ with st.sidebar:
                     st.session_state.rag_run_id = new_chat_state.current_run_id
                     st.session_state.rag_current_run_id_index = new_chat_state.current_run_index or 0
                     st.session_state.rag_chat_config_list = new_chat_state.config_list
-                    st.session_state.custom_rag_chat_history = new_chat_state.chat_history
+                    st.session_state.rag_history_token_budget = DEFAULT_HISTORY_TOKEN_BUDGET
                     st.session_state.custom_rag_sources = new_chat_state.source_documents
                     logger.info(
                         f"Add a new RAG dialog, added dialog name: {st.session_state.rag_run_name}, added dialog id: {st.session_state.rag_run_id}"
@@ -947,26 +1024,29 @@ with st.sidebar:
                         run_id=st.session_state.rag_run_id,
                         user_id=st.session_state['email']
                     )
-                    if len(dialog_processor.get_all_dialogs(user_id=st.session_state['email'])) == 0:
+                    if len(dialog_processor.list_dialogs(user_id=st.session_state['email'])) == 0:
                         new_chat_state = create_default_rag_dialog(
                             dialog_processor=dialog_processor,
                             priority="high"
                         )
                         st.session_state.rag_run_id = new_chat_state.current_run_id
                     else:
-                        while st.session_state.rag_current_run_id_index >= len(dialog_processor.get_all_dialogs(user_id=st.session_state['email'])):
+                        while st.session_state.rag_current_run_id_index >= len(dialog_processor.list_dialogs(user_id=st.session_state['email'])):
                             st.session_state.rag_current_run_id_index -= 1
                         st.session_state.rag_run_id = [
-                            run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])
+                            run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])
                         ][st.session_state.rag_current_run_id_index]
                     from time import sleep
                     sleep(0.1)
                     current_dialog = dialog_processor.get_dialog(
                         run_id=st.session_state.rag_run_id,
-                        user_id=st.session_state['email']
+                        user_id=st.session_state['email'],
+                        with_chat_history=False
                     )
                     st.session_state.rag_chat_config_list = [current_dialog.llm]
-                    st.session_state.custom_rag_chat_history = current_dialog.memory["chat_history"]
+                    st.session_state.rag_history_token_budget = (
+                        (current_dialog.run_data or {}).get("history_token_budget") or DEFAULT_HISTORY_TOKEN_BUDGET
+                    )
                     st.session_state.custom_rag_sources = current_dialog.task_data["source_documents"]
                     logger.info(
                         f"Delete a RAG dialog, deleted dialog name: {st.session_state.rag_run_name}, deleted dialog id: {st.session_state.rag_run_id}"
@@ -994,14 +1074,15 @@ with st.sidebar:
                         f"RAG dialog name changed from {origin_run_name} to {st.session_state.rag_run_name}.(run_id: {st.session_state.rag_run_id})"
                     )
                     st.session_state.rag_current_run_id_index = [
-                        run.run_id for run in dialog_processor.get_all_dialogs(user_id=st.session_state['email'])
+                        run.run_id for run in dialog_processor.list_dialogs(user_id=st.session_state['email'])
                     ].index(st.session_state.rag_run_id)
 
                 dialog_name = dialog_details_settings_popover.text_input(
                     label=i18n("Dialog name"),
                     value=dialog_processor.get_dialog(
                         run_id=st.session_state.rag_run_id,
-                        user_id=st.session_state['email']
+                        user_id=st.session_state['email'],
+                        with_chat_history=False
                     ).run_name,
                     key="rag_run_name",
                     on_change=rag_dialog_name_change_callback,
@@ -1023,6 +1104,22 @@ with st.sidebar:
                     key="history_length",
                 )
 
+                def rag_history_token_budget_change_callback():
+                    dialog_processor.update_history_token_budget(
+                        run_id=st.session_state.rag_run_id,
+                        user_id=st.session_state['email'],
+                        history_token_budget=st.session_state.rag_history_token_budget,
+                    )
+
+                dialog_details_settings_popover.number_input(
+                    label=i18n("History token budget"),
+                    min_value=256,
+                    step=1024,
+                    help=i18n("The maximum number of tokens of the system prompt and history sent to the llm."),
+                    key="rag_history_token_budget",
+                    on_change=rag_history_token_budget_change_callback,
+                )
+
     with rag_model_settings_tab:
         model_choosing_container = st.expander(
             label=i18n("Model Choosing"), expanded=True
@@ -1034,7 +1131,8 @@ with st.sidebar:
                 return options.index(
                     dialog_processor.get_dialog(
                         run_id=st.session_state.rag_run_id,
-                        user_id=st.session_state['email']
+                        user_id=st.session_state['email'],
+                        with_chat_history=False
                     ).assistant_data["model_type"]
                 )
             except:
@@ -1462,13 +1560,16 @@ with st.sidebar:
     delete_previous_round_button_col, clear_button_col = rag_dialog_details_tab.columns(2)
 
     def clear_chat_history_callback():
-        st.session_state.custom_rag_chat_history = []
         st.session_state.custom_rag_sources = {}
-        dialog_processor.update_chat_history(
+        dialog_processor.truncate_chat_history(
+            run_id=st.session_state.rag_run_id,
+            user_id=st.session_state['email'],
+            length=0,
+        )
+        dialog_processor.update_source_documents(
             run_id=st.session_state.rag_run_id,
             user_id=st.session_state['email'],
-            chat_history=st.session_state.custom_rag_chat_history,
-            task_data={"source_documents": st.session_state.custom_rag_sources},
+            source_documents=st.session_state.custom_rag_sources,
         )
         st.session_state.rag_current_run_id_index = rag_run_id_list.index(
             st.session_state.rag_run_id
@@ -1477,22 +1578,29 @@ with st.sidebar:
 
     def delete_previous_round_callback():
         # 删除最后一轮对话
+        # 回调在脚本重新运行之前执行，重新读取对话历史，只加载最后三条消息
+        history = dialog_processor.get_lazy_chat_history(
+            run_id=st.session_state.rag_run_id,
+            user_id=st.session_state['email']
+        )
+        last_messages = history[-3:]
         if (
-            len(st.session_state.custom_rag_chat_history) >= 2
-            and st.session_state.custom_rag_chat_history[-1]["role"] == "assistant"
-            and st.session_state.custom_rag_chat_history[-2]["role"] == "user"
+            len(last_messages) >= 2
+            and last_messages[-1]["role"] == "assistant"
+            and last_messages[-2]["role"] == "user"
         ):
-            st.session_state.custom_rag_chat_history = (
-                st.session_state.custom_rag_chat_history[:-2]
-            )
-        elif len(st.session_state.custom_rag_chat_history) > 0:
-            st.session_state.custom_rag_chat_history = (
-                st.session_state.custom_rag_chat_history[:-1]
-            )
+            remaining = last_messages[:-2]
+            length = len(history) - 2
+        elif len(last_messages) > 0:
+            remaining = last_messages[:-1]
+            length = len(history) - 1
+        else:
+            remaining = []
+            length = 0
 
         # 删除最后一轮对话对应的源文档
-        if st.session_state.custom_rag_chat_history:
-            last_message = st.session_state.custom_rag_chat_history[-1]
+        if length:
+            last_message = remaining[-1]
             if isinstance(last_message, dict) and "content" in last_message:
                 st.session_state.custom_rag_sources = {
                     key: value
@@ -1506,11 +1614,15 @@ with st.sidebar:
         else:
             logger.info("Chat history is empty, no need to delete source documents")
 
-        dialog_processor.update_chat_history(
+        dialog_processor.truncate_chat_history(
             run_id=st.session_state.rag_run_id,
             user_id=st.session_state['email'],
-            chat_history=st.session_state.custom_rag_chat_history,
-            task_data={"source_documents": st.session_state.custom_rag_sources},
+            length=length,
+        )
+        dialog_processor.update_source_documents(
+            run_id=st.session_state.rag_run_id,
+            user_id=st.session_state['email'],
+            source_documents=st.session_state.custom_rag_sources,
         )
 
     delete_previous_round_button = delete_previous_round_button_col.button(
@@ -1530,8 +1642,9 @@ with st.sidebar:
         use_container_width=True,
     )
     if export_button:
+        # 导出时才加载完整的对话历史
         export_dialog(
-            chat_history=st.session_state.custom_rag_chat_history,
+            chat_history=list(rag_chat_history),
             is_rag=True,
             chat_name=st.session_state.rag_run_name,
             model_name=st.session_state.model,
@@ -1559,7 +1672,7 @@ logger.info("Starting page rendering")
 # st.write(st.session_state.rag_chat_config_list)
 st.title(st.session_state.rag_run_name)
 write_custom_rag_chat_history(
-    st.session_state.custom_rag_chat_history, st.session_state.custom_rag_sources
+    rag_chat_history, st.session_state.custom_rag_sources
 )
 back_to_top(back_to_top_placeholder0, back_to_top_placeholder1)
 back_to_bottom(back_to_top_bottom_placeholder0, back_to_top_bottom_placeholder1)
@@ -1596,7 +1709,11 @@ if prompt and st.session_state.model and collection_selectbox:
         # 为使用默认对话名称的对话生成一个内容摘要的新名称
         try:
             asyncio.run(generate_new_run_name_with_llm_for_the_first_time(
-                chat_history=st.session_state.custom_rag_chat_history,
+                chat_history=dialog_processor.get_chat_history(
+                    run_id=st.session_state.rag_run_id,
+                    user_id=st.session_state['email'],
+                    limit=history_length,
+                ),
                 run_id=st.session_state.rag_run_id,
                 user_id=st.session_state['email'],
                 dialog_processor=dialog_processor,
@@ -1,14 +1,30 @@
 import subprocess
+import socket
 import time
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
+
+def wait_for_port(host: str, port: int, process: subprocess.Popen, timeout: float = 60.0) -> bool:
+    """等待进程开始监听端口，进程退出或超时时返回 False"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
 # 确保在当前目录下运行
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 
 try:
+    launched_at = time.perf_counter()
     # 启动test_server.py作为子进程
     # 这里放 server 的代码
     server_process = subprocess.Popen(
@@ -19,9 +35,7 @@ try:
         ]
     )
 
-    # 等待服务器启动
-    time.sleep(1)
-
+    # 前端不依赖服务器完成启动，两个进程同时启动
     # 启动test_front.py作为子进程
     # 这里放前端的代码，在 RAGENT 里是 Streamlit 的代码
     front_process = subprocess.Popen(
@@ -32,8 +46,15 @@ try:
         ]
     )
 
-    # 等待前端启动
-    time.sleep(1)
+    # 等待两个进程开始监听端口，代替固定的等待时间
+    for name, process, port in (
+        ("Server", server_process, int(os.getenv("SERVER_PORT", 8000))),
+        ("Front-end", front_process, int(os.getenv("FRONT_PORT", 5998))),
+    ):
+        if wait_for_port("127.0.0.1", port, process):
+            print(f"{name} is ready on port {port} after {time.perf_counter() - launched_at:.1f}s.")
+        else:
+            print(f"{name} did not start listening on port {port}.")
 
 
     # 此处可以添加代码以执行其他任务，例如打开浏览器等
@@ -0,0 +1,138 @@
+"""
+统计各入口启动时的导入耗时，并检查启动时间预算
+
+每个入口在新的解释器中用 `python -X importtime` 导入，报告总耗时与耗时最多的顶层包，
+同时检查启动时不应导入的重量级依赖（它们应通过 `utils.lazy_imports` 延迟加载）。
+
+    python startup_profile.py                 # 打印报告
+    python startup_profile.py --check         # 超出预算或导入了禁止的依赖时以非零状态退出
+    python startup_profile.py rag_chat -n 5   # 只统计指定入口，取 5 次中最快的一次
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Tuple
+
+
+class StartupTarget(NamedTuple):
+    modules: Tuple[str, ...]
+    # 导入耗时预算（毫秒），在较慢的机器上用 --scale 放宽
+    budget_ms: int
+    # 启动时不应被导入的顶层包
+    forbidden: Tuple[str, ...] = ()
+
+
+# 所有入口都不应在启动时加载的依赖
+_HEAVY = ("torch", "whisper", "sentence_transformers", "transformers", "networkx", "matplotlib", "unstructured")
+
+STARTUP_TARGETS: Dict[str, StartupTarget] = {
+    # FastAPI 服务
+    "server": StartupTarget(("server",), 3000, _HEAVY + ("autogen",)),
+    # 各页面在渲染之前导入的模块
+    "classic_chat": StartupTarget(
+        ("core.processors", "utils.st_utils", "utils.basic_utils", "modules.chat.memory", "modules.chat.wrapper"),
+        2500,
+        _HEAVY + ("chromadb", "autogen"),
+    ),
+    "rag_chat": StartupTarget(("core.processors.chat.rag", "utils.st_utils"), 5000, _HEAVY),
+    "knowledge_base": StartupTarget(
+        ("core.processors.vector.chroma.kb_processors", "utils.text_splitter.text_splitter_utils"),
+        5000,
+        _HEAVY,
+    ),
+}
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+_WALL_TIME_MARKER = "startup_profile_wall_ms="
+
+
+class ImportProfile(NamedTuple):
+    wall_ms: float
+    # 顶层包 -> 自身导入耗时之和（微秒）
+    packages: Dict[str, int]
+
+
+def profile_imports(modules: Tuple[str, ...]) -> ImportProfile:
+    """在新的解释器中导入模块，返回墙钟耗时与按顶层包汇总的导入耗时"""
+    code = (
+        "import time; _start = time.perf_counter()\n"
+        + "".join(f"import {module}\n" for module in modules)
+        + f"print('{_WALL_TIME_MARKER}%f' % ((time.perf_counter() - _start) * 1000))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        error = "\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:"))
+        raise RuntimeError(f"Importing {', '.join(modules)} failed:\n{error[-2000:]}")
+
+    wall_ms = next(
+        float(line[len(_WALL_TIME_MARKER):])
+        for line in result.stdout.splitlines()
+        if line.startswith(_WALL_TIME_MARKER)
+    )
+    packages: Dict[str, int] = defaultdict(int)
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            packages[match.group(4).split(".")[0]] += int(match.group(1))
+    return ImportProfile(wall_ms, dict(packages))
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="*", help=f"要统计的入口，默认全部：{', '.join(STARTUP_TARGETS)}")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="每个入口导入的次数，取最快的一次")
+    parser.add_argument("--top", type=int, default=10, help="列出耗时最多的顶层包数量")
+    parser.add_argument("--scale", type=float, default=float(os.getenv("STARTUP_BUDGET_SCALE", 1.0)), help="预算的放宽倍数")
+    parser.add_argument("--check", action="store_true", help="超出预算或导入了禁止的依赖时以非零状态退出")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.targets if name not in STARTUP_TARGETS]
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(unknown)}")
+
+    baseline = profile_imports(()).packages
+    failures = []
+    for name in args.targets or STARTUP_TARGETS:
+        target = STARTUP_TARGETS[name]
+        try:
+            profile = min(
+                (profile_imports(target.modules) for _ in range(max(args.repeat, 1))),
+                key=lambda p: p.wall_ms,
+            )
+        except RuntimeError as e:
+            print(f"{name:<16}{'':>8}      ERROR")
+            failures.append(f"{name}: {e}")
+            continue
+        # 解释器自身启动时导入的包不计入
+        packages = {pkg: us for pkg, us in profile.packages.items() if pkg not in baseline}
+        budget_ms = target.budget_ms * args.scale
+        forbidden = sorted(pkg for pkg in target.forbidden if pkg in packages)
+
+        status = "ok"
+        if profile.wall_ms > budget_ms:
+            status = "OVER BUDGET"
+            failures.append(f"{name}: {profile.wall_ms:.0f} ms > {budget_ms:.0f} ms")
+        if forbidden:
+            status = "FORBIDDEN IMPORTS"
+            failures.append(f"{name}: imports {', '.join(forbidden)}")
+
+        print(f"{name:<16}{profile.wall_ms:>8.0f} ms   budget {budget_ms:>6.0f} ms   {status}")
+        for pkg, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+            marker = "  (forbidden)" if pkg in forbidden else ""
+            print(f"    {pkg:<32}{us / 1000:>8.1f} ms{marker}")
+
+    if failures:
+        print("\n" + "\n".join(failures), file=sys.stderr)
+    return 1 if args.check and failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,17 @@
 from typing import Optional, Literal, List, Dict, Callable, Union
 from trafilatura import fetch_url, extract
-from utils.tool_utils import function_to_json
+from utils.tool_utils import ToolRegistry
 from utils.log.logger_config import setup_logger
 from loguru import logger
-import json
 import requests
 
 
+# 工具注册表，工具的参数模型与 schema 在导入时构建一次
+TOOL_REGISTRY = ToolRegistry()
+
+
 # Operator = Literal["+", "-", "*", "/"]
+@TOOL_REGISTRY.register
 def tool_calculator(expression:str) -> str:
     """
     A tool that calculates the result of a given mathematical expression, support basic operations of addition, subtraction, multiplication and division.The format for the expression is like "(3+5)*8/2".
@@ -90,6 +94,7 @@ def tool_calculator(expression:str) -> str:
 #     return extract(fetch_url(url),url=url,include_links=True)
 
 
+@TOOL_REGISTRY.register
 def tool_duckduckgo_search(
     query: str,
     region: str = "wt-wt",
@@ -142,6 +147,7 @@ def tool_duckduckgo_search(
         return f"Error: DuckDuckGo search failed with error: {str(e)}"
 
 
+@TOOL_REGISTRY.register
 def tool_jina_web_reader(
     url: str, 
     api_key: str = "",
@@ -205,26 +211,25 @@ def tool_jina_web_reader(
 
 
 # ************************************
-# Write all the tool functions above
+# Write all the tool functions above, decorated with @TOOL_REGISTRY.register
 # ************************************
 
 
-# 自动将所有整个py文件里的tool添加到to_tools字典中
+# 所有通过 TOOL_REGISTRY 注册的工具
 TO_TOOLS: Dict[str, Dict[str, Union[Callable, str]]] = {
-    tool.__name__: {
-        "name": tool.__name__,
-        "func": tool,
-        "description": tool.__doc__ if tool.__doc__ is not None else ""
+    tool.name: {
+        "name": tool.name,
+        "func": tool.func,
+        "description": tool.func.__doc__ if tool.func.__doc__ is not None else ""
     }
-    for tool in globals().values()
-    if callable(tool) and hasattr(tool, "__name__") and tool.__name__.startswith("tool_")
+    for tool in TOOL_REGISTRY
 }
 
-TOOLS_LIST = [json.loads(function_to_json(tool["func"])) for tool in TO_TOOLS.values()]
+TOOLS_LIST = TOOL_REGISTRY.schemas()
 
 TOOLS_MAP = {
-    tool["name"]: tool["func"]
-    for tool in TO_TOOLS.values()
+    tool.name: tool.func
+    for tool in TOOL_REGISTRY
 }
 
 
@@ -238,9 +243,9 @@ def filter_out_selected_tools_list(selected_tools: List[str]):
     筛选出所有被选中的工具
 
     :param selected_tools: 被选中的工具名称列表
-    :return: 从 TOOLS_LIST 中筛选出的工具列表
+    :return: 从 TOOL_REGISTRY 中筛选出的工具 schema 列表，结果按选择缓存
     """
-    return [tool for tool in TOOLS_LIST if tool['function']['name'] in selected_tools]
+    return TOOL_REGISTRY.schemas(selected_tools)
 
 
 def filter_out_selected_tools_dict(selected_tools: List[str]):
@@ -248,6 +253,6 @@ def filter_out_selected_tools_dict(selected_tools: List[str]):
     筛选出所有被选中的工具，获得一个工具名称到工具的映射
 
     :param selected_tools: 被选中的工具名称列表
-    :return: 从 TOOLS_MAP 中筛选出的工具列表
+    :return: 工具名称到 ToolSpec 的映射，调用前会校验并转换参数
     """
-    return {tool['function']['name']: TOOLS_MAP[tool['function']['name']] for tool in TOOLS_LIST if tool['function']['name'] in selected_tools}
\ No newline at end of file
+    return TOOL_REGISTRY.function_map(selected_tools)
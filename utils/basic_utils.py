@@ -13,6 +13,7 @@ from core.llm._client_info import (
 from core.llm.ollama.completion import get_ollama_model_list
 from core.llm.groq.completion import get_groq_models
 from core.basic_config import I18nAuto
+from core.storage.blob import get_blob_store
 from core.processors import (
     OAILikeConfigProcessor,
     ChatProcessor,
@@ -22,6 +23,7 @@ from config.constants import (
     I18N_DIR, 
     SUPPORTED_LANGUAGES,
     SUMMARY_PROMPT,
+    CONVERSATION_SUMMARY_PROMPT,
 )
 from utils.log.logger_config import setup_logger
 
@@ -139,6 +141,29 @@ async def generate_new_run_name_with_llm_for_the_first_time(
     st.rerun()
 
 
+def create_conversation_summarizer(
+    model_type: str,
+    llm_config: Dict,
+    summary_prompt: str = CONVERSATION_SUMMARY_PROMPT,
+):
+    """创建用于 `ConversationSummaryMemory` 的摘要函数，使用当前对话的模型更新滚动摘要"""
+    from modules.chat.memory import format_summary_request
+    from modules.chat.transform import ReasoningContentTagProcessor
+
+    def summarize(previous_summary: str, messages: List[Dict]) -> str:
+        chat_processor = ChatProcessor(model_type=model_type, llm_config=llm_config)
+        response = chat_processor.create_completion(
+            messages=[
+                {"role": "system", "content": summary_prompt},
+                {"role": "user", "content": format_summary_request(previous_summary, messages)},
+            ],
+        )
+        _, summary = ReasoningContentTagProcessor().extract(response.choices[0].message.content or "")
+        return summary.strip()
+
+    return summarize
+
+
 # def html_to_jpg(html_content: str) -> Image:
 #     """
 #     将HTML内容转换为JPG图片
@@ -287,6 +312,7 @@ def user_input_constructor(
 
     返回值:
     - 一个字典，包含了用户的角色和内容（文本或/和图像）。
+      图像保存在 blob 存储中，内容里只有 `blob:sha256:` 引用，请求模型前需用 `resolve_message_images` 解析。
     """
     base_input = {
         "role": "user"
@@ -309,7 +335,7 @@ def user_input_constructor(
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{encode_image(image)}"
+                    "url": get_blob_store().put(image.getvalue(), "image/jpeg")
                 }
             } for image in images
         ]
@@ -0,0 +1,355 @@
+import os
+import json
+import hashlib
+import textwrap
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from assets.styles.css.export_themes import default_theme, glassmorphism_theme
+from core.storage.blob import resolve_image_url
+
+
+EXPORT_THEMES = {
+    "default": default_theme,
+    "glassmorphism": glassmorphism_theme,
+}
+
+# 每个消息片段缓存的数量，超过大小限制的片段（通常包含内联图片）不缓存
+FRAGMENT_CACHE_SIZE = 4096
+MAX_CACHED_FRAGMENT_SIZE = 256 * 1024
+
+# HTML 模板在 {chat_messages} 处拆分为头部和尾部，消息片段逐条写在两者之间
+_HTML_HEAD = """
+    <!DOCTYPE html>
+    <html lang="zh-CN">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>{chat_name}</title>
+        <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
+        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/styles/{code_theme}.min.css">
+        <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/highlight.min.js"></script>
+        <style>
+            {css_theme}
+            pre {{
+                white-space: pre-wrap;
+                word-wrap: break-word;
+                background-color: #1A1B26;
+                border-radius: 5px;
+                padding: 1em;
+                margin: 1em 0;
+            }}
+            code {{
+                display: block;
+                overflow-x: auto;
+                padding: 0.5em;
+                background-color: #1A1B26;
+                font-family: 'Courier New', Courier, monospace;
+                color: #CBD2EA;
+            }}
+            code[class*="language-"] {{
+                background-color: #1A1B26;
+                color: #CBD2EA;
+            }}
+            .message.user pre,
+            .message.user code {{
+                text-align: left;
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="card">
+            <div class="info-card">
+                <div class="info-left">
+                    <div class="project-name">RAGENT</div>
+                    <div class="project-url">
+                        <a href="https://github.com/Wannabeasmartguy/RAGENT" target="_blank">
+                            github.com/Wannabeasmartguy/RAGENT
+                        </a>
+                    </div>
+                </div>
+                <div class="info-right">
+                    <div class="info-right-content model-name">Model: {model_name}</div>
+                    <div class="info-right-content message-count">Messages: {message_count}</div>
+                    <div class="info-right-content chat-name">Chat: {chat_name}</div>
+                </div>
+            </div>
+            <div class="chat-container">
+                """
+
+_HTML_TAIL = """
+            </div>
+        </div>
+        <script>
+            document.addEventListener('DOMContentLoaded', (event) => {{
+                marked.setOptions({{
+                    breaks: true,
+                    gfm: true,
+                    highlight: function(code, lang) {{
+                        const language = hljs.getLanguage(lang) ? lang : 'plaintext';
+                        return hljs.highlight(code, {{ language }}).value;
+                    }},
+                    langPrefix: 'hljs language-'
+                }});
+                
+                document.querySelectorAll('.markdown-content').forEach((element) => {{
+                    element.innerHTML = marked.parse(element.textContent);
+                }});
+                
+                hljs.highlightAll();
+
+                // 确保代码块内的换行符被保留
+                document.querySelectorAll('pre code').forEach((block) => {{
+                    block.innerHTML = block.innerHTML.replace(/\\n/g, '<br>');
+                }});
+            }});
+        </script>
+    </body>
+    </html>
+    """
+
+
+def wrap_long_text(text: str, max_length: int = 60) -> str:
+    """
+    将长文本按指定长度换行
+    """
+    wrapped_lines = textwrap.wrap(text, max_length)
+    return '<br>'.join(wrapped_lines)
+
+
+@lru_cache(maxsize=16)
+def compile_html_template(theme: str = "default", code_theme: str = "github-dark") -> Tuple[str, str]:
+    """
+    预编译主题模板，返回 (头部, 尾部)
+
+    头部中只剩 `{chat_name}`、`{model_name}`、`{message_count}` 三个占位符，用 str.replace 填充，
+    主题 CSS 中的 `{{ }}` 在这里一次性转义完成。
+    """
+    css_theme = EXPORT_THEMES.get(theme, default_theme)
+    head = _HTML_HEAD.replace("{css_theme}", css_theme).format(
+        code_theme=code_theme,
+        chat_name="{chat_name}",
+        model_name="{model_name}",
+        message_count="{message_count}",
+    )
+    return head, _HTML_TAIL.format()
+
+
+class _FragmentCache:
+    """按消息内容哈希缓存渲染好的片段，多次预览与导出之间共享"""
+
+    def __init__(self, maxsize: int = FRAGMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, kind: str, message: Dict[str, Any], render) -> Any:
+        key = (kind, _message_hash(message))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        fragment = render(message)
+        if _fragment_size(fragment) <= MAX_CACHED_FRAGMENT_SIZE:
+            with self._lock:
+                self._cache[key] = fragment
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return fragment
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+def _message_hash(message: Dict[str, Any]) -> str:
+    content = [message.get("role"), message.get("content")]
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _fragment_size(fragment: Any) -> int:
+    if isinstance(fragment, str):
+        return len(fragment)
+    return sum(len(part) for parts in fragment for part in parts if part)
+
+
+fragment_cache = _FragmentCache()
+
+
+def _image_url(item: Dict[str, Any]) -> str:
+    image_url = item['image_url'].get('url', '') if isinstance(item['image_url'], dict) else item['image_url']
+    return resolve_image_url(image_url)
+
+
+def _render_html_message(message: Dict[str, Any]) -> str:
+    role = message['role']
+    content = message['content']
+    parts = [f'<div class="message {role}">', f'<div class="role">{role.capitalize()}</div>']
+    if isinstance(content, str):
+        parts.append(f'<div class="markdown-content">{content}</div>')
+    elif isinstance(content, list):
+        for item in content:
+            if item['type'] == 'text':
+                parts.append(f'<div class="markdown-content">{item["text"]}</div>')
+            elif item['type'] == 'image_url':
+                parts.append(f'<img src="{_image_url(item)}" alt="Image">')
+    parts.append('</div>')
+    return "".join(parts)
+
+
+def _render_markdown_message(message: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """返回 (正文片段, 图片 URL)，正文中的图片用 None 占位，编号与引用在写出时确定"""
+    content = message['content']
+    parts = [f"## {message['role'].title()}\n\n"]
+    images = []
+    if isinstance(content, str):
+        parts.append(f"{content}\n\n")
+    elif isinstance(content, list):
+        for item in content:
+            if item['type'] == 'text':
+                parts.append(f"{item['text']}\n\n")
+            elif item['type'] == 'image_url':
+                parts.append(None)
+                images.append(_image_url(item))
+    return parts, images
+
+
+def _selected_messages(
+    chat_history: Sequence[Dict[str, Any]],
+    include_range: Optional[Tuple[int, int]],
+    exclude_indexes: Optional[Iterable[int]],
+) -> Tuple[Iterator[Dict[str, Any]], int]:
+    if include_range is None:
+        include_range = (0, len(chat_history) - 1)
+    exclude_indexes = list(exclude_indexes or [])
+    excluded = set(exclude_indexes)
+    indexes = [i for i in range(include_range[0], include_range[1] + 1) if i not in excluded]
+    # 消息数量沿用原来的算法：include_range范围长度 - exclude_indexes的元素个数
+    message_count = include_range[1] - include_range[0] + 1 - len(exclude_indexes)
+    return (chat_history[i] for i in indexes), message_count
+
+
+def iter_html_chat(
+    chat_history: Sequence[Dict[str, Any]],
+    include_range: Optional[Tuple[int, int]] = None,
+    exclude_indexes: Optional[Iterable[int]] = None,
+    theme: Optional[str] = "default",
+    chat_name: Optional[str] = "Chat history",
+    model_name: Optional[str] = None,
+    code_theme: Optional[str] = "github-dark",
+) -> Iterator[str]:
+    """
+    逐段生成 HTML 格式的聊天历史，参数同 `generate_html_chat`
+
+    每条消息的片段按内容哈希缓存，预览与导出重复生成时无需重新渲染。
+    """
+    messages, message_count = _selected_messages(chat_history, include_range, exclude_indexes)
+    head, tail = compile_html_template(theme or "default", code_theme or "github-dark")
+    yield (
+        head.replace("{chat_name}", wrap_long_text(chat_name))
+        .replace("{model_name}", model_name if model_name is not None else "Not specified")
+        .replace("{message_count}", str(message_count))
+    )
+    for index, message in enumerate(messages):
+        if index:
+            yield "\n"
+        yield fragment_cache.get("html", message, _render_html_message)
+    yield tail
+
+
+def iter_markdown_chat(
+    chat_history: Sequence[Dict[str, Any]],
+    include_range: Optional[Tuple[int, int]] = None,
+    exclude_indexes: Optional[Iterable[int]] = None,
+    chat_name: Optional[str] = "Chat history",
+) -> Iterator[str]:
+    """逐段生成 Markdown 格式的聊天历史，参数同 `generate_markdown_chat`"""
+    messages, _ = _selected_messages(chat_history, include_range, exclude_indexes)
+    image_references = []
+    image_counter = 0
+
+    if chat_name:
+        yield f"# {chat_name}\n\n"
+    for message in messages:
+        parts, images = fragment_cache.get("markdown", message, _render_markdown_message)
+        images = iter(images)
+        for part in parts:
+            if part is None:
+                # 所有图片都参与编号，只有 data URL 写成文末引用
+                image_url = next(images)
+                image_counter += 1
+                reference_id = f"image{image_counter}"
+                if image_url.startswith('data:image/'):
+                    image_references.append(f"[{reference_id}]: {image_url}\n")
+                    part = f"![image][{reference_id}]\n\n"
+                else:
+                    part = f"![Image]({image_url})\n\n"
+            yield part
+
+    # 添加图片引用到文档末尾
+    if image_references:
+        yield "\n\n<!-- Image References -->\n"
+        yield from image_references
+
+
+def write_export(path: str, chunks: Iterable[str]) -> str:
+    """将分段内容写入文件，先写临时文件再替换，避免留下不完整的导出"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+    return path
+
+
+def export_chat_history(
+    chat_history: Sequence[Dict[str, Any]],
+    path: str,
+    export_type: Literal["markdown", "html"] = "html",
+    include_range: Optional[Tuple[int, int]] = None,
+    exclude_indexes: Optional[Iterable[int]] = None,
+    theme: Optional[str] = "default",
+    chat_name: Optional[str] = "Chat history",
+    model_name: Optional[str] = None,
+) -> str:
+    """
+    将聊天历史流式导出到文件
+
+    Returns:
+        str: 导出文件的路径
+    """
+    if export_type == "markdown":
+        chunks = iter_markdown_chat(chat_history, include_range, exclude_indexes, chat_name)
+    elif export_type == "html":
+        chunks = iter_html_chat(chat_history, include_range, exclude_indexes, theme, chat_name, model_name)
+    else:
+        raise ValueError(f"Unsupported export type: {export_type}")
+    return write_export(path, chunks)
+
+
+def _export_job(job: Dict[str, Any]) -> str:
+    return export_chat_history(**job)
+
+
+def export_chat_histories(jobs: Sequence[Dict[str, Any]], max_workers: Optional[int] = None) -> List[str]:
+    """
+    批量导出多个对话，在进程池中并行执行
+
+    Args:
+        jobs: 每项为 `export_chat_history` 的关键字参数
+        max_workers: 进程数，默认为 CPU 核数
+
+    Returns:
+        List[str]: 导出文件的路径，顺序与 jobs 相同
+    """
+    if len(jobs) <= 1:
+        return [_export_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        paths = list(executor.map(_export_job, jobs))
+    logger.info(f"Exported {len(paths)} chat histories")
+    return paths
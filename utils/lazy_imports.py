@@ -0,0 +1,61 @@
+"""
+重量级可选依赖的延迟加载
+
+whisper、sentence_transformers（都会加载 torch）、networkx/matplotlib、autogen 等只在少数功能中用到，
+在模块顶层导入会拖慢每个页面的首次渲染与 API 服务的启动。需要它们的地方调用这里的访问函数，
+第一次调用时才导入，之后直接返回已导入的模块。
+"""
+import importlib
+from functools import lru_cache
+from types import ModuleType
+from typing import Optional
+
+
+@lru_cache(maxsize=None)
+def lazy_import(module_name: str, package: Optional[str] = None) -> ModuleType:
+    """
+    导入模块，未安装时给出安装提示
+
+    Args:
+        module_name: 模块名，如 "matplotlib.pyplot"
+        package: pip 包名，默认与模块名相同
+    """
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        raise ImportError(
+            f"Could not import {module_name}, please install with `pip install "
+            f"{package or module_name.split('.')[0]}`."
+        ) from e
+
+
+def get_whisper() -> ModuleType:
+    return lazy_import("whisper", "openai-whisper")
+
+
+def get_sentence_transformers() -> ModuleType:
+    return lazy_import("sentence_transformers", "sentence-transformers")
+
+
+def get_huggingface_hub() -> ModuleType:
+    return lazy_import("huggingface_hub", "huggingface_hub")
+
+
+def get_networkx() -> ModuleType:
+    return lazy_import("networkx")
+
+
+def get_pyplot() -> ModuleType:
+    return lazy_import("matplotlib.pyplot", "matplotlib")
+
+
+def get_autogen_oai() -> ModuleType:
+    return lazy_import("autogen.oai", "autogen")
+
+
+def get_autogen() -> ModuleType:
+    return lazy_import("autogen", "autogen")
+
+
+def get_faster_whisper() -> ModuleType:
+    return lazy_import("faster_whisper", "faster-whisper")
@@ -1,76 +1,277 @@
 # logger_config.py
-import sys
-from loguru import logger
+"""
+日志配置
+
+所有日志写入一个 JSON Lines 文件（每行一条记录，便于按 level / name 过滤与采集），
+各 sink 均为 `enqueue=True`，写文件在后台线程中完成，不阻塞请求。
+
+通过环境变量配置（均可省略）：
+
+- `LOG_LEVEL`：默认级别，默认 DEBUG
+- `LOG_LEVELS`：按模块前缀设置级别，如 `httpx=WARNING,modules.rag=INFO`
+- `LOG_SAMPLING`：按模块前缀对 DEBUG/INFO 采样的比例，如 `core.processors.chat=0.1`
+- `LOG_RATE_LIMIT`：按模块前缀限制每秒 DEBUG/INFO 的条数，如 `modules.llm=20`
+- `LOG_PREVIEW_CHARS`：`shorten` 截断长文本（如提示词）的长度，默认 500，0 表示不截断
+- `RAGENT_ENV=production`：关闭 `diagnose`（异常中不再打印变量的值，避免泄露密钥，也更快）
+  与开发时额外的可读错误日志；也可以用 `LOG_DIAGNOSE=True/False` 单独设置
+
+WARNING 及以上的记录不会被采样或限流。耗时的消息请使用参数或 `logger.opt(lazy=True)`，
+只有在记录会被写入时才格式化：
+
+    logger.debug("Retrieved {} documents", len(documents))
+    logger.opt(lazy=True).debug("System prompt: {}", lambda: shorten(system_prompt))
+"""
 import os
+import json
+import random
+import threading
+import time
+import traceback
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+from config.constants.paths import LOG_DIR
+
+LOG_FILE = os.path.join(LOG_DIR, "ragent-copilot.jsonl")
+ERROR_LOG_FILE = os.path.join(LOG_DIR, "ragent-copilot-error.log")
+
+# 对敏感字段的值打码
+# 按完整名称或 `_xxx` 后缀匹配，避免 max_tokens、token_count 之类的字段被误打码
+_SECRET_FIELDS = ("api_key", "token", "secret", "password")
+_NON_SECRET_PREFIXES = ("max_",)
+
+_handler_ids = []
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _parse_module_map(value: Optional[str], cast) -> Dict[str, Any]:
+    """解析 `prefix=value,prefix=value`"""
+    result = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        prefix, _, setting = item.partition("=")
+        try:
+            result[prefix.strip()] = cast(setting.strip())
+        except ValueError:
+            logger.warning(f"Ignoring invalid log setting {item!r}")
+    return result
+
+
+def _level_no(level: str) -> int:
+    return logger.level(level.upper()).no
+
+
+def _level_name(level: str) -> str:
+    # 未知的级别名称抛出 ValueError
+    return logger.level(level.strip().upper()).name
+
+
+class LogPolicy:
+    """
+    日志 sink 的过滤器：按模块前缀路由级别，并对 DEBUG/INFO 采样与限流
+
+    模块前缀按 `.` 分隔匹配（`modules.llm` 匹配 `modules.llm.openai`，不匹配 `modules.llms`），
+    取最长的前缀；每个模块解析一次后缓存。被采样或限流丢弃的条数记在该模块下一条写入的记录的
+    `extra["dropped"]` 中。
+    """
+
+    def __init__(
+        self,
+        level: str = "DEBUG",
+        levels: Optional[Dict[str, str]] = None,
+        sampling: Optional[Dict[str, float]] = None,
+        rate_limits: Optional[Dict[str, float]] = None,
+    ):
+        """
+        Args:
+            level: 默认级别
+            levels: 模块前缀 -> 级别
+            sampling: 模块前缀 -> 保留的比例（0~1）
+            rate_limits: 模块前缀 -> 每秒最多写入的条数
+        """
+        self.levels = {"": _level_no(level), **{k: _level_no(v) for k, v in (levels or {}).items()}}
+        self.sampling = sampling or {}
+        self.rate_limits = rate_limits or {}
+        self._warning_no = _level_no("WARNING")
+        self._policies: Dict[str, Tuple[int, float, float]] = {}
+        # 模块 -> [窗口开始时间, 窗口内条数, 丢弃条数]
+        self._windows: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def min_level(self) -> int:
+        return min(self.levels.values())
+
+    @staticmethod
+    def _lookup(name: str, table: Dict[str, Any], default: Any) -> Any:
+        while True:
+            if name in table:
+                return table[name]
+            if not name:
+                return default
+            name = name.rpartition(".")[0]
+
+    def _policy(self, name: str) -> Tuple[int, float, float]:
+        policy = self._policies.get(name)
+        if policy is None:
+            policy = self._policies[name] = (
+                self._lookup(name, self.levels, self.levels[""]),
+                self._lookup(name, self.sampling, 1.0),
+                self._lookup(name, self.rate_limits, 0),
+            )
+        return policy
+
+    def __call__(self, record: Dict[str, Any]) -> bool:
+        name = record["name"] or ""
+        level_no, sample, rate = self._policy(name)
+        no = record["level"].no
+        if no < level_no:
+            return False
+        if no >= self._warning_no or (sample >= 1 and not rate):
+            return True
+
+        with self._lock:
+            window = self._windows.setdefault(name, [0.0, 0, 0])
+            keep = sample >= 1 or random.random() < sample
+            if keep and rate:
+                now = time.monotonic()
+                if now - window[0] >= 1:
+                    window[0], window[1] = now, 0
+                keep = window[1] < rate
+                window[1] += keep
+            if not keep:
+                window[2] += 1
+                return False
+            if window[2]:
+                record["extra"]["dropped"] = window[2]
+                window[2] = 0
+        return True
+
+
+def _json_format(record: Dict[str, Any]) -> str:
+    payload = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "name": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "process": record["process"].id,
+        "thread": record["thread"].id,
+        "message": record["message"],
+    }
+    extra = {k: v for k, v in record["extra"].items() if k != "_json"}
+    if extra:
+        payload["extra"] = extra
+    if record["exception"] is not None:
+        exc_type, exc_value, exc_tb = record["exception"]
+        payload["exception"] = "".join(traceback.format_exception(exc_type, exc_value, exc_tb))
+    record["extra"]["_json"] = json.dumps(payload, ensure_ascii=False, default=str)
+    return "{extra[_json]}\n"
+
+
+def is_production() -> bool:
+    return os.getenv("RAGENT_ENV", "").strip().lower() in ("prod", "production")
+
+
+def shorten(text: Any, limit: Optional[int] = None) -> str:
+    """
+    截断日志中的长文本（提示词、检索结果等），只保留开头并注明总长度
+
+    Args:
+        text: 要记录的内容
+        limit: 保留的字符数，默认为 `LOG_PREVIEW_CHARS`，0 表示不截断
+    """
+    text = str(text)
+    if limit is None:
+        limit = int(os.getenv("LOG_PREVIEW_CHARS", 500))
+    if not limit or len(text) <= limit:
+        return text
+    return f"{text[:limit]}...({len(text)} chars)"
+
+
+def _is_secret_field(name: Any) -> bool:
+    """字段名等于 api_key/token/secret/password 或以 `_` 加这些名称结尾，max_ 开头的除外"""
+    name = str(name).lower().replace("-", "_")
+    if name.startswith(_NON_SECRET_PREFIXES):
+        return False
+    return any(name == field or name.endswith(f"_{field}") for field in _SECRET_FIELDS)
+
+
+def redact_secrets(value: Any) -> Any:
+    """返回副本，名称为 api_key/token/secret/password 或以其为后缀的字段的值被打码，pydantic 模型先转换为字典"""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump()
+    if isinstance(value, dict):
+        return {
+            k: "***" if _is_secret_field(k) and v else redact_secrets(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact_secrets(v) for v in value)
+    return value
+
 
 def setup_logger():
-    folder_ = "./log/"
-    prefix_ = "ragent-copilot-"
+    """配置日志 sink，重复调用时先移除之前添加的 sink"""
+    global _handler_ids
     rotation_ = "10 MB"
     retention_ = "30 days"
     encoding_ = "utf-8"
-    backtrace_ = True
-    diagnose_ = True
+    production = is_production()
+    diagnose_ = _env_flag("LOG_DIAGNOSE", not production)
 
-    format_ = '<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> ' \
-              '| <magenta>{process}</magenta>:<yellow>{thread}</yellow> ' \
-              '| <cyan>{name}</cyan>:<cyan>{function}</cyan>:<yellow>{line}</yellow> - <level>{message}</level>'
-
-    try:
-        logger.remove(0)  # 移除默认的日志记录器
-    except ValueError:
-        pass
-
-    # debug
-    logger.add(folder_ + prefix_ + "debug.log", level="DEBUG", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("DEBUG").no)
-
-    # info
-    logger.add(folder_ + prefix_ + "info.log", level="INFO", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("INFO").no)
-
-    # warning
-    logger.add(folder_ + prefix_ + "warning.log", level="WARNING", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("WARNING").no)
-
-    # error
-    logger.add(folder_ + prefix_ + "error.log", level="ERROR", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("ERROR").no)
-
-    # critical
-    logger.add(folder_ + prefix_ + "critical.log", level="CRITICAL", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("CRITICAL").no)
-
-    # logger.add(sys.stderr, level="CRITICAL", backtrace=backtrace_, diagnose=diagnose_,
-    #            format=format_, colorize=True,
-    #            filter=lambda record: record["level"].no >= logger.level("CRITICAL").no)
-    
-    # logger.add(sys.stdout, level="INFO", backtrace=backtrace_, diagnose=diagnose_,
-    #            format=format_, colorize=True,
-    #            filter=lambda record: record["level"].no == logger.level("INFO").no)
+    # 先解析配置，配置有误时的警告还能输出到现有的 sink
+    levels = _parse_module_map(f"={os.getenv('LOG_LEVEL', 'DEBUG')},{os.getenv('LOG_LEVELS', '')}", _level_name)
+    policy = LogPolicy(
+        level=levels.pop("", "DEBUG"),
+        levels=levels,
+        sampling=_parse_module_map(os.getenv("LOG_SAMPLING"), float),
+        rate_limits=_parse_module_map(os.getenv("LOG_RATE_LIMIT"), float),
+    )
+
+    for handler_id in _handler_ids + [0]:
+        try:
+            logger.remove(handler_id)  # 0 为默认的日志记录器
+        except ValueError:
+            pass
+    _handler_ids = []
+    # sink 的最低级别取各模块级别中最低的，低于它的调用在 loguru 中直接返回，不会格式化消息
+    _handler_ids.append(
+        logger.add(LOG_FILE, level=policy.min_level, format=_json_format, filter=policy,
+                   colorize=False, enqueue=True, backtrace=False, diagnose=False,
+                   rotation=rotation_, retention=retention_, encoding=encoding_)
+    )
+
+    if diagnose_:
+        # 开发时保留可读的错误日志，异常中带有变量的值
+        format_ = '<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> ' \
+                  '| <magenta>{process}</magenta>:<yellow>{thread}</yellow> ' \
+                  '| <cyan>{name}</cyan>:<cyan>{function}</cyan>:<yellow>{line}</yellow> - <level>{message}</level>'
+        _handler_ids.append(
+            logger.add(ERROR_LOG_FILE, level="ERROR", format=format_, colorize=False,
+                       enqueue=True, backtrace=True, diagnose=True,
+                       rotation=rotation_, retention=retention_, encoding=encoding_)
+        )
 
     # 设置负载均衡日志
-    setup_load_balance_logger()
+    setup_load_balance_logger(diagnose_)
+
 
-def setup_load_balance_logger():
+def setup_load_balance_logger(diagnose: bool = True):
     """为负载均衡策略配置专门的日志记录器"""
-    folder_ = "./log/load_balance/"
+    folder_ = os.path.join(LOG_DIR, "load_balance")
     prefix_ = "load-balance-"
     rotation_ = "10 MB"
     retention_ = "30 days"
     encoding_ = "utf-8"
-    backtrace_ = True
-    diagnose_ = True
 
     # 确保日志目录存在
     os.makedirs(folder_, exist_ok=True)
@@ -82,39 +283,42 @@ def setup_load_balance_logger():
              '- <level>{message}</level>'
 
     # 策略选择日志
-    logger.add(
-        folder_ + prefix_ + "strategy.log",
+    _handler_ids.append(logger.add(
+        os.path.join(folder_, prefix_ + "strategy.log"),
         level="DEBUG",
         format=format_,
         filter=lambda record: "strategy_selection" in record["extra"],
         rotation=rotation_,
         retention=retention_,
         encoding=encoding_,
-        backtrace=backtrace_,
-        diagnose=diagnose_
-    )
+        enqueue=True,
+        backtrace=diagnose,
+        diagnose=diagnose
+    ))
 
     # 性能统计日志
-    logger.add(
-        folder_ + prefix_ + "performance.log",
+    _handler_ids.append(logger.add(
+        os.path.join(folder_, prefix_ + "performance.log"),
         level="INFO",
         format=format_,
         filter=lambda record: "performance_stats" in record["extra"],
         rotation=rotation_,
         retention=retention_,
-        encoding=encoding_
-    )
+        encoding=encoding_,
+        enqueue=True
+    ))
 
     # 错误统计日志
-    logger.add(
-        folder_ + prefix_ + "errors.log",
+    _handler_ids.append(logger.add(
+        os.path.join(folder_, prefix_ + "errors.log"),
         level="WARNING",
         format=format_,
         filter=lambda record: "error_stats" in record["extra"],
         rotation=rotation_,
         retention=retention_,
-        encoding=encoding_
-    )
+        encoding=encoding_,
+        enqueue=True
+    ))
 
 def get_load_balance_logger(strategy: str, config_index: int = -1):
     """获取带有负载均衡上下文的日志记录器"""
@@ -130,19 +334,19 @@ def log_dict_changes(original_dict, new_dict):
     # 找出变化的键值对
     changed_keys = set(original_dict.keys()) & set(new_dict.keys())
     changed_keys = [key for key in changed_keys if original_dict[key] != new_dict[key]]
-    
+
     # 找出新增和删除的键
     added_keys = set(new_dict.keys()) - set(original_dict.keys())
     removed_keys = set(original_dict.keys()) - set(new_dict.keys())
-    
+
     # 记录变化
     if changed_keys or added_keys or removed_keys:
         logger.debug("Dictionary changes:")
         for key in changed_keys:
-            logger.debug(f"Key '{key}' changed from '{original_dict[key]}' to '{new_dict[key]}'")
+            logger.debug("Key '{}' changed from '{}' to '{}'", key, original_dict[key], new_dict[key])
         for key in added_keys:
-            logger.debug(f"Key '{key}' added with value '{new_dict[key]}'")
+            logger.debug("Key '{}' added with value '{}'", key, new_dict[key])
         for key in removed_keys:
-            logger.debug(f"Key '{key}' removed (old value was '{original_dict[key]}')")
+            logger.debug("Key '{}' removed (old value was '{}')", key, original_dict[key])
 
-setup_logger()
\ No newline at end of file
+setup_logger()
@@ -1,9 +1,13 @@
 
 import os
 import re
+import json
 import time
 import base64
-from typing import List, Dict, Optional, Literal, Tuple, Union
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any,  List, Dict, Optional, Literal, Tuple, Union, Sequence
 
 import streamlit_authenticator as stauth
 
@@ -12,6 +16,7 @@ from config.constants import (
     SUPPORTED_LANGUAGES,
     USER_AVATAR_SVG,
     AI_AVATAR_SVG,
+    WHISPER_MODELS,
     prompts
 )
 from assets.styles.css.rag_chat_css import (
@@ -25,18 +30,19 @@ from assets.styles.css.classic_chat_css import (
     USER_CHAT_STYLE_ST_V39,
     ASSISTANT_CHAT_STYLE,
 )
-from assets.styles.css.export_themes import (
-    default_theme, 
-    glassmorphism_theme
-)
 from core.basic_config import I18nAuto
+from core.storage.blob import get_blob_store, is_blob_url
+from utils.export_utils import (
+    export_chat_history,
+    iter_html_chat,
+    iter_markdown_chat,
+)
 from tools.toolkits import TO_TOOLS
+from modules.audio.transcription import get_transcription_service
 
 import streamlit as st
 import streamlit.components.v1 as components
-import whisper
 import pyperclip
-import textwrap
 from streamlit_float import *
 from packaging.version import parse as parse_version
 
@@ -209,6 +215,7 @@ def copy_to_clipboard(content: str):
     pyperclip.copy(content)
     st.toast(i18n("The content has been copied to the clipboard"), icon="✂️")
 
+@lru_cache(maxsize=32)
 def get_style(
         style_type:Literal["USER_CHAT", "ASSISTANT_CHAT", "RAG_USER_CHAT", "RAG_ASSISTANT_CHAT"],
         st_version:str
@@ -229,6 +236,7 @@ def get_style(
         return style_dict.get("v39", "")
 
 
+@lru_cache(maxsize=32)
 def get_combined_style(
         st_version:str, 
         *style_types:Literal["USER_CHAT", "ASSISTANT_CHAT", "RAG_USER_CHAT", "RAG_ASSISTANT_CHAT"]
@@ -242,54 +250,146 @@ def get_combined_style(
     """
     return "".join(get_style(style_type, st_version) for style_type in style_types)
 
-# @st.cache_data
+# 将SVG编码为base64
+USER_AVATAR = f"data:image/svg+xml;base64,{base64.b64encode(USER_AVATAR_SVG.encode('utf-8')).decode('utf-8')}"
+AI_AVATAR = f"data:image/svg+xml;base64,{base64.b64encode(AI_AVATAR_SVG.encode('utf-8')).decode('utf-8')}"
+
+# 每次重新运行时只渲染最近的消息，更早的消息通过“加载更早的消息”按钮分页显示
+CHAT_HISTORY_WINDOW = 20
+# 每个会话缓存的消息渲染结果数量
+MESSAGE_RENDER_CACHE_SIZE = 256
+
+
+def get_chat_history_window(
+    total: int,
+    window_key: str = "chat_history",
+    window_size: int = CHAT_HISTORY_WINDOW,
+) -> int:
+    """
+    计算本次需要渲染的第一条消息的索引，存在更早的消息时显示“加载更早的消息”按钮
+
+    Args:
+        total: 消息总数
+        window_key: 窗口状态在 session_state 中的键名前缀，不同页面使用不同的键
+        window_size: 每页显示的消息数量
+
+    Returns:
+        int: 第一条需要渲染的消息的索引
+    """
+    state_key = f"{window_key}_window_size"
+    shown = st.session_state.setdefault(state_key, window_size)
+    start = max(total - shown, 0)
+    if start > 0:
+        def _load_older():
+            st.session_state[state_key] += window_size
+
+        st.button(
+            label=i18n("Load older messages") + f" ({start})",
+            key=f"{window_key}_load_older",
+            on_click=_load_older,
+            use_container_width=True,
+        )
+    return start
+
+
+def _message_render_key(message: Dict[str, Any]) -> str:
+    """消息 ID 加内容哈希，消息被编辑后会得到新的键"""
+    message_id = message.get("id") or message.get("response_id") or ""
+    content = [message.get("role"), message.get("reasoning_content"), message.get("content")]
+    content_hash = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{message_id}:{content_hash}"
+
+
+def _build_render_blocks(message: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """将消息转换为 (元素类型, 内容) 列表，图片只保存 blob 引用或 URL，不保存解码后的字节"""
+    blocks = []
+    if message.get("reasoning_content"):
+        blocks.append(("caption", message["reasoning_content"]))
+    if isinstance(message["content"], str):
+        blocks.append(("markdown", message["content"]))
+    elif isinstance(message["content"], List):
+        for content in message["content"]:
+            if content["type"] == "text":
+                blocks.append(("markdown", content["text"]))
+            elif content["type"] == "image_url":
+                image_url = content["image_url"]
+                if isinstance(image_url, dict):
+                    image_url = image_url.get("url", "")
+                blocks.append(("image", image_url))
+    return blocks
+
+
+def get_message_render_blocks(message: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """
+    获取消息的渲染内容，按消息 ID 与内容哈希缓存在 session_state 中
+
+    Streamlit 每次重新运行都需要重新输出所有元素，缓存避免了重复解析消息。
+    缓存中的图片只是引用，字节在渲染时读取，缓存的内存占用不随图片大小增长。
+    """
+    cache: OrderedDict = st.session_state.setdefault("_message_render_cache", OrderedDict())
+    key = _message_render_key(message)
+    blocks = cache.get(key)
+    if blocks is None:
+        blocks = _build_render_blocks(message)
+        cache[key] = blocks
+        if len(cache) > MESSAGE_RENDER_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return blocks
+
+
+def _load_image(image_url: str) -> Union[bytes, str]:
+    """blob 引用从存储读取，data URL 解码为字节，其他 URL 原样交给 st.image"""
+    if is_blob_url(image_url):
+        return get_blob_store().read(image_url)
+    if image_url.startswith("data:image/"):
+        return base64.b64decode(image_url.split(",", 1)[1])
+    return image_url
+
+
+def render_message_blocks(blocks: List[Tuple[str, Any]]) -> None:
+    for kind, content in blocks:
+        if kind == "caption":
+            st.caption(content)
+        elif kind == "markdown":
+            st.markdown(content)
+        elif kind == "image":
+            st.image(_load_image(content))
+
+
 def write_chat_history(
-    chat_history: Optional[List[Dict[str, str]]] = None,
-    if_custom_css: bool = True
+    chat_history: Optional[Sequence[Dict[str, str]]] = None,
+    if_custom_css: bool = True,
+    window_size: Optional[int] = CHAT_HISTORY_WINDOW,
+    window_key: str = "chat_history",
 ) -> None:
-    # 将SVG编码为base64
-    user_avatar = f"data:image/svg+xml;base64,{base64.b64encode(USER_AVATAR_SVG.encode('utf-8')).decode('utf-8')}"
-
-    # 将SVG编码为base64
-    ai_avatar = f"data:image/svg+xml;base64,{base64.b64encode(AI_AVATAR_SVG.encode('utf-8')).decode('utf-8')}"
+    """
+    渲染对话历史
 
+    Args:
+        chat_history: 对话历史，可以是列表，也可以是 `LazyChatHistory` 等按页加载的序列
+        if_custom_css: 是否注入自定义聊天样式
+        window_size: 只渲染最近的消息数量，更早的消息分页加载，为 None 时渲染全部
+        window_key: 分页状态在 session_state 中的键名前缀
+    """
     if chat_history:
-        for message in chat_history:
+        start = 0 if window_size is None else get_chat_history_window(len(chat_history), window_key, window_size)
+        for message in chat_history[start:]:
             try:
                 if message["role"] == "system":
                     continue
             except:
                 pass
-            with st.chat_message(message["role"], avatar=user_avatar if message["role"] == "user" else ai_avatar):
+            with st.chat_message(message["role"], avatar=USER_AVATAR if message["role"] == "user" else AI_AVATAR):
                 st.html(f"<span class='chat-{message['role']}'></span>")
-                if "reasoning_content" in message and message["reasoning_content"]:
-                    st.caption(message['reasoning_content'])
-                if isinstance(message["content"], str):
-                    st.markdown(message["content"])
-                elif isinstance(message["content"], List):
-                    for content in message["content"]:
-                        if content["type"] == "text":
-                            st.markdown(content["text"])
-                        elif content["type"] == "image_url":
-                            # 如果开头为data:image/jpeg;base64，则解码为BytesIO对象
-                            if content["image_url"].startswith("data:image/jpeg;base64"):
-                                image_data = base64.b64decode(content["image_url"].split(",")[1])
-                                st.image(image_data)
-                            else:
-                                st.image(content["image_url"])
+                render_message_blocks(get_message_render_blocks(message))
         
-        # 根据Streamlit版本选择样式
+        # 根据Streamlit版本选择样式，每次运行只输出一次
         if if_custom_css:
             chat_style = get_combined_style(st.__version__, "USER_CHAT", "ASSISTANT_CHAT")
             st.html(chat_style)
 
-def wrap_long_text(text: str, max_length: int = 60) -> str:
-    """
-    将长文本按指定长度换行
-    """
-    wrapped_lines = textwrap.wrap(text, max_length)
-    return '<br>'.join(wrapped_lines)
-
 def generate_html_chat(
         chat_history: List[Dict[str, str]], 
         include_range: Optional[Tuple[int, int]] = None, 
@@ -314,148 +414,15 @@ def generate_html_chat(
     Returns:
         str: 生成的HTML格式聊天历史
     """
-    if theme == "default":
-        css_theme = default_theme
-    elif theme == "glassmorphism":
-        css_theme = glassmorphism_theme
-    else:
-        css_theme = default_theme  # 默认使用 default 主题
-
-    html_template = """
-    <!DOCTYPE html>
-    <html lang="zh-CN">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>{chat_name}</title>
-        <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/styles/{code_theme}.min.css">
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/highlight.min.js"></script>
-        <style>
-            {css_theme}
-            pre {{
-                white-space: pre-wrap;
-                word-wrap: break-word;
-                background-color: #1A1B26;
-                border-radius: 5px;
-                padding: 1em;
-                margin: 1em 0;
-            }}
-            code {{
-                display: block;
-                overflow-x: auto;
-                padding: 0.5em;
-                background-color: #1A1B26;
-                font-family: 'Courier New', Courier, monospace;
-                color: #CBD2EA;
-            }}
-            code[class*="language-"] {{
-                background-color: #1A1B26;
-                color: #CBD2EA;
-            }}
-            .message.user pre,
-            .message.user code {{
-                text-align: left;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="card">
-            <div class="info-card">
-                <div class="info-left">
-                    <div class="project-name">RAGENT</div>
-                    <div class="project-url">
-                        <a href="https://github.com/Wannabeasmartguy/RAGENT" target="_blank">
-                            github.com/Wannabeasmartguy/RAGENT
-                        </a>
-                    </div>
-                </div>
-                <div class="info-right">
-                    <div class="info-right-content model-name">Model: {model_name}</div>
-                    <div class="info-right-content message-count">Messages: {message_count}</div>
-                    <div class="info-right-content chat-name">Chat: {chat_name}</div>
-                </div>
-            </div>
-            <div class="chat-container">
-                {chat_messages}
-            </div>
-        </div>
-        <script>
-            document.addEventListener('DOMContentLoaded', (event) => {{
-                marked.setOptions({{
-                    breaks: true,
-                    gfm: true,
-                    highlight: function(code, lang) {{
-                        const language = hljs.getLanguage(lang) ? lang : 'plaintext';
-                        return hljs.highlight(code, {{ language }}).value;
-                    }},
-                    langPrefix: 'hljs language-'
-                }});
-                
-                document.querySelectorAll('.markdown-content').forEach((element) => {{
-                    element.innerHTML = marked.parse(element.textContent);
-                }});
-                
-                hljs.highlightAll();
-
-                // 确保代码块内的换行符被保留
-                document.querySelectorAll('pre code').forEach((block) => {{
-                    block.innerHTML = block.innerHTML.replace(/\\n/g, '<br>');
-                }});
-            }});
-        </script>
-    </body>
-    </html>
-    """
-
-    model_name = model_name if model_name is not None else "Not specified"
-    wrapped_chat_name = wrap_long_text(chat_name)
-
-    if include_range is None:
-        include_range = (0, len(chat_history) - 1)
-    if exclude_indexes is None:
-        exclude_indexes = []
-    
-    # 计算消息数量，方法为：include_range范围长度 - exclude_indexes的元素个数
-    message_count = include_range[1] - include_range[0] + 1 - len(exclude_indexes)
-
-    chat_messages = []
-    for i in range(include_range[0], include_range[1] + 1):
-        if i in exclude_indexes:
-            continue
-
-        message = chat_history[i]
-        role = message['role']
-        content = message['content']
-        
-        message_html = f'<div class="message {role}">'
-        message_html += f'<div class="role">{role.capitalize()}</div>'
-        
-        if isinstance(content, str):
-            message_html += f'<div class="markdown-content">{content}</div>'
-        elif isinstance(content, list):
-            for item in content:
-                if item['type'] == 'text':
-                    message_html += f'<div class="markdown-content">{item["text"]}</div>'
-                elif item['type'] == 'image_url':
-                    image_url = item['image_url'].get('url', '')
-                    message_html += f'<img src="{image_url}" alt="Image">'
-        
-        message_html += '</div>'
-        chat_messages.append(message_html)
-    
-    # 使用 str.replace() 来插入 CSS 主题
-    html_content = html_template.replace("{css_theme}", css_theme)
-    # 然后使用 .format() 插入聊天消息
-    html_content = html_content.format(
-        chat_messages="\n".join(chat_messages),
-        chat_name=wrapped_chat_name,
+    return "".join(iter_html_chat(
+        chat_history=chat_history,
+        include_range=include_range,
+        exclude_indexes=exclude_indexes,
+        theme=theme,
+        chat_name=chat_name,
         model_name=model_name,
-        message_count=message_count,
-        code_theme=code_theme
-    )
-    
-    return html_content
+        code_theme=code_theme,
+    ))
 
 def generate_markdown_chat(
     chat_history: List[Dict[str, str]], 
@@ -474,56 +441,12 @@ def generate_markdown_chat(
     Returns:
         str: 生成的Markdown格式聊天历史
     """
-    formatted_history = []
-    image_references = []
-    image_counter = 0
-
-    # 如果没有指定范围，则处理所有消息
-    if include_range is None:
-        include_range = (0, len(chat_history) - 1)
-    
-    # 如果没有指定排除索引，初始化为空列表
-    if exclude_indexes is None:
-        exclude_indexes = []
-
-    if chat_name:
-        formatted_history.append(f"# {chat_name}\n\n")
-
-    for i in range(include_range[0], include_range[1] + 1):
-        if i in exclude_indexes:
-            continue
-
-        message = chat_history[i]
-        role = message['role'].title()
-        content = message['content']
-        
-        formatted_history.append(f"## {role}\n\n")
-        
-        if isinstance(content, str):
-            formatted_history.append(f"{content}\n\n")
-        elif isinstance(content, list):
-            for item in content:
-                if item['type'] == 'text':
-                    formatted_history.append(f"{item['text']}\n\n")
-                elif item['type'] == 'image_url':
-                    image_url = item['image_url'].get('url', '')
-                    image_counter += 1
-                    reference_id = f"image{image_counter}"
-                    
-                    if image_url.startswith('data:image/jpeg;base64,'):
-                        formatted_history.append(f"![image][{reference_id}]\n\n")
-                        image_references.append(f"[{reference_id}]: {image_url}\n")
-                    else:
-                        formatted_history.append(f"![Image]({image_url})\n\n")
-    
-    # 添加图片引用到文档末尾
-    if image_references:
-        formatted_history.append("\n\n<!-- Image References -->\n")
-        formatted_history.extend(image_references)
-    
-    chat_history_text = "".join(formatted_history)
-
-    return chat_history_text
+    return "".join(iter_markdown_chat(
+        chat_history=chat_history,
+        include_range=include_range,
+        exclude_indexes=exclude_indexes,
+        chat_name=chat_name,
+    ))
 
 def export_chat_history_callback(
         chat_history: List[Dict[str, str]], 
@@ -556,44 +479,25 @@ def export_chat_history_callback(
     export_folder = "chat histories export"
     os.makedirs(export_folder, exist_ok=True)
 
-    if export_type == "markdown":
-        markdown_content = generate_markdown_chat(
-            chat_history=chat_history,
-            include_range=include_range,
-            exclude_indexes=exclude_indexes,
-            chat_name=chat_name
-        )
-
-        filename = f"{'RAG ' if is_rag else ''}Chat history - {chat_name}.md"
+    if export_type in ("markdown", "html"):
+        extension = "md" if export_type == "markdown" else "html"
+        filename = f"{'RAG ' if is_rag else ''}Chat history - {chat_name}.{extension}"
         i = 1
         while os.path.exists(os.path.join(export_folder, filename)):
-            filename = f"{'RAG ' if is_rag else ''}Chat history - {chat_name} ({i}).md"
+            filename = f"{'RAG ' if is_rag else ''}Chat history - {chat_name} ({i}).{extension}"
             i += 1
 
-        full_path = os.path.join(export_folder, filename)
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(markdown_content)
-        st.toast(body=i18n(f"Chat history exported to: {full_path}"), icon="🎉")
-    
-    elif export_type == "html":
-        html_content = generate_html_chat(
+        # 逐条写入文件，不在内存中拼接完整的导出内容
+        full_path = export_chat_history(
             chat_history=chat_history,
+            path=os.path.join(export_folder, filename),
+            export_type=export_type,
             include_range=include_range,
             exclude_indexes=exclude_indexes,
             theme=theme,
             chat_name=chat_name,
-            model_name=model_name
+            model_name=model_name,
         )
-
-        filename = f"{'RAG ' if is_rag else ''}Chat history - {chat_name}.html"
-        i = 1
-        while os.path.exists(os.path.join(export_folder, filename)):
-            filename = f"{'RAG ' if is_rag else ''}Chat history - {chat_name} ({i}).html"
-            i += 1
-
-        full_path = os.path.join(export_folder, filename)
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
         st.toast(body=i18n(f"Chat history exported to: {full_path}"), icon="🎉")
 
     # elif export_type == "jpg":
@@ -713,7 +617,7 @@ def float_chat_input_with_audio_recorder(if_tools_call: bool = False, is_file_up
         )
         transcribe_model_name = voice_input_popover.selectbox(
             label=i18n("Transcribe model"),
-            options=whisper.available_models(),
+            options=WHISPER_MODELS,
             index=3,
             key="transcribe_model"   
         )
@@ -726,27 +630,24 @@ def float_chat_input_with_audio_recorder(if_tools_call: bool = False, is_file_up
                     label=i18n("Transcribe"),
                     use_container_width=True
                 )
-                # 临时存储音频文件,将BytesIO对象转换为文件对象
-                with open("dynamic_configs/temp.wav", "wb") as f:
-                    f.write(audio_recorded.getvalue())
-                # 加载语音识别模型
+                # 录音结束后即在后台加载模型，点击识别时只需推理
+                transcription_service = get_transcription_service()
+                preload_key = (transcribe_model_name, audio_recorded.file_id)
+                if st.session_state.get("transcribe_preloaded") != preload_key:
+                    transcription_service.preload(transcribe_model_name)
+                    st.session_state["transcribe_preloaded"] = preload_key
                 if transcribe_button:
                     with st.status(i18n("Transcribing...")):
-                        st.write(i18n("Loading model"))
-                        transcribe_model = whisper.load_model(
-                            name=transcribe_model_name,
-                            download_root="./tts_models"
+                        content = st.write_stream(
+                            transcription_service.stream_transcription(
+                                audio_recorded.getvalue(),
+                                model_name=transcribe_model_name,
+                            )
                         )
-                        st.write(i18n("Model loaded"))
-                        # 识别语音
-                        st.write(i18n("Transcribing"))
-                        transcribe_result = transcribe_model.transcribe(audio="dynamic_configs/temp.wav",word_timestamps=True,verbose=True)
                         st.write(i18n("Transcribed"))
-                    content = transcribe_result.get("text","No result.")
+                    content = content or "No result."
                     copy_to_clipboard(content)
                     st.code(content)
-                    # 删除临时文件
-                    os.remove("dynamic_configs/temp.wav")
 
     chat_input_css = float_css_helper(bottom="5rem", display="flex", justify_content="center", margin="0 auto")
     chat_input_container.float(chat_input_css)
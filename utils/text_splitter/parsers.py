@@ -0,0 +1,307 @@
+import os
+import io
+import csv
+import json
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from loguru import logger
+
+from config.constants import PARSE_CACHE_DIR
+from core.compression import compress, decompress
+
+
+# 解析器的输出格式变化时递增，使旧的缓存失效
+PARSER_VERSION = 1
+# PDF 平均每页少于该字符数时视为扫描件，交给 Unstructured 做 OCR
+MIN_PDF_CHARS_PER_PAGE = 20
+
+_MARKITDOWN_FILE_TYPES = ['docx','doc','pptx','ppt','xlsx','xls','csv']
+
+
+def decode_text(data: bytes) -> str:
+    """解码纯文本文件，依次尝试 UTF-8（含 BOM）与 GB18030"""
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def _parse_text(data: bytes, file_name: str) -> List[Document]:
+    return [Document(page_content=decode_text(data))]
+
+
+def _parse_pdf(data: bytes, file_name: str) -> Optional[List[Document]]:
+    """读取 PDF 的文本层，每页一个文档；没有文本层（扫描件）时返回 None"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        PdfReader = None
+
+    if PdfReader is not None:
+        reader = PdfReader(io.BytesIO(data))
+        pages = [page.extract_text() or "" for page in reader.pages]
+    else:
+        from pdfminer.high_level import extract_text
+        # pdfminer 用换页符分隔各页
+        pages = extract_text(io.BytesIO(data)).split("\f")
+
+    if sum(len(page.strip()) for page in pages) < MIN_PDF_CHARS_PER_PAGE * max(len(pages), 1):
+        return None
+    return [
+        Document(page_content=page, metadata={"page_number": index + 1})
+        for index, page in enumerate(pages)
+        if page.strip()
+    ]
+
+
+def _parse_docx(data: bytes, file_name: str) -> Optional[List[Document]]:
+    """按文档顺序读取段落与表格，表格转为 Markdown"""
+    try:
+        from docx import Document as DocxDocument
+    except ImportError:
+        return None
+
+    document = DocxDocument(io.BytesIO(data))
+    paragraphs_by_element = {p._element: p for p in document.paragraphs}
+    tables_by_element = {t._element: t for t in document.tables}
+    blocks = []
+    for element in document.element.body.iterchildren():
+        if element in paragraphs_by_element:
+            text = paragraphs_by_element[element].text
+            if text.strip():
+                blocks.append(text)
+        elif element in tables_by_element:
+            rows = [[cell.text.strip() for cell in row.cells] for row in tables_by_element[element].rows]
+            if rows:
+                blocks.append(_markdown_table(rows))
+    return [Document(page_content="\n\n".join(blocks))]
+
+
+def _parse_html(data: bytes, file_name: str) -> Optional[List[Document]]:
+    try:
+        import html2text
+    except ImportError:
+        return None
+
+    converter = html2text.HTML2Text()
+    converter.body_width = 0
+    converter.ignore_images = True
+    return [Document(page_content=converter.handle(decode_text(data)))]
+
+
+def _parse_csv(data: bytes, file_name: str) -> List[Document]:
+    text = decode_text(data)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(io.StringIO(text), dialect) if any(cell.strip() for cell in row)]
+    return [Document(page_content=_markdown_table(rows) if rows else "")]
+
+
+def _markdown_table(rows: List[List[str]]) -> str:
+    width = max(len(row) for row in rows)
+    rows = [[cell.replace("|", "\\|").replace("\n", " ") for cell in row] + [""] * (width - len(row)) for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + " --- |" * width]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return "\n".join(lines)
+
+
+def _parse_with_markitdown(data: bytes, file_name: str) -> List[Document]:
+    from markitdown import MarkItDown, StreamInfo
+
+    file_ext = os.path.splitext(file_name)[1].lower()
+    res = MarkItDown().convert_stream(
+        io.BytesIO(data), stream_info=StreamInfo(extension=file_ext, filename=file_name)
+    )
+    return [Document(page_content=res.text_content)]
+
+
+def _parse_with_unstructured(data: bytes, file_name: str) -> List[Document]:
+    """最慢的解析方式，会加载版面分析与 OCR 模型，只用于扫描件等其它解析器无法处理的文件"""
+    from langchain_community.document_loaders.unstructured import UnstructuredFileIOLoader
+
+    return UnstructuredFileIOLoader(io.BytesIO(data), metadata_filename=file_name).load()
+
+
+# 文件扩展名 -> 轻量解析器，返回 None 表示无法处理，交给下一级解析器
+_FAST_PARSERS: Dict[str, Callable[[bytes, str], Optional[List[Document]]]] = {
+    "md": _parse_text,
+    "txt": _parse_text,
+    "pdf": _parse_pdf,
+    "docx": _parse_docx,
+    "html": _parse_html,
+    "htm": _parse_html,
+    "csv": _parse_csv,
+}
+
+SUPPORTED_FILE_TYPES = sorted(set(_FAST_PARSERS) | set(_MARKITDOWN_FILE_TYPES))
+
+
+class ParseCache:
+    """
+    按文件内容哈希缓存解析结果
+
+    同一个文件以不同的分块参数重新分块时不必重新解析。结果压缩后存放在 `cache_dir`，
+    最近使用的结果同时保存在内存中。磁盘占用在写入时累加，只有超过 `max_bytes` 时才扫描目录，
+    删除最久未使用的文件直到低于 `max_bytes` 的 `prune_ratio`，批量导入时不必每次写入都扫描。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = PARSE_CACHE_DIR,
+        max_memory_items: int = 32,
+        max_bytes: int = 512 * 1024 * 1024,
+        prune_ratio: float = 0.9,
+    ):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_bytes = max_bytes
+        self.prune_ratio = prune_ratio
+        self._memory: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._lock = Lock()
+        # 磁盘缓存的大小，第一次写入时扫描一次，之后按写入累加
+        self._disk_bytes: Optional[int] = None
+        self._disk_lock = Lock()
+
+    @staticmethod
+    def key(data: bytes, file_ext: str) -> str:
+        return f"{hashlib.sha256(data).hexdigest()}-{file_ext}-v{PARSER_VERSION}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _remember(self, key: str, records: List[Dict]) -> None:
+        with self._lock:
+            self._memory[key] = records
+            self._memory.move_to_end(key)
+            if len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[List[Document]]:
+        with self._lock:
+            records = self._memory.get(key)
+        if records is None:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    payload = f.read()
+                records = json.loads(decompress(payload[0], payload[1:]))
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable parse cache entry {key}: {e}")
+                return None
+            self._remember(key, records)
+        return [Document(page_content=r["page_content"], metadata=dict(r["metadata"])) for r in records]
+
+    def put(self, key: str, documents: List[Document]) -> None:
+        records = [{"page_content": d.page_content, "metadata": dict(d.metadata)} for d in documents]
+        self._remember(key, records)
+        try:
+            codec_id, payload = compress(json.dumps(records, default=str).encode(), "zlib")
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            content = bytes([codec_id]) + payload
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            self._track(len(content) - replaced)
+        except OSError as e:
+            logger.warning(f"Failed to write parse cache entry {key}: {e}")
+
+    def _track(self, added: int) -> None:
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._disk_bytes += added
+            if self._disk_bytes > self.max_bytes:
+                self._prune()
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """(修改时间, 大小, 路径)，跳过其它进程正在写入的临时文件"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _prune(self) -> None:
+        # 重新扫描，顺带校正其它进程写入造成的偏差
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.prune_ratio
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_bytes = total
+
+
+parse_cache = ParseCache()
+
+
+def parse_document(data: bytes, file_name: str, use_cache: bool = True) -> List[Document]:
+    """
+    解析文件内容，按扩展名选择解析器
+
+    PDF 文本层、docx、html、csv、md/txt 使用轻量解析器，其它 Office 文件使用 MarkItDown，
+    扫描件与其它解析器无法处理的文件才使用 Unstructured。
+
+    Args:
+        data: 文件内容
+        file_name: 文件名，用于判断文件类型
+        use_cache: 是否使用按内容哈希的解析缓存
+
+    Returns:
+        List[Document]: 解析得到的文档，元数据中不含 `source`，由调用方设置
+    """
+    file_ext = os.path.splitext(file_name)[1].lstrip('.').lower()
+    key = ParseCache.key(data, file_ext)
+    if use_cache:
+        cached = parse_cache.get(key)
+        if cached is not None:
+            logger.info(f"Parse cache hit: {file_name}")
+            return cached
+
+    documents = None
+    fast_parser = _FAST_PARSERS.get(file_ext)
+    if fast_parser is not None:
+        try:
+            documents = fast_parser(data, file_name)
+        except Exception as e:
+            logger.warning(f"Fast parser failed on {file_name}, falling back: {e}")
+    if documents is None and file_ext in _MARKITDOWN_FILE_TYPES:
+        logger.info(f"Markitdown supported file type: {file_ext}")
+        documents = _parse_with_markitdown(data, file_name)
+    if documents is None:
+        logger.info(f"Unstructured supported file type: {file_ext}")
+        documents = _parse_with_unstructured(data, file_name)
+
+    if use_cache:
+        parse_cache.put(key, documents)
+    return documents
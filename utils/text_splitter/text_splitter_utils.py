@@ -1,12 +1,9 @@
-from langchain_community.document_loaders.unstructured import UnstructuredFileLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from markitdown import MarkItDown
 from loguru import logger
 
 import streamlit as st
-import os
-import tempfile
+from uuid import uuid4
 # 下载punkt分词器，避免在运行时报错
 import nltk
 try:
@@ -16,7 +13,10 @@ except LookupError:
     nltk.download('punkt_tab')
     nltk.download('averaged_perceptron_tagger_eng')
 from pathlib import Path
-from typing import List, Union, BinaryIO
+from typing import List, Optional, Union, BinaryIO
+
+from utils.text_splitter.parsers import SUPPORTED_FILE_TYPES, parse_document
+from utils.text_splitter.token_chunker import EmbeddingTokenChunker, get_chunk_tokenizer
 
 
 _CHINESE_SEPARATORS = [
@@ -33,91 +33,95 @@ _CHINESE_SEPARATORS = [
     "",
 ]
 
-_MARKITDOWN_SUPPORTED_FILE_TYPES = ['md','txt','docx','doc','pptx','ppt','xlsx','xls','csv']
-_UNSTRUCTURED_SUPPORTED_FILE_TYPES = ['pdf']
-_SUPPORTED_FILE_TYPES = _MARKITDOWN_SUPPORTED_FILE_TYPES + _UNSTRUCTURED_SUPPORTED_FILE_TYPES
+_SUPPORTED_FILE_TYPES = SUPPORTED_FILE_TYPES
+
+
+def create_text_splitter(
+    chunk_size: int = 1000,
+    chunk_overlap: int = 0,
+    embedding_type: Optional[str] = None,
+    embedding_model_name_or_path: Optional[str] = None,
+):
+    '''
+    创建文本分割器
+
+    指定了嵌入模型时按该模型分词器的 token 数分块，分块不会超过模型的输入窗口；
+    否则按字符数使用 RecursiveCharacterTextSplitter。
+    '''
+    if embedding_type is None:
+        return RecursiveCharacterTextSplitter(separators=_CHINESE_SEPARATORS,chunk_size=chunk_size,chunk_overlap=chunk_overlap)
+    return EmbeddingTokenChunker(
+        tokenizer=get_chunk_tokenizer(embedding_type, embedding_model_name_or_path),
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+
+
+def _source_name(file_name: str) -> str:
+    """
+    生成分块的 `source` 元数据：`<文件名>__<随机串><扩展名>`
+
+    与之前临时文件的命名一致，同名文件多次上传时仍可区分，`simplify_filename` 可还原原文件名。
+    """
+    path = Path(file_name)
+    return f"{path.stem}__{uuid4().hex[:8]}{path.suffix}"
+
+
+def load_document(
+    data: Union[bytes, BinaryIO],
+    file_name: str,
+    source: Optional[str] = None,
+) -> List[Document]:
+    '''
+    在内存中解析文件，不写入临时文件
+
+    解析结果按文件内容哈希缓存，修改分块参数后重新分块不会重新解析，见 `parsers.parse_document`。
+
+    Args:
+        data: 文件内容，bytes 或可读的二进制流（如 Streamlit 的 UploadedFile）；
+        file_name: 文件名，用于判断文件类型；
+        source: 写入元数据的 `source`，默认为文件名。
+
+    Returns:
+        List[Document]: 解析得到的文档。
+    '''
+    raw = data if isinstance(data, bytes) else data.read()
+    documents = parse_document(raw, file_name)
+    for document in documents:
+        document.metadata = {**document.metadata, "source": source or file_name}
+    return documents
 
 
 @st.cache_data
 def choose_text_splitter(
     imput_stream: Union[List[BinaryIO],BinaryIO],
     chunk_size: int=1000,
-    chunk_overlap: int=0
+    chunk_overlap: int=0,
+    embedding_type: Optional[str]=None,
+    embedding_model_name_or_path: Optional[str]=None,
 ) -> List[Document]:
     '''
     根据文件类型选择不同的文本分割器
     
     Args:
-        imput_stream: IO对象，单个或多个文件；
+        imput_stream: IO对象，单个或多个文件，文件类型由 `name` 属性的扩展名判断；
         chunk_size: 每个分块的大小，默认为1000；
-        chunk_overlap: 每个分块的重叠部分，默认为0。
+        chunk_overlap: 每个分块的重叠部分，默认为0；
+        embedding_type: 嵌入模型类型，指定时分块大小与重叠按该模型的 token 数计算；
+        embedding_model_name_or_path: 嵌入模型名称或路径。
     '''
-
-    #如果 imput_stream 是多个IO对象
-    if isinstance(imput_stream,list):
-        file_path_list = [i.name for i in imput_stream]
-        splitted_docs = []
-
-        for file in file_path_list:
-            # 根据扩展名判断文件类型
-            file_ext = os.path.splitext(file)[1].lstrip('.')
-            if file_ext in _MARKITDOWN_SUPPORTED_FILE_TYPES:
-                try:
-                    logger.info(f"Markitdown supported file type: {file_ext}")
-                    md = MarkItDown()
-                    res = md.convert(file)
-                    document = Document(page_content=res,metadata={"source":file})
-                    text_splitter = RecursiveCharacterTextSplitter(separators=_CHINESE_SEPARATORS,chunk_size=chunk_size,chunk_overlap=chunk_overlap)
-                    split_docs = text_splitter.split_documents(document)
-                    splitted_docs.extend(split_docs)
-                except Exception as e:
-                    logger.error(f"Markitdown unsupported file type: {file_ext}, error message: {e}")
-                    raise e
-            else:
-                try:
-                    logger.info(f"Unstructured supported file type: {file_ext}")
-                    loader = UnstructuredFileLoader(file)
-                    document = loader.load()
-                    text_splitter = RecursiveCharacterTextSplitter(separators=_CHINESE_SEPARATORS,chunk_size=chunk_size,chunk_overlap=chunk_overlap)
-                    split_docs = text_splitter.split_documents(document)
-                    splitted_docs.extend(split_docs)
-                except Exception as e:
-                    logger.error(f"Unstructured unsupported file type: {file_ext}, error message: {e}")
-                    raise e
-
-        return splitted_docs
-    
-    # 如果 imput_stream 是单个IO对象
-    else:
-        logger.info(f"object, file type: {imput_stream.name}")
-        file_ext = os.path.splitext(imput_stream.name)[1].lstrip('.')
-        splitted_docs = []  # 初始化 splitted_docs 列表
-
-        if file_ext in _MARKITDOWN_SUPPORTED_FILE_TYPES:
-            try:
-                logger.info(f"Markitdown supported file type: {file_ext}")
-                md = MarkItDown()
-                res = md.convert(imput_stream.name)
-                document = [Document(page_content=res.text_content,metadata={"source":imput_stream.name})]
-                text_splitter = RecursiveCharacterTextSplitter(separators=_CHINESE_SEPARATORS,chunk_size=chunk_size,chunk_overlap=chunk_overlap)
-                split_docs = text_splitter.split_documents(document)
-                splitted_docs.extend(split_docs)
-            except Exception as e:
-                logger.error(f"Markitdown unsupported file type: {file_ext}, error message: {e}")
-                raise e
-        else:
-            try:
-                logger.info(f"Unstructured supported file type: {file_ext}")
-                loader = UnstructuredFileLoader(imput_stream.name)
-                document = loader.load()
-                text_splitter = RecursiveCharacterTextSplitter(separators=_CHINESE_SEPARATORS,chunk_size=chunk_size,chunk_overlap=chunk_overlap)
-                split_docs = text_splitter.split_documents(document)
-                splitted_docs.extend(split_docs)
-            except Exception as e:
-                logger.error(f"Unstructured unsupported file type: {file_ext}, error message: {e}")
-                raise e
-
-        return splitted_docs
+    text_splitter = create_text_splitter(chunk_size, chunk_overlap, embedding_type, embedding_model_name_or_path)
+    streams = imput_stream if isinstance(imput_stream, list) else [imput_stream]
+
+    splitted_docs = []
+    for stream in streams:
+        try:
+            documents = load_document(stream, stream.name)
+        except Exception as e:
+            logger.error(f"Failed to parse file: {stream.name}, error message: {e}")
+            raise e
+        splitted_docs.extend(text_splitter.split_documents(documents))
+    return splitted_docs
     
 
 def simplify_filename(original_name):
@@ -145,34 +149,30 @@ def text_split_execute(
     file: BinaryIO,
     split_chunk_size: int = 1000,
     split_overlap: int = 0,
+    embedding_type: Optional[str] = None,
+    embedding_model_name_or_path: Optional[str] = None,
 ) -> List[Document]:
-    # 获取文件类型，以在创建临时文件时使用正确的后缀
-    file_suffix = Path(file.name).suffix
-    # 获取文件名，不包含后缀
-    file_name_without_suffix = Path(file.name).stem
-
-    # delete 设置为 False,才能在解除绑定后使用 temp_file 进行分割
-    with tempfile.NamedTemporaryFile(prefix=file_name_without_suffix + "__",suffix=file_suffix,delete=False) as temp_file:
-        # stringio = StringIO(file.getvalue().decode())
-        temp_file.write(file.getvalue())
-        temp_file.seek(0)
-        # st.write(temp_file.name)
-        # st.write("File contents:")
-        # st.write(temp_file.read())
-    
-        splitted_docs = choose_text_splitter(imput_stream=temp_file,chunk_size=split_chunk_size,chunk_overlap=split_overlap)
-    # 手动删除临时文件
-    os.remove(temp_file.name)
-    # st.write(splitted_docs[0].page_content)
-    # st.write(splitted_docs)
+    '''
+    解析上传的文件并分块，文件内容直接在内存中传给解析器
 
-    return splitted_docs
+    Args:
+        file: 上传的文件；
+        split_chunk_size: 每个分块的大小，默认为1000；
+        split_overlap: 每个分块的重叠部分，默认为0；
+        embedding_type: 嵌入模型类型，指定时按该模型的 token 数分块；
+        embedding_model_name_or_path: 嵌入模型名称或路径。
+    '''
+    documents = load_document(file.getvalue(), file.name, source=_source_name(file.name))
+    text_splitter = create_text_splitter(split_chunk_size, split_overlap, embedding_type, embedding_model_name_or_path)
+    return text_splitter.split_documents(documents)
 
 @st.cache_data
 def url_text_split_execute(
     url_content: dict,
     split_chunk_size: int = 1000,
     split_overlap: int = 0,
+    embedding_type: Optional[str] = None,
+    embedding_model_name_or_path: Optional[str] = None,
 ) -> List[Document]:
     """
     处理JinaReader返回的网页内容
@@ -180,21 +180,51 @@ def url_text_split_execute(
     Args:
         url_content: JinaReader返回的网页内容，字典类型，只处理`content`字段；
         split_chunk_size: 每个分块的大小，默认为1000；
-        split_overlap: 每个分块的重叠部分，默认为0。
+        split_overlap: 每个分块的重叠部分，默认为0；
+        embedding_type: 嵌入模型类型，指定时按该模型的 token 数分块；
+        embedding_model_name_or_path: 嵌入模型名称或路径。
     
     Returns:
         splitted_docs: 分割后的文档列表。
     """
-    # 默认文件类型为Markdown
-    file_suffix = ".md"
-    file_name_without_suffix = url_content["content"].split("\n\n")[0]
-
-    with tempfile.NamedTemporaryFile(prefix=file_name_without_suffix + "__",suffix=file_suffix,delete=False) as temp_file:
-        temp_file.write(url_content["content"].encode("utf-8"))
-        temp_file.seek(0)
-
-        splitted_docs = choose_text_splitter(imput_stream=temp_file,chunk_size=split_chunk_size,chunk_overlap=split_overlap)
-    # 手动删除临时文件
-    os.remove(temp_file.name)
+    title = url_content["content"].split("\n\n")[0]
+    return split_web_page(
+        url_content["content"],
+        title,
+        url=None,
+        split_chunk_size=split_chunk_size,
+        split_overlap=split_overlap,
+        embedding_type=embedding_type,
+        embedding_model_name_or_path=embedding_model_name_or_path,
+    )
+
+
+def split_web_page(
+    content: str,
+    title: str,
+    url: Optional[str] = None,
+    split_chunk_size: int = 1000,
+    split_overlap: int = 0,
+    embedding_type: Optional[str] = None,
+    embedding_model_name_or_path: Optional[str] = None,
+) -> List[Document]:
+    """
+    分块一个网页的 Markdown 内容，不经过 Streamlit 缓存，供网站抓取时逐页调用
 
-    return splitted_docs
\ No newline at end of file
+    Args:
+        content: 网页的 Markdown 内容
+        title: 网页标题，作为来源名称
+        url: 网页地址，保存在分块的元数据中
+        split_chunk_size: 每个分块的大小，默认为1000；
+        split_overlap: 每个分块的重叠部分，默认为0；
+        embedding_type: 嵌入模型类型，指定时按该模型的 token 数分块；
+        embedding_model_name_or_path: 嵌入模型名称或路径。
+    """
+    # 网页内容已是 Markdown 文本，直接分块；标题作为来源名称
+    title = title.replace("/", "_").replace("\\", "_")
+    metadata = {"source": _source_name(f"{title}.md")}
+    if url:
+        metadata["url"] = url
+    document = Document(page_content=content, metadata=metadata)
+    text_splitter = create_text_splitter(split_chunk_size, split_overlap, embedding_type, embedding_model_name_or_path)
+    return text_splitter.split_documents([document])
@@ -0,0 +1,224 @@
+import os
+import re
+import json
+from functools import lru_cache
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_text_splitters import TextSplitter
+from loguru import logger
+
+from modules.chat.transform import get_encoding
+
+
+# 在句末标点、分号与换行之后断句，英文句点只在其后为空白时断句，避免拆开小数与缩写
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[。！？!?；;\n])(?!\n)|(?<=\.)(?=\s)")
+# 分块前批量计数的句子数量
+TOKENIZE_BATCH_SIZE = 1024
+
+
+class ChunkTokenizer:
+    """
+    分块时使用的长度度量，默认按字符计数
+
+    子类使用嵌入模型自身的分词器计数，`max_tokens` 为模型单次输入的上限（不含特殊 token），未知时为 None。
+    """
+
+    name = "characters"
+    max_tokens: Optional[int] = None
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        return [len(text) for text in texts]
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        """把超过 `max_tokens` 的文本按 token 边界切开"""
+        return [text[i:i + max_tokens] for i in range(0, len(text), max_tokens)]
+
+
+class HuggingFaceChunkTokenizer(ChunkTokenizer):
+    """使用本地 Sentence Transformer 模型目录中的（fast）分词器"""
+
+    def __init__(self, model_path: str):
+        from transformers import AutoTokenizer
+
+        self.name = model_path
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.max_tokens = self._max_seq_length(model_path)
+        if self.max_tokens is not None:
+            # [CLS]、[SEP] 等特殊 token 也占用模型的输入窗口
+            self.max_tokens -= self.tokenizer.num_special_tokens_to_add()
+
+    def _max_seq_length(self, model_path: str) -> Optional[int]:
+        config_path = os.path.join(model_path, "sentence_bert_config.json")
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                max_seq_length = json.load(f).get("max_seq_length")
+            if max_seq_length:
+                return int(max_seq_length)
+        # 未设置时 transformers 会返回一个极大的哨兵值
+        model_max_length = getattr(self.tokenizer, "model_max_length", None)
+        if model_max_length and model_max_length < 1_000_000:
+            return int(model_max_length)
+        return None
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        encoded = self.tokenizer(
+            list(texts),
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        if not getattr(self.tokenizer, "is_fast", False):
+            return super().split(text, max_tokens)
+        offsets = self.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True
+        )["offset_mapping"]
+        cuts = [offsets[i][0] for i in range(max_tokens, len(offsets), max_tokens)]
+        return _cut(text, cuts)
+
+
+class TiktokenChunkTokenizer(ChunkTokenizer):
+    """OpenAI 嵌入模型使用的 tiktoken 编码"""
+
+    # OpenAI 嵌入模型单次输入的 token 上限
+    MAX_TOKENS = 8191
+
+    def __init__(self, encoding: Any):
+        self.name = encoding.name
+        self.encoding = encoding
+        self.max_tokens = self.MAX_TOKENS
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(list(texts))]
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        tokens = self.encoding.encode_ordinary(text)
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+        cuts = [offsets[i] for i in range(max_tokens, len(offsets), max_tokens)]
+        return _cut(text, cuts)
+
+
+def _cut(text: str, cuts: Iterable[int]) -> List[str]:
+    pieces = []
+    start = 0
+    for cut in cuts:
+        if cut > start:
+            pieces.append(text[start:cut])
+            start = cut
+    pieces.append(text[start:])
+    return pieces
+
+
+@lru_cache(maxsize=8)
+def get_chunk_tokenizer(
+    embedding_type: Optional[str] = None,
+    embedding_model_name_or_path: Optional[str] = None,
+) -> ChunkTokenizer:
+    """
+    获取嵌入模型对应的分词器，按模型缓存
+
+    Args:
+        embedding_type: 嵌入模型类型，"sentence_transformer"、"openai" 或 "aoai"
+        embedding_model_name_or_path: 模型名称，Sentence Transformer 模型为 embeddings 目录下的相对路径
+
+    Returns:
+        ChunkTokenizer: 无法加载分词器时退回按字符计数
+    """
+    try:
+        if embedding_type == "sentence_transformer" and embedding_model_name_or_path:
+            model_path = embedding_model_name_or_path
+            if not os.path.isabs(model_path) and not model_path.startswith("embeddings"):
+                model_path = os.path.join("embeddings", model_path)
+            return HuggingFaceChunkTokenizer(model_path)
+        if embedding_type in ("openai", "aoai"):
+            encoding = get_encoding(embedding_model_name_or_path)
+            if encoding is not None:
+                return TiktokenChunkTokenizer(encoding)
+    except Exception as e:
+        logger.warning(f"Failed to load tokenizer of {embedding_model_name_or_path}, chunk sizes will be measured in characters: {e}")
+    return ChunkTokenizer()
+
+
+def split_sentences(text: str) -> List[str]:
+    """按句子切分文本，句子保留结尾的标点与空白，拼接后与原文相同"""
+    return [sentence for sentence in _SENTENCE_BOUNDARY.split(text) if sentence]
+
+
+class EmbeddingTokenChunker(TextSplitter):
+    """
+    按嵌入模型的 token 数分块
+
+    - 文本先切分为句子，每批 `TOKENIZE_BATCH_SIZE` 个句子一次性计数，再按顺序装入不超过 `chunk_size` 个 token 的分块
+    - 分块之间按 token 数重叠：下一个分块从上一个分块末尾不超过 `chunk_overlap` 个 token 的句子开始
+    - 超过 `chunk_size` 的长句在 token 边界处切开
+    - `chunk_size` 不会超过模型的输入窗口，避免分块在嵌入时被截断
+
+    分块的 token 数按句子的 token 数相加估计，句子拼接处的分词差异可以忽略。
+    """
+
+    def __init__(
+        self,
+        tokenizer: Optional[ChunkTokenizer] = None,
+        chunk_size: int = 512,
+        chunk_overlap: int = 0,
+        **kwargs: Any,
+    ):
+        """
+        Args:
+            tokenizer: 长度度量，默认按字符计数
+            chunk_size: 每个分块最多的 token 数
+            chunk_overlap: 相邻分块重叠的 token 数
+        """
+        tokenizer = tokenizer or ChunkTokenizer()
+        if tokenizer.max_tokens is not None and chunk_size > tokenizer.max_tokens:
+            logger.info(f"Chunk size {chunk_size} exceeds the input window of {tokenizer.name}, using {tokenizer.max_tokens}")
+            chunk_size = tokenizer.max_tokens
+        chunk_overlap = min(chunk_overlap, chunk_size // 2)
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=tokenizer.count,
+            **kwargs,
+        )
+        self.tokenizer = tokenizer
+
+    def _sentences_with_counts(self, text: str) -> Iterator[Tuple[str, int]]:
+        sentences = split_sentences(text)
+        for start in range(0, len(sentences), TOKENIZE_BATCH_SIZE):
+            batch = sentences[start:start + TOKENIZE_BATCH_SIZE]
+            for sentence, count in zip(batch, self.tokenizer.count_batch(batch)):
+                if count <= self._chunk_size:
+                    yield sentence, count
+                    continue
+                pieces = self.tokenizer.split(sentence, self._chunk_size)
+                yield from zip(pieces, self.tokenizer.count_batch(pieces))
+
+    def split_text(self, text: str) -> List[str]:
+        chunks = []
+        window: List[Tuple[str, int]] = []
+        window_tokens = 0
+        for sentence, count in self._sentences_with_counts(text):
+            if window and window_tokens + count > self._chunk_size:
+                chunks.append("".join(s for s, _ in window))
+                # 从末尾保留不超过 chunk_overlap 的句子作为下一个分块的开头
+                overlap: List[Tuple[str, int]] = []
+                overlap_tokens = 0
+                for item in reversed(window[1:]):
+                    if overlap_tokens + item[1] > self._chunk_overlap or overlap_tokens + item[1] + count > self._chunk_size:
+                        break
+                    overlap.insert(0, item)
+                    overlap_tokens += item[1]
+                window, window_tokens = overlap, overlap_tokens
+            window.append((sentence, count))
+            window_tokens += count
+        if window:
+            chunks.append("".join(s for s, _ in window))
+
+        if getattr(self, "_strip_whitespace", True):
+            chunks = [chunk.strip() for chunk in chunks]
+        return [chunk for chunk in chunks if chunk]
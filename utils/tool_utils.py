@@ -3,58 +3,245 @@ import random
 import inspect
 from loguru import logger
 from copy import deepcopy
-from typing import Any, Dict, List, Union, Optional, Callable
+from functools import lru_cache
+from typing import (
+    Any, Dict, List, Union, Optional, Callable, Iterable, Literal, Tuple, Type,
+    get_args, get_origin,
+)
+from pydantic import BaseModel, Field, ValidationError, create_model
 from openai import OpenAI, AzureOpenAI, Stream
 from openai.types.chat.chat_completion import ChatCompletion
 
 from config.constants.prompts import TOOL_USE_PROMPT
 
 
-def function_to_json(func: Callable[..., Any]) -> str:
-    # 获取函数的签名
-    sig = inspect.signature(func)
-    # 获取函数的文档字符串
-    doc = func.__doc__
-    
-    # 解析文档字符串以获取参数描述
+_JSON_SCHEMA_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+}
+
+
+def _parse_docstring(doc: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """
+    解析文档字符串，返回工具描述与参数描述
+
+    :param doc: 函数的文档字符串
+    :return: (去除 `:param` 行后的描述, 参数名到描述的映射)
+    """
+    if not doc:
+        return "", {}
+
+    description_lines = []
     param_descriptions = {}
-    if doc:
-        lines = doc.strip().split('\n')
-        for line in lines:
-            line = line.strip()
-            if line.startswith(':param'):
-                parts = line.split(':param ')[1].split(':')
-                if len(parts) > 1:
-                    param_name = parts[0].strip()
-                    description = parts[1].strip()
-                    param_descriptions[param_name] = description
-    
-    # 构建参数列表
+    for line in inspect.cleandoc(doc).split('\n'):
+        stripped = line.strip()
+        if stripped.startswith(':param'):
+            parts = stripped.split(':param ', 1)[1].split(':', 1)
+            if len(parts) > 1:
+                param_descriptions[parts[0].strip()] = parts[1].strip()
+        else:
+            description_lines.append(line)
+    return '\n'.join(description_lines).strip(), param_descriptions
+
+
+def _annotation_to_json_schema(annotation: Any) -> Dict[str, Any]:
+    """将 Python 类型注解转换为 JSON schema 片段"""
+    if annotation is inspect.Parameter.empty or annotation is Any:
+        return {"type": "string"}
+
+    origin = get_origin(annotation)
+    if origin is Literal:
+        values = list(get_args(annotation))
+        return {"type": _JSON_SCHEMA_TYPES.get(type(values[0]), "string"), "enum": values}
+    if origin is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return _annotation_to_json_schema(args[0]) if len(args) == 1 else {}
+    if origin in (list, List):
+        item_args = get_args(annotation)
+        schema = {"type": "array"}
+        if item_args:
+            schema["items"] = _annotation_to_json_schema(item_args[0])
+        return schema
+    if origin in (dict, Dict):
+        return {"type": "object"}
+    return {"type": _JSON_SCHEMA_TYPES.get(annotation, "string")}
+
+
+def _build_args_model(
+    name: str,
+    func: Callable[..., Any],
+    param_descriptions: Dict[str, str],
+) -> Type[BaseModel]:
+    """根据函数签名构建用于校验参数的 pydantic 模型"""
+    fields = {}
+    for param_name, param in inspect.signature(func).parameters.items():
+        annotation = Any if param.annotation is inspect.Parameter.empty else param.annotation
+        default = ... if param.default is inspect.Parameter.empty else param.default
+        fields[param_name] = (
+            annotation,
+            Field(default, description=param_descriptions.get(param_name, "")),
+        )
+    return create_model(f"{name}_arguments", **fields)
+
+
+def _build_tool_schema(
+    name: str,
+    description: str,
+    func: Callable[..., Any],
+    param_descriptions: Dict[str, str],
+) -> Dict[str, Any]:
+    """根据函数签名构建 OpenAI tool schema"""
     properties = {}
-    for name, param in sig.parameters.items():
-        properties[name] = {
-            'type': param.annotation.__name__ if hasattr(param.annotation, '__name__') else str(param.annotation),
-            'description': param_descriptions.get(name, '')  # 使用解析的描述或空字符串
+    required = []
+    for param_name, param in inspect.signature(func).parameters.items():
+        properties[param_name] = {
+            **_annotation_to_json_schema(param.annotation),
+            'description': param_descriptions.get(param_name, ''),
         }
-    
-    # 构建JSON结构
-    function_json = {
+        if param.default is inspect.Parameter.empty:
+            required.append(param_name)
+
+    return {
         'type': 'function',
         'function': {
-            'name': func.__name__,
-            'description': doc.strip() if doc else '',
+            'name': name,
+            'description': description,
             'parameters': {
                 'type': 'object',
                 'properties': properties,
-                'required': list(sig.parameters.keys())
+                'required': required
             }
         }
     }
 
-    # python中字符串为str， json中字符串为string，所以需要将"type": "str"改为"type": "string"
-    function_json['function']['parameters']['properties'] = {k: {**v, 'type': 'string' if v['type'] == 'str' else v['type']} for k, v in function_json['function']['parameters']['properties'].items()}
 
-    return json.dumps(function_json, indent=4)
+@lru_cache(maxsize=None)
+def function_to_json(func: Callable[..., Any]) -> str:
+    """
+    将函数转换为 OpenAI tool schema 的 JSON 字符串，结果按函数缓存
+
+    :param func: 工具函数
+    :return: JSON 字符串
+    """
+    description, param_descriptions = _parse_docstring(func.__doc__)
+    return json.dumps(
+        _build_tool_schema(func.__name__, description, func, param_descriptions),
+        indent=4
+    )
+
+
+class ToolArgumentsError(ValueError):
+    """工具调用参数校验失败时抛出"""
+
+
+class ToolSpec:
+    """
+    预编译的工具描述：在注册时一次性解析签名与文档字符串，
+    生成参数校验模型与 OpenAI tool schema，之后每轮对话直接复用。
+    """
+
+    def __init__(self, func: Callable[..., Any], name: Optional[str] = None):
+        self.func = func
+        self.name = name or func.__name__
+        self.description, param_descriptions = _parse_docstring(func.__doc__)
+        self.args_model = _build_args_model(self.name, func, param_descriptions)
+        self.schema = _build_tool_schema(self.name, self.description, func, param_descriptions)
+
+    def validate(self, arguments: Union[str, Dict[str, Any], None]) -> Dict[str, Any]:
+        """
+        校验并转换模型给出的工具参数
+
+        :param arguments: JSON 字符串或字典形式的参数
+        :return: 校验、类型转换后的参数字典
+        :raises ToolArgumentsError: 参数不合法时抛出
+        """
+        try:
+            if isinstance(arguments, str):
+                model = self.args_model.model_validate_json(arguments or "{}")
+            else:
+                model = self.args_model.model_validate(arguments or {})
+        except ValidationError as e:
+            raise ToolArgumentsError(
+                f"Invalid arguments for tool `{self.name}`: {e.errors(include_url=False)}"
+            ) from e
+        return model.model_dump()
+
+    def __call__(self, *args, **kwargs) -> Any:
+        if args:
+            return self.func(*args, **kwargs)
+        return self.func(**self.validate(kwargs))
+
+
+class ToolRegistry:
+    """
+    工具注册表，通过装饰器注册工具函数，schema 与参数模型只在注册时构建一次
+    """
+
+    def __init__(self):
+        self._tools: Dict[str, ToolSpec] = {}
+        self._selection_cache: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+
+    def register(self, func: Optional[Callable[..., Any]] = None, *, name: Optional[str] = None):
+        """
+        注册工具的装饰器，可直接使用 `@registry.register` 或 `@registry.register(name=...)`
+        """
+        def decorator(f: Callable[..., Any]) -> Callable[..., Any]:
+            spec = ToolSpec(f, name=name)
+            self._tools[spec.name] = spec
+            self._selection_cache.clear()
+            return f
+
+        if func is not None:
+            return decorator(func)
+        return decorator
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def __getitem__(self, name: str) -> ToolSpec:
+        return self._tools[name]
+
+    def __iter__(self):
+        return iter(self._tools.values())
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def names(self) -> List[str]:
+        return list(self._tools.keys())
+
+    def schemas(self, selected_tools: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        获取工具的 OpenAI tool schema 列表，按选择结果缓存
+
+        :param selected_tools: 被选中的工具名称，为 None 时返回全部工具
+        :return: 工具 schema 列表
+        """
+        if selected_tools is None:
+            key = tuple(self._tools.keys())
+        else:
+            key = tuple(sorted(set(selected_tools)))
+        if key not in self._selection_cache:
+            self._selection_cache[key] = [
+                self._tools[name].schema for name in self._tools if name in key
+            ]
+        return self._selection_cache[key]
+
+    def function_map(self, selected_tools: Optional[Iterable[str]] = None) -> Dict[str, ToolSpec]:
+        """
+        获取工具名称到 ToolSpec 的映射，调用 ToolSpec 时会先校验参数
+
+        :param selected_tools: 被选中的工具名称，为 None 时返回全部工具
+        :return: 工具名称到 ToolSpec 的映射
+        """
+        if selected_tools is None:
+            return dict(self._tools)
+        selected = set(selected_tools)
+        return {name: spec for name, spec in self._tools.items() if name in selected}
 
 
 class ToolsParameterOutputParser:
@@ -103,7 +290,15 @@ class ToolsParameterOutputParser:
         params = [param.function for param in output.choices[0].message.tool_calls]
         tool_call_ids = [param.id for param in output.choices[0].message.tool_calls]
         
-        return [{'name': param.name, 'parameters': json.loads(param.arguments), 'tool_call_id': tool_call_ids[params.index(param)]} for param in params]
+        return [{'name': param.name, 'parameters': self._loads_arguments(param.arguments), 'tool_call_id': tool_call_id} for param, tool_call_id in zip(params, tool_call_ids)]
+
+    @staticmethod
+    def _loads_arguments(arguments: str) -> Union[Dict[str, Any], str]:
+        """解析参数 JSON，无法解析时保留原始字符串，交由 ToolSpec 校验并返回错误"""
+        try:
+            return json.loads(arguments)
+        except json.JSONDecodeError:
+            return arguments
 
 
 def create_tools_call_completion(
@@ -143,7 +338,7 @@ def create_tools_call_completion(
             temperature = config_list[0]['params'].get('temperature', 0)
             top_p = config_list[0]['params'].get('top_p', 1)
             stream = config_list[0]['params'].get('stream', False)
-            logger.info(f"Using config_list: {config_list}")
+            logger.info("Using model {} at {}", model, base_url)
         except Exception as e:
             logger.error(f"Error parsing config_list: {e}")
             raise e
@@ -187,14 +382,23 @@ def create_tools_call_completion(
         messages.append(response.choices[0].message.dict(exclude_unset=True))
 
         # 第二步， 根据工具调用参数，本地运行工具，并返回结果
-        function_results = [function_map[param['name']](**param['parameters']) for param in parsed_params]
-        # 添加所有工具调用结果到消息列表
-        for result in function_results:
+        # 工具参数先经过预编译的参数模型校验和类型转换，不合法时把错误作为工具结果返回给模型
+        for param in parsed_params:
+            tool = function_map[param['name']]
+            try:
+                if isinstance(tool, ToolSpec):
+                    result = tool.func(**tool.validate(param['parameters']))
+                else:
+                    result = tool(**param['parameters'])
+            except ToolArgumentsError as e:
+                logger.warning(str(e))
+                result = f"Error: {e}"
+            # 添加工具调用结果到消息列表
             messages.append({
                 "role":"tool",
-                "name": parsed_params[function_results.index(result)]['name'],
+                "name": param['name'],
                 "content":result,
-                "tool_call_id":parsed_params[function_results.index(result)]['tool_call_id']
+                "tool_call_id":param['tool_call_id']
             })
         
         # 第三步， 调用模型生成最终的回复